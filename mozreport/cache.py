@@ -0,0 +1,201 @@
+from collections import Counter
+from contextlib import closing, contextmanager
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from . import databricks
+from .delta import download
+from .util import get_data_dir
+
+DEFAULT_MAX_MB = 10 * 1024
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        digest TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        last_used REAL NOT NULL
+    )
+"""
+
+# ioctl that asks Linux filesystems like btrfs and XFS for a copy-on-write clone
+FICLONE = 0x40049409
+
+
+def replace_with_copy(source: Path, destination: Path) -> None:
+    """Replaces destination with a copy of source that shares its storage if possible.
+
+    Tries a reflink, which shares blocks but is an independent file, then a
+    hard link, then a plain copy. The destination is replaced atomically, so
+    a file that was hard-linked to something else is never written through.
+    """
+    destination = Path(destination)
+    fd, temp = tempfile.mkstemp(dir=str(destination.parent), prefix=f".{destination.name}.")
+    os.close(fd)
+    temp = Path(temp)
+    try:
+        try:
+            import fcntl
+            with open(source, "rb") as src, open(temp, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            # Reflinked files are independent, so they can be writable
+            os.chmod(temp, 0o644)
+        except (ImportError, OSError):
+            temp.unlink()
+            try:
+                os.link(source, temp)
+            except OSError:
+                shutil.copyfile(source, temp)
+                os.chmod(temp, 0o644)
+        os.replace(temp, destination)
+    except BaseException:
+        if temp.exists():
+            temp.unlink()
+        raise
+
+
+def write_file(contents: bytes, destination: Path) -> None:
+    """Replaces destination with a new file holding contents."""
+    fd, temp = tempfile.mkstemp(dir=str(destination.parent), prefix=f".{destination.name}.")
+    with os.fdopen(fd, "wb") as f:
+        f.write(contents)
+    os.replace(temp, destination)
+
+
+class ResultCache:
+    """A cache of downloaded result files, shared by every experiment directory.
+
+    Files are stored once per distinct content, under their SHA-256, and
+    looked up by a key made of the workspace, remote path, size and
+    modification time, so a file that changed on DBFS is downloaded again.
+    Cached files are read-only, and are hard-linked into experiment
+    directories where the filesystem can't reflink them, so don't modify a
+    fetched result in place. When the cache outgrows max_bytes, the least
+    recently used files are deleted; experiment directories keep their links.
+    Files that threads sharing this cache are still fetching aren't evicted.
+    """
+
+    def __init__(self, root: Optional[Path] = None, max_bytes: int = DEFAULT_MAX_MB << 20) -> None:
+        self.root = root or get_data_dir()/"results"
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._in_flight = Counter()
+
+    @contextmanager
+    def _pin(self, digest: str):
+        """Keeps evict() from deleting the file with this digest until the block exits."""
+        with self._lock:
+            self._in_flight[digest] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight[digest] -= 1
+                if not self._in_flight[digest]:
+                    del self._in_flight[digest]
+
+    @property
+    def objects(self) -> Path:
+        return self.root/"objects"
+
+    def _connect(self) -> sqlite3.Connection:
+        self.objects.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.root/"index.sqlite3"), timeout=30)
+        conn.execute(SCHEMA)
+        return conn
+
+    @staticmethod
+    def key(host: str, remote_path: str, status: dict) -> str:
+        identity = [host, remote_path, status.get("file_size"), status.get("modification_time")]
+        return hashlib.sha256(json.dumps(identity).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Path]:
+        """The cached file for key, if there is one, marking it as recently used."""
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT digest FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            path = self.objects/row[0]
+            if not path.exists():
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return path
+
+    def put(self, key: str, contents: bytes, digest: Optional[str] = None) -> Path:
+        digest = digest or hashlib.sha256(contents).hexdigest()
+        path = self.objects/digest
+        if not path.exists():
+            self.objects.mkdir(parents=True, exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=str(self.objects), prefix=".download.")
+            with os.fdopen(fd, "wb") as f:
+                f.write(contents)
+            os.chmod(temp, 0o444)
+            os.replace(temp, path)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, digest, len(contents), time.time()),
+            )
+        self.evict(keep=digest)
+        return path
+
+    def size(self) -> int:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT SUM(size) FROM (SELECT MAX(size) AS size FROM entries GROUP BY digest)"
+            ).fetchone()
+        return row[0] or 0
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Deletes the least recently used files until the cache fits in max_bytes."""
+        with closing(self._connect()) as conn, conn:
+            digests = conn.execute(
+                "SELECT digest, MAX(size), MAX(last_used) FROM entries "
+                "GROUP BY digest ORDER BY MAX(last_used)"
+            ).fetchall()
+            total = sum(size for _, size, _ in digests)
+            with self._lock:
+                pinned = set(self._in_flight)
+            for digest, size, _ in digests:
+                if total <= self.max_bytes:
+                    break
+                if digest == keep or digest in pinned:
+                    continue
+                conn.execute("DELETE FROM entries WHERE digest = ?", (digest,))
+                path = self.objects/digest
+                if path.exists():
+                    path.unlink()
+                total -= size
+
+    def fetch(self, client: databricks.Client, remote_path: str, destination: Path) -> bool:
+        """Puts the file at remote_path in destination, downloading it only if necessary.
+
+        Returns whether it came from the cache.
+        """
+        key = self.key(client.config.host, remote_path, client.get_status(remote_path))
+        cached = self.get(key)
+        if cached is not None:
+            try:
+                replace_with_copy(cached, destination)
+                return True
+            except FileNotFoundError:
+                pass  # evicted by another process in the meantime
+        # The previous copy at destination, if any, saves downloading unchanged blocks
+        contents = download(client, remote_path, destination)
+        digest = hashlib.sha256(contents).hexdigest()
+        with self._pin(digest):
+            try:
+                replace_with_copy(self.put(key, contents, digest), destination)
+            except FileNotFoundError:
+                # Evicted by another process in the meantime; the bytes are still here
+                write_file(contents, destination)
+        return False
@@ -4,22 +4,32 @@ import os
 from pathlib import Path
 import sys
 import time
-from typing import Optional, Union
+from typing import List, Optional, Union
 import uuid
 
 import attr
-import cattr
 import click
-from halo import Halo
-import toml
 
+from .cache import DEFAULT_MAX_MB, ResultCache
 from .databricks import DatabricksConfig, Client
-from .experiment import ExperimentConfig, generate_etl_script, submit_etl_script
+from .experiment import (
+    ExperimentConfig, fetch_result_file, fetch_shards, generate_etl_script, submit_etl_batch,
+    submit_etl_script,
+)
+from .runs import RunTracker
+from .sync import delete_all, stale_directories, sync_down, sync_up
 from .template import Template
 from .util import get_data_dir
 
+# cattr, halo, requests and toml are comparatively slow to import,
+# so they're imported where they're used to keep `mozreport --help` fast.
+
+
+def Spinner(**kwargs):
+    from halo import Halo
+    return Halo(enabled="MOZREPORT_TESTING" not in os.environ, **kwargs)
+
 
-Spinner = partial(Halo, enabled="MOZREPORT_TESTING" not in os.environ)
 Pipeline = Enum("Pipeline", "always never prompt")
 
 
@@ -43,12 +53,24 @@ cli.__doc__ = f"""
 
     * `mozreport new` to declare a new experiment and generate an analysis script
 
-    * `mozreport submit` to run an analysis script on Databricks
+    * `mozreport submit` to run an analysis script on Databricks,
+    or `mozreport submit-batch` to analyze several experiments in one job
+
+    * `mozreport status` and `mozreport wait` to follow runs submitted with --no-wait
 
     * `mozreport fetch` to download the result
 
+    * `mozreport gc` now and then to delete old working directories from DBFS
+
     * `mozreport report` to set up a report template
 
+    * `mozreport build` to render an R Markdown report
+
+    * `mozreport query` to look at the results without leaving the shell,
+    or `mozreport summarize` to describe large per-user tables in bounded memory
+
+    * `mozreport diff` to see what changed between two fetched results
+
     \b
     The local configuration directory is {get_data_dir()}.
 """
@@ -65,15 +87,20 @@ class CliConfig:
     default_template: str = attr.ib()
     databricks: DatabricksConfig = attr.ib()
     version: str = attr.ib(default="v1")
+    # Size cap of the local cache of fetched results, shared by all experiments; 0 disables it
+    result_cache_mb: int = attr.ib(default=DEFAULT_MAX_MB)
 
-    valid_templates = [t.name for t in Template.find_all()]
+    @staticmethod
+    def valid_templates() -> List[str]:
+        return [t.name for t in Template.find_all()]
 
     @default_template.validator
     def validate_default_template(self, attribute, value) -> None:
-        if value not in self.valid_templates:
+        valid_templates = self.valid_templates()
+        if value not in valid_templates:
             raise ValueError(
                 "Invalid template; choices are: %s" %
-                ", ".join(self.valid_templates))
+                ", ".join(valid_templates))
 
     @staticmethod
     def _default_config_path():
@@ -85,12 +112,16 @@ class CliConfig:
 
         Can raise FileNotFoundError.
         """
+        import cattr
+        import toml
         config_path = config_path or cls._default_config_path()
         with open(config_path, "r") as f:
             blob = toml.load(f)
         return cattr.structure(blob, cls)
 
     def save(self, config_path: Optional[Path] = None):
+        import cattr
+        import toml
         config_path = config_path or self._default_config_path()
         d = cattr.unstructure(self)
         config_path.parent.mkdir(parents=True, exist_ok=True)
@@ -99,12 +130,13 @@ class CliConfig:
 
 
 def build_cli_config(defaults: Optional[Union[dict, CliConfig]] = None) -> CliConfig:
+    import cattr
     if defaults is None:
         defaults = {}
     elif isinstance(defaults, CliConfig):
         defaults = cattr.unstructure(defaults)
 
-    defaults.setdefault("default_template", CliConfig.valid_templates[0])
+    defaults.setdefault("default_template", CliConfig.valid_templates()[0])
     defaults.setdefault("databricks", {})
     defaults["databricks"].setdefault("host", "https://dbc-caf9527b-e073.cloud.databricks.com")
     defaults["databricks"].setdefault("token", None)
@@ -134,14 +166,16 @@ def build_cli_config(defaults: Optional[Union[dict, CliConfig]] = None) -> CliCo
 
 
 def build_experiment_config(defaults: Optional[Union[dict, ExperimentConfig]]) -> ExperimentConfig:
+    import cattr
     if defaults is None:
         defaults = {}
     elif isinstance(defaults, ExperimentConfig):
         defaults = cattr.unstructure(defaults)
 
-    args = {
-        "uuid": defaults.get("uuid", uuid.uuid4())
-    }
+    # Everything but the slug is kept, so re-running `new` after editing
+    # mozreport.toml renders the script from the edited configuration
+    args = dict(defaults)
+    args["uuid"] = defaults.get("uuid", uuid.uuid4())
 
     args["slug"] = click.prompt(
         "Experiment slug",
@@ -164,6 +198,12 @@ def get_cli_config_or_die() -> CliConfig:
         sys.exit(1)
 
 
+def result_cache(config: CliConfig) -> Optional[ResultCache]:
+    if config.result_cache_mb <= 0:
+        return None
+    return ResultCache(max_bytes=config.result_cache_mb << 20)
+
+
 def get_experiment_config_or_die() -> ExperimentConfig:
     try:
         return ExperimentConfig.from_file()
@@ -263,17 +303,22 @@ def submit(ctx, cluster_slug, wait, filename):
         status = client.run_info(run_id)
         spinner.succeed()
     url = status["run_page_url"]
+    tracker = RunTracker()
+    run = tracker.record(
+        config.databricks.host, run_id, experiment.slug, experiment.dbfs_working_path,
+        Path.cwd(), status,
+    )
     click.echo("Submitted. Job status: " + url)
     if not wait:
+        click.echo("Run `mozreport wait` to wait for it and download the result.")
         return
     with Spinner(text="Waiting for completion") as spinner:
-        state = status["state"]["life_cycle_state"]
-        while state != "TERMINATED":
+        while not run.finished:
             time.sleep(5)
             status = client.run_info(run_id)
-            state = status["state"]["life_cycle_state"]
-        if status["state"]["result_state"] == "FAILED":
-            spinner.fail()
+            run = tracker.update(run, status)
+        if not run.succeeded:
+            spinner.fail(describe_run(run))
             return
         else:
             spinner.succeed()
@@ -289,32 +334,498 @@ def submit(ctx, cluster_slug, wait, filename):
         ctx.invoke(fetch)
 
 
+@cli.command("submit-batch")
+@click.option(
+    "--cluster_slug",
+    default="1003-151000-grebe23",
+    help=(
+        "Cluster ID (not the cluster name) of the Databricks cluster to use. "
+        "Defaults to the slug for shared_serverless."
+    ),
+)
+@click.argument(
+    "directories",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, file_okay=False),
+)
+def submit_batch(cluster_slug, directories):
+    """Run the default analysis of several experiments as one Databricks job.
+
+    DIRECTORIES: Experiment directories, each with the mozreport.toml from `mozreport new`.
+    The experiments table is read once for all of them. Their configurations may
+    only differ in the slug, uuid and enrollment dates. Customized
+    mozreport_etl_script.py files are ignored; use `mozreport submit` for those.
+    Follow the job with `mozreport wait`, which fetches each experiment's result
+    into its directory.
+    """
+    config = get_cli_config_or_die()
+    experiments = []
+    for directory in directories:
+        try:
+            experiments.append(ExperimentConfig.from_file(Path(directory)/"mozreport.toml"))
+        except FileNotFoundError:
+            click.echo(f"I can't find mozreport.toml in {directory}.", err=True)
+            sys.exit(1)
+    client = Client(config.databricks)
+    with Spinner(text=f"Submitting {len(experiments)} experiments to Databricks") as spinner:
+        try:
+            run_id = submit_etl_batch(experiments, client, cluster_slug)
+        except ValueError as e:
+            spinner.fail(str(e))
+            sys.exit(1)
+        spinner.succeed()
+    status = client.run_info(run_id)
+    tracker = RunTracker()
+    for directory, experiment in zip(directories, experiments):
+        tracker.record(
+            config.databricks.host, run_id, experiment.slug, experiment.dbfs_working_path,
+            Path(directory), status,
+        )
+    click.echo("Submitted. Job status: " + status["run_page_url"])
+    click.echo("Run `mozreport wait` to wait for it and download the results.")
+
+
 @cli.command()
-def fetch():
+@click.option(
+    "--diagnostics",
+    is_flag=True,
+    help="Also download diagnostics.json, with the query plans and Spark stage metrics of the ETL",
+)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help="Whether to use the local cache of fetched results (uses it by default)",
+)
+def fetch(diagnostics, cache):
     """Fetch a summary.sqlite3 file from Databricks.
+
+    Results are kept in a cache in the local configuration directory, so
+    fetching an unchanged result again, from any directory, doesn't download it.
+    For the sharded output formats, summary.sqlite3 is downloaded first, then
+    the shards of per_user_daily_averages, several at a time.
     """
     config = get_cli_config_or_die()
     experiment = get_experiment_config_or_die()
     client = Client(config.databricks)
-    remote_filename = experiment.dbfs_working_path + "/summary.sqlite3"
-    with Spinner(text=f"Downloading file dbfs:{remote_filename}") as spinner:
-        summary = client.get_file(remote_filename)
+    cache = result_cache(config) if cache else None
+    filenames = ["summary.sqlite3"]
+    if diagnostics:
+        filenames.append("diagnostics.json")
+    for filename in filenames:
+        remote_filename = experiment.dbfs_working_path + "/" + filename
+        with Spinner(text=f"Downloading file dbfs:{remote_filename}") as spinner:
+            fetch_result_file(client, experiment.dbfs_working_path, filename, cache=cache)
+            spinner.succeed()
+    with Spinner(text="Downloading the shards of per_user_daily_averages") as spinner:
+        shards = fetch_shards(client, experiment.dbfs_working_path, cache=cache)
+        if shards:
+            spinner.succeed(f"Downloaded {len(shards)} shards")
+        else:
+            spinner.stop()
+    working_path = experiment.dbfs_working_path
+    tracker = RunTracker()
+    for run in tracker.runs():
+        if run.working_path == working_path and run.succeeded and not run.fetched:
+            tracker.mark_fetched(run)
+
+
+def describe_run(run) -> str:
+    return f"{run.slug} (run {run.run_id}): {run.state}"
+
+
+@cli.command()
+@click.option("--limit", default=20, show_default=True, help="How many recent runs to show")
+def status(limit):
+    """Show the state of recently submitted runs.
+    """
+    config = get_cli_config_or_die()
+    client = Client(config.databricks)
+    tracker = RunTracker()
+    runs = tracker.runs(limit=limit)
+    if not runs:
+        click.echo("No runs have been submitted yet.")
+        return
+    for run in runs:
+        if not run.finished and run.host == config.databricks.host:
+            run = tracker.update(run, client.run_info(run.run_id))
+        fetched = ", fetched" if run.fetched else ""
+        click.echo(f"{describe_run(run)}{fetched}")
+        click.echo(f"  Directory: {run.directory}")
+        if run.run_page_url:
+            click.echo(f"  Job status: {run.run_page_url}")
+
+
+@cli.command()
+@click.option(
+    "--interval",
+    default=30.0,
+    show_default=True,
+    help="How often to check on the runs, in seconds",
+)
+@click.option(
+    "--fetch/--no-fetch",
+    default=True,
+    help="Whether to download the result of each run that succeeds (downloads by default)",
+)
+@click.pass_context
+def wait(ctx, interval, fetch):
+    """Wait for every pending run, fetching results as they finish.
+
+    Covers all the runs submitted from this machine, whatever directory they
+    were submitted from; each result is downloaded to its experiment's
+    directory, replacing any existing local result.
+    """
+    config = get_cli_config_or_die()
+    client = Client(config.databricks)
+    tracker = RunTracker()
+    fetch = fetch and ctx.obj["pipeline"] != Pipeline.never
+    pending = []
+    for run in tracker.pending():
+        if run.host != config.databricks.host:
+            click.echo(f"Skipping {describe_run(run)}, which was submitted to {run.host}.")
+        else:
+            pending.append(run)
+    if not pending:
+        click.echo("No runs are pending.")
+        return
+    failed = False
+    while pending:
+        still_pending = []
+        # The experiments of a batch share a run; ask about it once per round
+        infos = {}
+        for run in pending:
+            if not run.finished:
+                if run.run_id not in infos:
+                    infos[run.run_id] = client.run_info(run.run_id)
+                run = tracker.update(run, infos[run.run_id])
+                if not run.finished:
+                    still_pending.append(run)
+                    continue
+                click.echo(describe_run(run))
+            if not run.succeeded:
+                failed = True
+            elif fetch:
+                if not Path(run.directory).is_dir():
+                    click.echo(f"Can't fetch {run.slug}: {run.directory} is missing.", err=True)
+                    failed = True
+                    continue
+                with Spinner(text=f"Downloading the result of {run.slug}") as spinner:
+                    path = fetch_result_file(
+                        client, run.working_path, "summary.sqlite3", Path(run.directory),
+                        cache=result_cache(config),
+                    )
+                    fetch_shards(
+                        client, run.working_path, Path(run.directory), cache=result_cache(config),
+                    )
+                    tracker.mark_fetched(run)
+                    spinner.succeed(f"Downloaded {path}")
+        pending = still_pending
+        if pending:
+            time.sleep(interval)
+    sys.exit(1 if failed else 0)
+
+
+@cli.command()
+@click.option(
+    "--older-than",
+    default=30,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Delete working directories in which nothing changed for this many days",
+)
+@click.option("--dry-run", is_flag=True, help="Only list what would be deleted")
+@click.option(
+    "--all",
+    "all_directories",
+    is_flag=True,
+    help=(
+        "Consider every working directory in dbfs:/mozreport, including other people's, "
+        "not only those of runs submitted from this machine"
+    ),
+)
+def gc(older_than, dry_run, all_directories):
+    """Delete stale working directories from dbfs:/mozreport.
+
+    Each submitted experiment leaves its script and results in a working
+    directory on DBFS. Only the directories of runs submitted from this
+    machine, which `mozreport status` lists, are considered, unless --all is
+    given; dbfs:/mozreport is shared, so --all asks before deleting.
+    Directories of pending runs are kept whatever their age. Fetched results
+    stay in your experiment directories.
+    """
+    config = get_cli_config_or_die()
+    client = Client(config.databricks)
+    tracker = RunTracker()
+    host = config.databricks.host
+    keep = {run.working_path for run in tracker.pending() if run.host == host}
+    tracked = None
+    if not all_directories:
+        tracked = {run.working_path for run in tracker.runs() if run.host == host}
+    with Spinner(text="Looking for stale working directories") as spinner:
+        cutoff = time.time() - older_than * 24 * 60 * 60
+        stale = [
+            p for p in stale_directories(client, "/mozreport", cutoff, only=tracked)
+            if p not in keep
+        ]
+        spinner.succeed(f"Found {len(stale)} stale working directories")
+    for path in stale:
+        click.echo(f"dbfs:{path}")
+    if dry_run or not stale:
+        return
+    if all_directories and not click.confirm(
+        f"Delete these {len(stale)} directories, including any that aren't yours?"
+    ):
+        return
+    with Spinner(text=f"Deleting {len(stale)} directories") as spinner:
+        delete_all(client, stale)
         spinner.succeed()
-    with open("summary.sqlite3", "wb") as f:
-        f.write(summary)
+
+
+@cli.command()
+@click.option(
+    "--up",
+    is_flag=True,
+    help="Upload the local files that changed, instead of downloading the remote ones",
+)
+@click.argument("directory", default=".", type=click.Path(file_okay=False))
+def sync(up, directory):
+    """Copy every changed file between the experiment's working directory on DBFS and DIRECTORY.
+
+    Where `fetch` downloads the result, this copies all the artifacts of a
+    run, several at a time, skipping the files that didn't change.
+    DIRECTORY defaults to the current directory.
+    """
+    config = get_cli_config_or_die()
+    experiment = get_experiment_config_or_die()
+    client = Client(config.databricks)
+    remote_dir = experiment.dbfs_working_path
+    directory = Path(directory)
+    if up:
+        with Spinner(text=f"Uploading changed files to dbfs:{remote_dir}") as spinner:
+            changed = sync_up(client, directory, remote_dir)
+            spinner.succeed(f"Uploaded {len(changed)} files")
+    else:
+        directory.mkdir(parents=True, exist_ok=True)
+        with Spinner(text=f"Downloading changed files from dbfs:{remote_dir}") as spinner:
+            changed = sync_down(client, remote_dir, directory)
+            spinner.succeed(f"Downloaded {len(changed)} files")
+    for name in changed:
+        click.echo(name)
 
 
 @cli.command()
 @click.option("--template", help="Template name to use")
-def report(template):
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Replace files that are older than the template's copies (including your edits)",
+)
+@click.option("--list", "list_templates", is_flag=True, help="List the available templates")
+def report(template, force, list_templates):
     """Install a report template in the current working directory.
+
+    Files that are already newer than the template's copies are left alone.
     """
-    config = get_cli_config_or_die()
     all_templates = Template.find_all()
+    if list_templates:
+        for t in all_templates:
+            click.echo(f"{t.name}: {t.description or '(no description)'}")
+            click.echo(f"  Location: {t.path}")
+            if t.output_formats:
+                click.echo(f"  Output formats: {', '.join(t.output_formats)}")
+            if t.r_packages:
+                click.echo(f"  R packages: {', '.join(t.r_packages)}")
+        return
+    config = get_cli_config_or_die()
     template = template or config.default_template
     found = [t for t in all_templates if t.name == template]
     if not found:
         click.echo(f"Couldn't find template {template}.", err=True)
         click.echo("I know about: " + ','.join(t.name for t in all_templates), err=True)
         sys.exit(1)
-    found[0].emplace(Path.cwd(), overwrite=False)
+    try:
+        found[0].emplace(Path.cwd(), overwrite=force, incremental=True)
+    except FileExistsError as e:
+        click.echo(
+            f"These files are older than the {template} template's copies: {e}\n"
+            "Use --force to replace them.",
+            err=True,
+        )
+        sys.exit(1)
+
+
+@cli.command()
+@click.option("--watch", is_flag=True, help="Render again whenever report.Rmd or the data change")
+@click.option(
+    "--interval",
+    default=1.0,
+    show_default=True,
+    help="How often to check for changes, in seconds",
+)
+def build(watch, interval):
+    """Render report.Rmd in a persistent R session.
+
+    The session keeps libraries and summary.sqlite3 tables loaded between renders.
+    """
+    from .rworker import PRELUDE, RWorker, required_packages, wait_for_changes
+
+    report = Path("report.Rmd")
+    if not report.exists():
+        click.echo(
+            "I can't find report.Rmd in this path.\n"
+            "Have you run `mozreport report` yet?",
+            err=True,
+        )
+        sys.exit(1)
+    libraries = "; ".join(f"library({p})" for p in required_packages(report))
+    with RWorker(echo=click.echo) as worker:
+        with Spinner(text="Starting R") as spinner:
+            if not worker.run(PRELUDE + f"suppressPackageStartupMessages({{{libraries}}})"):
+                spinner.fail()
+                sys.exit(1)
+            spinner.succeed()
+        ok = worker.render(report)
+        click.echo("Rendered report.Rmd." if ok else "Rendering report.Rmd failed.")
+        if not watch:
+            sys.exit(0 if ok else 1)
+        click.echo("Watching for changes; press Ctrl-C to stop.")
+        try:
+            for changed in wait_for_changes([report, Path("summary.sqlite3")], interval):
+                click.echo("Changed: " + ", ".join(str(p) for p in changed))
+                ok = worker.render(report)
+                click.echo("Rendered report.Rmd." if ok else "Rendering report.Rmd failed.")
+        except KeyboardInterrupt:
+            pass
+
+
+@cli.command()
+@click.argument("sql", required=False)
+@click.option("--view", help="Name of a table or prepared view to print, e.g. branch_means")
+@click.option(
+    "--format", "output_format",
+    type=click.Choice(["csv", "json"]),
+    default="csv",
+    show_default=True,
+)
+@click.option(
+    "--database",
+    default="summary.sqlite3",
+    show_default=True,
+    type=click.Path(exists=True, dir_okay=False),
+)
+@click.option(
+    "--branch", "branches",
+    multiple=True,
+    help="Only read the per-user rows of this branch; repeat for several",
+)
+@click.option(
+    "--channel", "channels",
+    multiple=True,
+    help="Only read the per-user rows of this channel; repeat for several",
+)
+def query(sql, view, output_format, database, branches, channels):
+    """Query a summary.sqlite3 file.
+
+    SQL: A query to run. The branch_means and branch_quantiles views summarize
+    per_user_daily_averages by branch. Without SQL or --view, lists the
+    tables and views. With --branch or --channel, per_user_daily_averages
+    only has the rows of those branches or channels, and of a sharded
+    result, only their shards are read.
+    """
+    from . import query as q
+
+    try:
+        conn = q.open_summary(database, branches or None, channels or None)
+    except ValueError as e:
+        click.echo(str(e), err=True)
+        sys.exit(1)
+    if view:
+        sql = f"SELECT * FROM {q.quote(view)}"
+    if not sql:
+        for name in q.views(conn):
+            click.echo(name)
+        return
+    out = click.get_text_stream("stdout")
+    q.WRITERS[output_format](conn.execute(sql), out)
+
+
+@cli.command()
+@click.option(
+    "--by-channel",
+    is_flag=True,
+    help="Summarize each channel of each branch separately",
+)
+@click.option("--bins", default=50, show_default=True, help="Number of histogram bins")
+@click.option(
+    "--processes",
+    type=click.IntRange(min=1),
+    help="How many processes summarize the table (defaults to the number of CPUs)",
+)
+@click.option(
+    "--format", "output_format",
+    type=click.Choice(["csv", "json"]),
+    default="csv",
+    show_default=True,
+)
+@click.option(
+    "--database",
+    default="summary.sqlite3",
+    show_default=True,
+    type=click.Path(exists=True, dir_okay=False),
+)
+def summarize(by_channel, bins, processes, output_format, database):
+    """Summarize per_user_daily_averages by branch without loading it into memory.
+
+    Prints the count, mean, variance, minimum, maximum and histogram of
+    each column, reading the table in batches. Needs NumPy, which you can
+    install with `pip install mozreport[summarize]`.
+    """
+    try:
+        from . import summarize as s
+    except ImportError:
+        click.echo("mozreport summarize needs NumPy: pip install mozreport[summarize]", err=True)
+        sys.exit(1)
+    from .query import WRITERS
+
+    by = s.GROUP_KEYS if by_channel else ["experiment_branch"]
+    summaries = s.summarize(database, by=by, bins=bins, processes=processes)
+    WRITERS[output_format](s.as_cursor(summaries, by), click.get_text_stream("stdout"))
+
+
+@cli.command()
+@click.argument("old", type=click.Path(exists=True, dir_okay=False))
+@click.argument("new", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--table",
+    type=click.Choice(["summary", "per_user_daily_averages"]),
+    help="Only compare this table",
+)
+@click.option(
+    "--format", "output_format",
+    type=click.Choice(["csv", "json"]),
+    default="csv",
+    show_default=True,
+)
+def diff(old, new, table, output_format):
+    """Compare two summary.sqlite3 files from runs of the same experiment.
+
+    Lists the summary statistics that changed, and per-branch client counts
+    and means of the per-user averages.
+    """
+    from .diff import CHANGES, open_pair
+    from .query import WRITERS
+
+    conn = open_pair(old, new)
+    tables = [table] if table else list(CHANGES)
+    out = click.get_text_stream("stdout")
+    if output_format == "json":
+        out.write("{")
+    for i, name in enumerate(tables):
+        if output_format == "json":
+            out.write(f"{', ' if i else ''}\"{name}\": ")
+        else:
+            out.write(f"{chr(10) if i else ''}# {name}\n")
+        WRITERS[output_format](CHANGES[name](conn), out)
+    if output_format == "json":
+        out.write("}\n")
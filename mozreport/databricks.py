@@ -1,10 +1,13 @@
 from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
 from typing.io import IO
 from urllib.parse import urljoin
 from typing import Optional, List
 
 import attr
-from requests import Session
+
+# Concurrent requests for bulk operations; Databricks rate-limits beyond a few dozen
+MAX_CONCURRENT_REQUESTS = 8
 
 
 @attr.s
@@ -18,16 +21,18 @@ class Client:
         self.config = config
 
         if session is None:
+            from requests import Session  # pragma: no cover
             session = Session()  # pragma: no cover
         session.headers.update({"Authorization": f"Bearer {self.config.token}"})
         self._requests = session
 
-    def upload_file(self, file: IO[bytes], remote_path: str) -> None:
+    def upload_file(self, file: IO[bytes], remote_path: str, overwrite: bool = False) -> None:
         url = urljoin(self.config.host, "/api/2.0/dbfs/put")
         response = self._requests.post(
             url,
             data={
                 "path": remote_path,
+                "overwrite": "true" if overwrite else "false",
             },
             files={
                 "contents": file,
@@ -49,6 +54,57 @@ class Client:
             return False
         raise DatabricksException(repr(body))
 
+    def get_status(self, remote_path: str) -> dict:
+        """Returns the path, is_dir, file_size and modification_time of a file."""
+        url = urljoin(self.config.host, "/api/2.0/dbfs/get-status")
+        response = self._requests.get(
+            url,
+            params={"path": remote_path},
+        )
+        if response.status_code != 200:
+            raise DatabricksException(response.text)
+        return response.json()
+
+    def list_dir(self, remote_path: str, recursive: bool = False) -> List[dict]:
+        """Lists the files and directories in a directory, like get_status does for one file.
+
+        With recursive=True, includes the contents of subdirectories, listing
+        each level of the tree concurrently.
+        """
+        url = urljoin(self.config.host, "/api/2.0/dbfs/list")
+
+        def list_one(path):
+            response = self._requests.get(url, params={"path": path})
+            if response.status_code != 200:
+                raise DatabricksException(response.text)
+            return response.json().get("files", [])
+
+        entries = list_one(remote_path)
+        if not recursive:
+            return entries
+        result = []
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            while entries:
+                result.extend(entries)
+                directories = [e["path"] for e in entries if e["is_dir"]]
+                entries = [e for level in executor.map(list_one, directories) for e in level]
+        return result
+
+    def read_range(self, remote_path: str, offset: int, length: int) -> bytes:
+        """Reads up to length bytes, at most 1 MB, starting at offset."""
+        url = urljoin(self.config.host, "/api/2.0/dbfs/read")
+        response = self._requests.get(
+            url,
+            params={
+                "path": remote_path,
+                "offset": offset,
+                "length": length,
+            }
+        )
+        if response.status_code != 200:
+            raise DatabricksException(response.text)
+        return b64decode(response.json()["data"])
+
     def get_file(self, remote_path: str) -> bytes:
         url = urljoin(self.config.host, "/api/2.0/dbfs/read")
         chunks = []
@@ -0,0 +1,81 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import List, Optional
+
+from . import databricks
+
+# Suffix of the block manifests that the ETL script writes next to each output
+MANIFEST_SUFFIX = ".blocks.json"
+
+
+def block_hashes(path: Path, block_size: int) -> List[str]:
+    with open(path, "rb") as f:
+        return [
+            hashlib.sha256(block).hexdigest()
+            for block in iter(lambda: f.read(block_size), b"")
+        ]
+
+
+def get_manifest(client: databricks.Client, remote_path: str) -> Optional[dict]:
+    """The block manifest of remote_path, or None if it has none."""
+    manifest_path = remote_path + MANIFEST_SUFFIX
+    if not client.file_exists(manifest_path):
+        return None
+    try:
+        return json.loads(client.get_file(manifest_path).decode("utf-8"))
+    except ValueError:
+        return None
+
+
+def fetch_changed_blocks(
+    client: databricks.Client,
+    remote_path: str,
+    manifest: dict,
+    base: Path,
+) -> Optional[bytes]:
+    """Reconstructs remote_path from base, reading only the blocks that differ.
+
+    Returns None if the result doesn't match the manifest, which happens if
+    the file was replaced while it was being read.
+    """
+    block_size = manifest["block_size"]
+    local = block_hashes(base, block_size)
+    pieces = []
+    with open(base, "rb") as f:
+        for i, expected in enumerate(manifest["blocks"]):
+            if i < len(local) and local[i] == expected:
+                f.seek(i * block_size)
+                block = f.read(block_size)
+            else:
+                block = client.read_range(remote_path, i * block_size, block_size)
+                if hashlib.sha256(block).hexdigest() != expected:
+                    return None
+            pieces.append(block)
+    contents = b"".join(pieces)
+    if len(contents) != manifest["size"]:
+        return None
+    return contents
+
+
+def download(
+    client: databricks.Client,
+    remote_path: str,
+    base: Optional[Path] = None,
+) -> bytes:
+    """Downloads remote_path, reusing the blocks of a previous copy at base if possible.
+
+    The delta is only used if the ETL wrote a block manifest for the file
+    that describes its current size; otherwise the whole file is read.
+    """
+    if base is not None and Path(base).is_file():
+        manifest = get_manifest(client, remote_path)
+        if (
+            manifest is not None
+            and manifest.get("algorithm") == "sha256"
+            and manifest["size"] == client.get_status(remote_path)["file_size"]
+        ):
+            contents = fetch_changed_blocks(client, remote_path, manifest, Path(base))
+            if contents is not None:
+                return contents
+    return client.get_file(remote_path)
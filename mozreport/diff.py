@@ -0,0 +1,137 @@
+from contextlib import ExitStack, closing
+from pathlib import Path
+import sqlite3
+from typing import List, Union
+
+from .query import PER_USER_TABLE, averaged_columns, quote
+from .results import DEFAULT_CACHE_SIZE_KIB
+from .shards import open_result
+
+# Columns of the summary table that are compared; the other columns identify a row
+SUMMARY_VALUES = ["stat_value", "ci_low", "ci_high"]
+
+
+def open_pair(old: Union[str, Path], new: Union[str, Path]) -> sqlite3.Connection:
+    """Attaches two result databases, read-only, as `old` and `new`.
+
+    The comparisons run as SQL inside SQLite, so neither database is
+    loaded into Python. per_user_changes reads sharded results through
+    their shards.
+    """
+    conn = sqlite3.connect("file::memory:", uri=True)
+    for name, path in (("old", old), ("new", new)):
+        path = Path(path).resolve()
+        if not path.exists():
+            raise FileNotFoundError(str(path))
+        conn.execute(f"ATTACH DATABASE ? AS {name}", (path.as_uri() + "?immutable=1",))
+        conn.execute(f"PRAGMA {name}.mmap_size = {path.stat().st_size}")
+        conn.execute(f"PRAGMA {name}.cache_size = -{DEFAULT_CACHE_SIZE_KIB // 2}")
+    return conn
+
+
+def common_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    def columns(schema):
+        return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({quote(table)})")]
+    new_columns = columns("new")
+    return [c for c in columns("old") if c in new_columns]
+
+
+def summary_changes(conn: sqlite3.Connection) -> sqlite3.Cursor:
+    """Rows of the summary table whose values were added, removed or changed."""
+    columns = common_columns(conn, "summary")
+    keys = [c for c in columns if c not in SUMMARY_VALUES]
+    values = [c for c in columns if c in SUMMARY_VALUES]
+    key_list = ", ".join(quote(k) for k in keys)
+
+    def joined(alias):
+        return " AND ".join(f"{alias}.{quote(k)} IS keys.{quote(k)}" for k in keys)
+
+    selected = [f"keys.{quote(k)}" for k in keys]
+    for v in values:
+        selected.extend([
+            f"o.{quote(v)} AS {quote('old_' + v)}",
+            f"n.{quote(v)} AS {quote('new_' + v)}",
+        ])
+    differs = " OR ".join(f"o.{quote(v)} IS NOT n.{quote(v)}" for v in values)
+    return conn.execute(f"""
+        WITH keys AS (
+            SELECT {key_list} FROM old.summary
+            UNION
+            SELECT {key_list} FROM new.summary
+        )
+        SELECT {", ".join(selected)}
+        FROM keys
+        LEFT JOIN old.summary o ON {joined("o")}
+        LEFT JOIN new.summary n ON {joined("n")}
+        WHERE {differs}
+        ORDER BY {", ".join(f"keys.{quote(k)}" for k in keys)}
+    """)
+
+
+def database_path(conn: sqlite3.Connection, schema: str) -> Path:
+    """The file attached to conn as schema."""
+    return Path(next(r[2] for r in conn.execute("PRAGMA database_list") if r[1] == schema))
+
+
+def per_user_changes(conn: sqlite3.Connection) -> sqlite3.Cursor:
+    """Per-branch client counts and means of per_user_daily_averages, before and after.
+
+    Each side's table is read through shards.open_result, since with the
+    sharded output formats it isn't in summary.sqlite3. Only the per-branch
+    statistics are copied into conn, as temporary tables, to be compared.
+    """
+    with ExitStack() as stack:
+        sides = {
+            schema: stack.enter_context(closing(open_result(database_path(conn, schema))))
+            for schema in ("old", "new")
+        }
+        new_columns = averaged_columns(sides["new"])
+        columns = [c for c in averaged_columns(sides["old"]) if c in new_columns]
+        statistics = [("clients", "COUNT(*)")]
+        statistics += [(f"mean_{c}", f"AVG({quote(c)})") for c in columns]
+        aggregates = ", ".join(f"{expression} AS {quote(name)}" for name, expression in statistics)
+        names = ", ".join(quote(n) for n in ["experiment_branch"] + [n for n, _ in statistics])
+        for schema, side in sides.items():
+            rows = side.execute(
+                f"SELECT experiment_branch, {aggregates} "
+                f"FROM {quote(PER_USER_TABLE)} GROUP BY experiment_branch"
+            ).fetchall()
+            conn.execute(f"DROP TABLE IF EXISTS temp.{schema}_branch_statistics")
+            conn.execute(f"CREATE TEMP TABLE {schema}_branch_statistics ({names})")
+            conn.executemany(
+                f"INSERT INTO temp.{schema}_branch_statistics "
+                f"VALUES ({', '.join('?' for _ in range(len(statistics) + 1))})",
+                rows,
+            )
+    per_statistic = [
+        f"""
+        SELECT
+            branches.experiment_branch,
+            '{name}' AS statistic,
+            o.{quote(name)} AS old_value,
+            n.{quote(name)} AS new_value,
+            n.{quote(name)} - o.{quote(name)} AS change,
+            CASE WHEN o.{quote(name)} != 0
+                THEN (n.{quote(name)} - o.{quote(name)}) / ABS(o.{quote(name)} * 1.0)
+            END AS relative_change
+        FROM branches
+        LEFT JOIN temp.old_branch_statistics o USING (experiment_branch)
+        LEFT JOIN temp.new_branch_statistics n USING (experiment_branch)
+        """
+        for name, _ in statistics
+    ]
+    return conn.execute(f"""
+        WITH branches AS (
+            SELECT experiment_branch FROM temp.old_branch_statistics
+            UNION
+            SELECT experiment_branch FROM temp.new_branch_statistics
+        )
+        SELECT * FROM ({" UNION ALL ".join(per_statistic)})
+        ORDER BY experiment_branch, statistic
+    """)
+
+
+CHANGES = {
+    "summary": summary_changes,
+    PER_USER_TABLE: per_user_changes,
+}
@@ -0,0 +1,485 @@
+"""A local emulator of the Databricks REST endpoints that mozreport uses.
+
+It serves DBFS (put, read, get-status, list, delete, mkdirs and create/add-block/close)
+from a local directory, and runs the Python file of a jobs/runs/submit
+spark_python_task locally, in a subprocess. Parameters that start with /dbfs/
+are rewritten to point into the local directory, like the FUSE mount on a
+cluster. There's no Spark, so scripts that need `spark` or `dbutils` fail the
+run, as they would on a cluster without them.
+
+Use it in-process:
+
+    with Emulator() as emulator:
+        client = Client(emulator.config)
+
+or start one with `python -m mozreport.emulator`, which prints its URL, and
+point the `host` in your mozreport configuration at it.
+"""
+import argparse
+from base64 import b64decode, b64encode
+from collections import deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+from pathlib import Path
+import posixpath
+import re
+import shutil
+import signal
+from socketserver import ThreadingMixIn
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+from .databricks import DatabricksConfig
+
+MEGABYTE = 1 << 20  # largest read or block the API accepts
+
+
+def synthetic_bytes(offset: int, length: int) -> bytes:
+    """Deterministic contents for synthetic files: byte i is i % 251."""
+    pattern = bytes(range(251))
+    start = offset % 251
+    repeats = (start + length) // 251 + 1
+    return (pattern * repeats)[start:start + length]
+
+
+class ApiError(Exception):
+    def __init__(self, error_code: str, message: str = "", status: int = 400) -> None:
+        super().__init__(message)
+        self.error_code = error_code
+        self.message = message
+        self.status = status
+
+
+def not_found(path: str) -> ApiError:
+    return ApiError(
+        "RESOURCE_DOES_NOT_EXIST", f"No file or directory exists on path {path}.", status=404
+    )
+
+
+class EmulatorState:
+    """Files, open upload handles and runs, shared by the request handlers."""
+
+    def __init__(
+        self,
+        root: Path,
+        latency: float = 0.0,
+        bandwidth: float = 0.0,
+        rate_limit: float = 0.0,
+        python: str = sys.executable,
+    ) -> None:
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth  # bytes per second; 0 is unlimited
+        self.rate_limit = rate_limit  # requests per second; 0 is unlimited
+        self.python = python
+        # Generated on read, so they can be larger than memory or disk
+        self.synthetic = {}
+        self.handles = {}
+        self.runs = {}
+        self.lock = threading.Lock()
+        self._recent_requests = deque()
+
+    def delay(self, size: int = 0) -> None:
+        seconds = self.latency
+        if self.bandwidth:
+            seconds += size / self.bandwidth
+        if seconds:
+            time.sleep(seconds)
+
+    def admit(self) -> None:
+        """Raises REQUEST_LIMIT_EXCEEDED if the last second saw rate_limit requests."""
+        if not self.rate_limit:
+            return
+        now = time.monotonic()
+        with self.lock:
+            while self._recent_requests and self._recent_requests[0] <= now - 1:
+                self._recent_requests.popleft()
+            if len(self._recent_requests) >= self.rate_limit:
+                raise ApiError("REQUEST_LIMIT_EXCEEDED", "Too many requests.", status=429)
+            self._recent_requests.append(now)
+
+    def local_path(self, path: str) -> Path:
+        if not path or not path.startswith("/"):
+            raise ApiError("INVALID_PARAMETER_VALUE", f"Path must be absolute: {path}")
+        return self.root.joinpath(posixpath.normpath(path).lstrip("/"))
+
+    def status(self, path: str) -> dict:
+        if path in self.synthetic:
+            return {
+                "path": path,
+                "is_dir": False,
+                "file_size": self.synthetic[path],
+                "modification_time": 0,
+            }
+        local = self.local_path(path)
+        if not local.exists():
+            raise not_found(path)
+        stat = local.stat()
+        is_dir = local.is_dir()
+        return {
+            "path": path,
+            "is_dir": is_dir,
+            "file_size": 0 if is_dir else stat.st_size,
+            "modification_time": stat.st_mtime_ns // 1000000,
+        }
+
+    def list(self, path: str) -> list:
+        status = self.status(path)
+        if not status["is_dir"]:
+            return [status]
+        local = self.local_path(path)
+        children = [posixpath.join(path, child.name) for child in sorted(local.iterdir())]
+        children.extend(
+            p for p in sorted(self.synthetic) if posixpath.dirname(p) == posixpath.normpath(path)
+        )
+        return [self.status(child) for child in children]
+
+    def read(self, path: str, offset: int, length: int) -> bytes:
+        if length > MEGABYTE:
+            raise ApiError("MAX_READ_SIZE_EXCEEDED", f"Cannot read more than {MEGABYTE} bytes.")
+        status = self.status(path)
+        if status["is_dir"]:
+            raise ApiError("INVALID_PARAMETER_VALUE", f"Path is a directory: {path}")
+        length = min(length, max(status["file_size"] - offset, 0))
+        if path in self.synthetic:
+            return synthetic_bytes(offset, length)
+        with open(self.local_path(path), "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def open_for_writing(self, path: str, overwrite: bool):
+        local = self.local_path(path)
+        if local.is_dir():
+            raise ApiError("RESOURCE_ALREADY_EXISTS", f"A directory exists at {path}.")
+        if (local.exists() or path in self.synthetic) and not overwrite:
+            raise ApiError("RESOURCE_ALREADY_EXISTS", f"A file already exists at {path}.")
+        self.synthetic.pop(path, None)
+        local.parent.mkdir(parents=True, exist_ok=True)
+        return open(local, "wb")
+
+    def put(self, path: str, contents: bytes, overwrite: bool) -> None:
+        with self.open_for_writing(path, overwrite) as f:
+            f.write(contents)
+
+    def create(self, path: str, overwrite: bool) -> int:
+        f = self.open_for_writing(path, overwrite)
+        with self.lock:
+            handle = len(self.handles) + 1
+            self.handles[handle] = f
+        return handle
+
+    def handle(self, handle: int):
+        f = self.handles.get(handle)
+        if f is None or f.closed:
+            raise not_found(f"handle {handle}")
+        return f
+
+    def add_block(self, handle: int, data: bytes) -> None:
+        if len(data) > MEGABYTE:
+            raise ApiError("MAX_BLOCK_SIZE_EXCEEDED", f"Blocks are at most {MEGABYTE} bytes.")
+        self.handle(handle).write(data)
+
+    def close(self, handle: int) -> None:
+        self.handle(handle).close()
+
+    def mkdirs(self, path: str) -> None:
+        local = self.local_path(path)
+        if local.is_file():
+            raise ApiError("RESOURCE_ALREADY_EXISTS", f"A file exists at {path}.")
+        local.mkdir(parents=True, exist_ok=True)
+
+    def delete(self, path: str, recursive: bool) -> None:
+        self.synthetic.pop(path, None)
+        local = self.local_path(path)
+        if local == self.root:
+            raise ApiError("INVALID_PARAMETER_VALUE", "Cannot delete the root directory.")
+        if local.is_dir():
+            if any(local.iterdir()) and not recursive:
+                raise ApiError("IO_ERROR", f"Directory {path} is not empty.")
+            shutil.rmtree(local)
+        elif local.exists():
+            local.unlink()
+
+    def submit(self, job: dict) -> int:
+        task = job.get("spark_python_task")
+        if not task:
+            raise ApiError("INVALID_PARAMETER_VALUE", "Only spark_python_task runs are emulated.")
+        with self.lock:
+            run_id = len(self.runs) + 1
+            self.runs[run_id] = {
+                "run_id": run_id,
+                "run_name": job.get("run_name", ""),
+                "run_page_url": f"http://localhost/#job/1/run/{run_id}",
+                "start_time": int(time.time() * 1000),
+                "state": {"life_cycle_state": "PENDING", "state_message": ""},
+            }
+        threading.Thread(target=self.run, args=(run_id, task), daemon=True).start()
+        return run_id
+
+    def set_state(self, run_id: int, **state) -> None:
+        with self.lock:
+            self.runs[run_id]["state"] = state
+            if state["life_cycle_state"] in ("TERMINATED", "INTERNAL_ERROR"):
+                self.runs[run_id]["end_time"] = int(time.time() * 1000)
+
+    def dbfs_argument(self, argument: str) -> str:
+        if argument == "/dbfs" or argument.startswith("/dbfs/"):
+            return str(self.local_path(argument[len("/dbfs"):] or "/"))
+        return argument
+
+    def run(self, run_id: int, task: dict) -> None:
+        python_file = task["python_file"]
+        path = python_file[len("dbfs:"):] if python_file.startswith("dbfs:") else python_file
+        try:
+            script = self.local_path(path)
+        except ApiError:
+            script = None
+        if script is None or not script.is_file():
+            self.set_state(
+                run_id,
+                life_cycle_state="INTERNAL_ERROR",
+                result_state="FAILED",
+                state_message=f"{python_file} does not exist.",
+            )
+            return
+        self.set_state(run_id, life_cycle_state="RUNNING", state_message="")
+        arguments = [self.dbfs_argument(a) for a in task.get("parameters", [])]
+        try:
+            with tempfile.TemporaryDirectory(prefix="mozreport-run-") as cwd:
+                result = subprocess.run(
+                    [self.python, str(script)] + arguments,
+                    cwd=cwd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    universal_newlines=True,
+                )
+        except OSError as e:
+            # Otherwise the run would stay RUNNING, and `mozreport wait` would never return
+            self.set_state(
+                run_id,
+                life_cycle_state="INTERNAL_ERROR",
+                result_state="FAILED",
+                state_message=f"Couldn't start {python_file}: {e}",
+            )
+            return
+        output = result.stdout.strip().splitlines()
+        self.set_state(
+            run_id,
+            life_cycle_state="TERMINATED",
+            result_state="SUCCESS" if result.returncode == 0 else "FAILED",
+            state_message=output[-1] if output and result.returncode else "",
+        )
+
+
+def form_fields(content_type: str, body: bytes) -> dict:
+    """Parses a multipart/form-data body into a dict of field name to bytes."""
+    head = b"Content-Type: " + content_type.encode("ascii") + b"\r\n\r\n"
+    message = BytesParser(policy=HTTP).parsebytes(head + body)
+    return {
+        part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+        for part in message.iter_parts()
+    }
+
+
+def is_true(value) -> bool:
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    return value in (True, "true", "True", "1")
+
+
+class EmulatorHandler(BaseHTTPRequestHandler):
+    state: EmulatorState
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body, status=200):
+        payload = json.dumps(body).encode("utf-8")
+        self.state.delay(len(payload))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def handle_api(self, method):
+        url = urlparse(self.path)
+        try:
+            self.state.admit()
+            endpoint = getattr(self, method + re.sub(r"[^a-z0-9]", "_", url.path), None)
+            if endpoint is None:
+                raise ApiError("ENDPOINT_NOT_FOUND", f"No API endpoint {url.path}.", status=404)
+            if method == "get":
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            else:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self.state.delay(len(body))
+                content_type = self.headers.get("Content-Type", "")
+                if content_type.startswith("multipart/form-data"):
+                    params = form_fields(content_type, body)
+                else:
+                    params = json.loads(body or b"{}")
+            self.send_json(endpoint(params) or {})
+        except ApiError as e:
+            self.send_json({"error_code": e.error_code, "message": e.message}, status=e.status)
+        except (KeyError, ValueError) as e:
+            self.send_json(
+                {"error_code": "INVALID_PARAMETER_VALUE", "message": repr(e)}, status=400
+            )
+
+    def do_GET(self):
+        self.handle_api("get")
+
+    def do_POST(self):
+        self.handle_api("post")
+
+    def get_api_2_0_dbfs_get_status(self, params):
+        return self.state.status(params["path"])
+
+    def get_api_2_0_dbfs_list(self, params):
+        return {"files": self.state.list(params["path"])}
+
+    def get_api_2_0_dbfs_read(self, params):
+        data = self.state.read(
+            params["path"], int(params.get("offset", 0)), int(params.get("length", MEGABYTE))
+        )
+        return {"bytes_read": len(data), "data": b64encode(data).decode("ascii")}
+
+    def post_api_2_0_dbfs_put(self, params):
+        path, contents = params["path"], params.get("contents", b"")
+        if isinstance(path, bytes):
+            path = path.decode("utf-8")
+        else:
+            # The JSON form of the API, limited to one block of base64 contents
+            contents = b64decode(contents)
+            if len(contents) > MEGABYTE:
+                raise ApiError("MAX_BLOCK_SIZE_EXCEEDED", "Use create/add-block/close instead.")
+        self.state.put(path, contents, is_true(params.get("overwrite", False)))
+
+    def post_api_2_0_dbfs_create(self, params):
+        return {"handle": self.state.create(params["path"], is_true(params.get("overwrite")))}
+
+    def post_api_2_0_dbfs_add_block(self, params):
+        self.state.add_block(int(params["handle"]), b64decode(params["data"]))
+
+    def post_api_2_0_dbfs_close(self, params):
+        self.state.close(int(params["handle"]))
+
+    def post_api_2_0_dbfs_mkdirs(self, params):
+        self.state.mkdirs(params["path"])
+
+    def post_api_2_0_dbfs_delete(self, params):
+        self.state.delete(params["path"], is_true(params.get("recursive", False)))
+
+    def post_api_2_0_jobs_runs_submit(self, params):
+        return {"run_id": self.state.submit(params)}
+
+    def get_api_2_0_jobs_runs_get(self, params):
+        run = self.state.runs.get(int(params["run_id"]))
+        if run is None:
+            raise ApiError("INVALID_PARAMETER_VALUE", f"Run {params['run_id']} does not exist.")
+        with self.state.lock:
+            return json.loads(json.dumps(run))
+
+
+class EmulatorServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, state: EmulatorState, port: int = 0) -> None:
+        handler = type("BoundEmulatorHandler", (EmulatorHandler,), {"state": state})
+        super().__init__(("127.0.0.1", port), handler)
+        self.state = state
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+
+class Emulator:
+    """Runs an emulated workspace on a background thread.
+
+    Files live under `root`, or under a temporary directory that's removed
+    when the emulator is closed.
+    """
+
+    def __init__(self, root: Optional[Path] = None, port: int = 0, **options) -> None:
+        self._tempdir = None
+        if root is None:
+            self._tempdir = tempfile.TemporaryDirectory(prefix="mozreport-dbfs-")
+            root = self._tempdir.name
+        Path(root).mkdir(parents=True, exist_ok=True)
+        self.state = EmulatorState(Path(root), **options)
+        self.server = EmulatorServer(self.state, port)
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def url(self) -> str:
+        return self.server.url
+
+    @property
+    def config(self) -> DatabricksConfig:
+        return DatabricksConfig(token="emulator", host=self.url)
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if self._tempdir is not None:
+            self._tempdir.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", help="Directory to keep DBFS in (default: a temporary one)")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to each request")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="Bytes per second")
+    parser.add_argument(
+        "--rate-limit", type=float, default=0.0, help="Requests per second before HTTP 429s"
+    )
+    parser.add_argument(
+        "--synthetic",
+        action="append",
+        default=[],
+        metavar="PATH=SIZE",
+        help="Serve a generated file of SIZE bytes at PATH",
+    )
+    args = parser.parse_args()
+    emulator = Emulator(
+        root=args.root,
+        port=args.port,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        rate_limit=args.rate_limit,
+    )
+    for spec in args.synthetic:
+        path, size = spec.rsplit("=", 1)
+        emulator.state.synthetic[path] = int(size)
+    print(emulator.url, flush=True)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.close()
+
+
+if __name__ == "__main__":
+    main()
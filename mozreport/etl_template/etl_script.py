@@ -1,16 +1,72 @@
 # This is a script for computing the core product metrics for an experiment.
 
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import hashlib
+import json
 import re
 import os
 import shutil
 import sqlite3
 import sys
 import tempfile
+import time
+from urllib.request import urlopen
 
 dbutils.library.installPyPI("click")  # noqa:F821 unknown name dbutils
 
 import click  # noqa:E402 import not at top of file
 
+# mozreport:begin-config
+# `mozreport new` fills in this block from mozreport.toml;
+# edit the config file and re-run it instead of changing these by hand.
+# The values are the defaults for the command-line options below.
+SLUG = None
+UUID = None
+ENROLLMENT_START = None
+ENROLLMENT_END = None
+OBSERVATION_END = None
+SAMPLE_PERCENT = 100
+OUTPUT_FORMAT = "sqlite"
+SKEW_MODE = "none"
+MAX_PINGS_PER_CLIENT_DAY = None
+METRICS = [
+    "EngagementAvgDailyHours",
+    "EngagementAvgDailyActiveHours",
+    "EngagementHourlyUris",
+    "EngagementIntensity",
+]
+COLUMNS_TO_AVERAGE = [
+    "subsession_length",
+    "active_ticks",
+    "scalar_parent_browser_engagement_total_uri_count",
+]
+# mozreport:end-config
+
+# Outputs get a manifest of SHA-256 hashes of each block of this many bytes, the
+# largest DBFS read, so `mozreport fetch` can download only the blocks that changed.
+MANIFEST_BLOCK_SIZE = 1 << 20
+
+# Relative accuracy of the quantile sketches: a quantile read from a sketch is
+# within this fraction of the true value. mozreport.sketch reads the sketches.
+SKETCH_RELATIVE_ACCURACY = 0.01
+
+# Output formats that split per_user_daily_averages into a file per value of
+# these columns, listed in SHARD_MANIFEST next to summary.sqlite3
+SHARD_KEYS = {
+    "sharded": ["experiment_branch"],
+    "sharded-by-channel": ["experiment_branch", "normalized_channel"],
+}
+SHARD_MANIFEST = "shards.json"
+
+# Created in every output that has the table, so the fetched files, which
+# mozreport only ever reads, can find a branch's and channel's rows directly
+INDEXES = {
+    "per_user_daily_averages_branch_channel": (
+        "per_user_daily_averages", ["experiment_branch", "normalized_channel"],
+    ),
+}
+
 
 def name_to_stub(name):
     """
@@ -20,24 +76,356 @@ def name_to_stub(name):
     return re.sub(r"[^A-Za-z0-9]+", "_", name).strip("_").lower()
 
 
-def run_etl(slug, enrollment_end, output_path):
+def explain(df):
+    """Returns the parsed, analyzed, optimized and physical plans of a DataFrame,
+    as printed by `df.explain(True)`.
+    """
+    return df._jdf.queryExecution().toString()
+
+
+def stage_metrics(sc, stage_id):
+    """Describes one Spark stage.
+
+    Shuffle, spill and timing metrics come from the driver's monitoring REST API;
+    if that isn't reachable, we fall back to the task counts the StatusTracker knows.
+    """
+    api = "%s/api/v1/applications/%s/stages/%d" % (sc.uiWebUrl, sc.applicationId, stage_id)
+    try:
+        with urlopen(api, timeout=10) as response:
+            attempts = json.loads(response.read().decode("utf-8"))
+    except Exception:
+        info = sc.statusTracker().getStageInfo(stage_id)
+        if info is None:
+            return {"stageId": stage_id}
+        return {
+            "stageId": info.stageId,
+            "attemptId": info.currentAttemptId,
+            "name": info.name,
+            "numTasks": info.numTasks,
+            "numCompletedTasks": info.numCompletedTasks,
+            "numFailedTasks": info.numFailedTasks,
+        }
+
+    keys = [
+        "stageId", "attemptId", "name", "status", "numTasks", "numFailedTasks",
+        "submissionTime", "completionTime", "executorRunTime", "inputBytes",
+        "shuffleReadBytes", "shuffleReadRecords", "shuffleWriteBytes",
+        "shuffleWriteRecords", "memoryBytesSpilled", "diskBytesSpilled",
+    ]
+    attempt = attempts[-1]
+    result = {k: attempt.get(k) for k in keys}
+    try:
+        # Quantiles of per-task run time and shuffle reads are how skew shows up
+        summary_url = "%s/%d/taskSummary?quantiles=0.5,0.95,1.0" % (api, attempt["attemptId"])
+        with urlopen(summary_url, timeout=10) as response:
+            result["taskSummary"] = json.loads(response.read().decode("utf-8"))
+    except Exception:
+        pass
+    return result
+
+
+@contextmanager
+def diagnostics_phase(diagnostics, name):
+    """Tags the Spark jobs run inside the block so that their stages
+    can be recorded in `diagnostics[name]` afterwards.
+    """
+    sc = spark.sparkContext  # noqa:F821 unknown name spark
+    job_group = "mozreport-%s-%d" % (name, time.time() * 1000)
+    sc.setJobGroup(job_group, "mozreport: %s" % name)
+    phase = diagnostics.setdefault(name, {})
+    start = time.time()
+    try:
+        yield phase
+    finally:
+        phase["wall_seconds"] = time.time() - start
+        sc.setLocalProperty("spark.jobGroup.id", None)
+        tracker = sc.statusTracker()
+        stage_ids = []
+        for job_id in sorted(tracker.getJobIdsForGroup(job_group)):
+            job = tracker.getJobInfo(job_id)
+            if job is not None:
+                stage_ids.extend(job.stageIds)
+        phase["stages"] = [stage_metrics(sc, i) for i in sorted(set(stage_ids))]
+
+
+def drop_heavy_client_days(df, max_pings):
+    """Drops the client-days with more than `max_pings` pings.
+
+    Returns the filtered DataFrame and a pandas DataFrame counting the
+    client-days and pings that were dropped from each experiment's branches.
+    """
+    from pyspark.sql import functions as f
+
+    keys = ["experiment_id", "client_id", "submission_date_s3", "experiment_branch"]
+    heavy = (
+        df
+        .groupBy(*keys)
+        .count()
+        .filter(f.col("count") > max_pings)
+        .cache()
+    )
+    capped = (
+        heavy
+        .groupBy("experiment_id", "experiment_branch")
+        .agg(
+            f.count("*").alias("client_days"),
+            f.sum("count").alias("pings"),
+        )
+        .toPandas()
+    )
+    # The heavy client-days are few, so they're collected, which lets the cache
+    # go, and broadcast, which keeps the anti-join from shuffling (and
+    # re-skewing) the experiment data.
+    heavy_keys = heavy.select(*keys)
+    heavy_keys = spark.createDataFrame(heavy_keys.collect(), heavy_keys.schema)  # noqa
+    heavy.unpersist()
+    filtered = df.join(f.broadcast(heavy_keys), on=keys, how="left_anti")
+    return filtered, capped
+
+
+def daily_sums(df, keys, columns, skew_mode, salt_buckets):
+    """Sums `columns` over `keys`.
+
+    With skew_mode="salted", the rows of each key are first spread over
+    `salt_buckets` random partial aggregates, so no single task has to
+    sum every ping of a heavy client.
+    """
+    from pyspark.sql import functions as f
+
+    if skew_mode != "salted":
+        return df.groupBy(*keys).agg(*[f.sum(c).alias(c) for c in columns])
+    return (
+        df
+        .withColumn("_salt", (f.rand(seed=0) * salt_buckets).cast("int"))
+        .groupBy("_salt", *keys)
+        .agg(*[f.sum(c).alias(c) for c in columns])
+        .groupBy(*keys)
+        .agg(*[f.sum(c).alias(c) for c in columns])
+    )
+
+
+def quantile_sketches(per_user, columns, relative_accuracy):
+    """Summarizes the distribution of each column per experiment, branch and channel.
+
+    Each value is counted in a logarithmic bucket, as in DDSketch: bucket i
+    of sign s holds the values v with gamma^(i-1) < |v| <= gamma^i, where
+    gamma = (1 + relative_accuracy) / (1 - relative_accuracy). Zeros go in
+    sign 0, bucket 0. The sketches of disjoint sets of clients merge by
+    adding the counts of matching buckets, so branches, channels, samples
+    and runs can be combined without the per-user rows.
+    """
+    from pyspark.sql import functions as f
+
+    gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+    keys = ["experiment_id", "experiment_branch", "normalized_channel"]
+    values = f.explode(f.array(*[
+        f.struct(f.lit(c).alias("metric"), f.col(c).cast("double").alias("value"))
+        for c in columns
+    ]))
+    magnitude = f.abs(f.col("value"))
+    return (
+        per_user
+        .select(*keys, values.alias("m"))
+        .select(*keys, "m.metric", "m.value")
+        .filter(f.col("value").isNotNull() & ~f.isnan("value"))
+        .select(
+            *keys,
+            "metric",
+            f.signum("value").cast("int").alias("sign"),
+            f.when(magnitude == 0, 0)
+            .otherwise(f.ceil(f.log(gamma, magnitude)))
+            .cast("int")
+            .alias("bucket"),
+        )
+        .groupBy(*keys, "metric", "sign", "bucket")
+        .count()
+    )
+
+
+def analysis_window(experiment):
+    """The first and last submission_date_s3 (YYYYMMDD) to analyze for an experiment.
+
+    Analysis starts the day after enrollment ends, or when enrollment starts
+    if the end isn't known. Either bound may be None.
+    """
+    first = experiment["enrollment_start"]
+    if experiment["enrollment_end"]:
+        day_after = datetime.strptime(experiment["enrollment_end"], "%Y%m%d") + timedelta(days=1)
+        first = day_after.strftime("%Y%m%d")
+    return first, experiment["observation_end"]
+
+
+def date_filter(first, last):
+    """A filter on submission_date_s3 between first and last, inclusive, or None."""
+    from pyspark.sql import functions as f
+
+    condition = None
+    if first:
+        condition = f.col("submission_date_s3") >= first
+    if last:
+        before_end = f.col("submission_date_s3") <= last
+        condition = before_end if condition is None else condition & before_end
+    return condition
+
+
+def block_manifest(path, block_size=MANIFEST_BLOCK_SIZE):
+    """Describes a file as the SHA-256 of each of its blocks."""
+    blocks = []
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            blocks.append(hashlib.sha256(block).hexdigest())
+    return {
+        "algorithm": "sha256",
+        "block_size": block_size,
+        "size": os.path.getsize(path),
+        "blocks": blocks,
+    }
+
+
+def write_sqlite(output_path, tables):
+    """Writes pandas DataFrames to a new SQLite database at output_path, replacing it.
+
+    The tables get their INDEXES before the file is hashed. A block manifest
+    is written next to it, as output_path + ".blocks.json".
+    """
+    temp_db_file = tempfile.NamedTemporaryFile(delete=False)
+    temp_db_path = temp_db_file.name
+    temp_db_file.close()
+    conn = sqlite3.connect(temp_db_path)
+    for name, table in tables.items():
+        table.to_sql(name, conn, index=False)
+    for name, (table, columns) in INDEXES.items():
+        if table in tables:
+            conn.execute("CREATE INDEX %s ON %s (%s)" % (name, table, ", ".join(columns)))
+    conn.commit()
+    conn.close()
+    manifest = block_manifest(temp_db_path)
+
+    if not os.path.exists(os.path.dirname(output_path)):
+        os.makedirs(os.path.dirname(output_path))
+    manifest_path = output_path + ".blocks.json"
+    # The manifest goes last, so a manifest never describes a different file
+    for path in (manifest_path, output_path):
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.copy(src=temp_db_path, dst=output_path)
+    os.remove(temp_db_path)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+
+
+def shard_tables(table, keys):
+    """Splits a DataFrame into (values, rows) pairs, one per distinct value of keys.
+
+    Missing values, which Spark writes as None or NaN, form their own shard.
+    """
+    shards = []
+    for values in table[keys].drop_duplicates().itertuples(index=False):
+        values = [None if v is None or v != v else v for v in values]
+        mask = True
+        for key, value in zip(keys, values):
+            column = table[key]
+            mask = mask & (column.isnull() if value is None else column == value)
+        shards.append((dict(zip(keys, values)), table[mask]))
+    return shards
+
+
+def write_sharded(output_path, tables, keys):
+    """Writes tables like write_sqlite, with per_user_daily_averages split by keys.
+
+    output_path gets every other table, and is written first, so the small
+    summary can be fetched while the shards are being written. The shards go
+    in a shards directory next to it, and SHARD_MANIFEST, which lists the
+    file and key values of each shard, is written last.
+    """
+    directory = os.path.dirname(output_path)
+    manifest_path = os.path.join(directory, SHARD_MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    write_sqlite(output_path, {k: v for k, v in tables.items() if k != "per_user_daily_averages"})
+
+    shard_directory = os.path.join(directory, "shards")
+    if os.path.exists(shard_directory):
+        shutil.rmtree(shard_directory)
+    shards = []
+    for i, (values, table) in enumerate(shard_tables(tables["per_user_daily_averages"], keys)):
+        stub = "-".join(name_to_stub(str(v)) for v in values.values())
+        filename = "shards/%03d-%s.sqlite3" % (i, stub)
+        write_sqlite(os.path.join(directory, filename), {"per_user_daily_averages": table})
+        shard = {"path": filename, "rows": len(table)}
+        shard.update(values)
+        shards.append(shard)
+    manifest = {"table": "per_user_daily_averages", "keys": keys, "shards": shards}
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+
+
+def run_etl(
+    experiments,
+    sample_percent=100,
+    output_format="sqlite",
+    skew_mode="none",
+    salt_buckets=32,
+    max_pings_per_client_day=None,
+):
+    """Computes the summary of each experiment in one job.
+
+    `experiments` is a list of dicts with the slug, enrollment_start,
+    enrollment_end, observation_end, output_path and diagnostics_path of
+    each experiment. The experiments table is scanned once for all of them;
+    each experiment still gets its own output and diagnostics files.
+    """
     from mozanalysis import metrics
     from mozanalysis.experiments import ExperimentAnalysis
+    import pandas as pd
     from pyspark.sql import functions as f
 
-    blessed_metrics = [
-      metrics.EngagementAvgDailyHours,
-      metrics.EngagementAvgDailyActiveHours,
-      metrics.EngagementHourlyUris,
-      metrics.EngagementIntensity,
-    ]
+    blessed_metrics = [getattr(metrics, name) for name in METRICS]
 
     spark.conf.set("spark.databricks.queryWatchdog.enabled", False)  # noqa
-    experiments = spark.table("experiments")  # noqa
-    my_experiment = experiments.filter(experiments.experiment_id == slug)
-    if enrollment_end:
-        my_experiment = my_experiment.filter(my_experiment.submission_date_s3 > enrollment_end)
-    summary = ExperimentAnalysis(my_experiment).metrics(*blessed_metrics).run()
+    if skew_mode == "aqe":
+        # Adaptive execution rebalances shuffle partitions, but its skew handling
+        # only splits sort-merge joins, not the per-client groupBy that heavy
+        # clients skew here; use skew_mode="salted" for that.
+        spark.conf.set("spark.sql.adaptive.enabled", True)  # noqa
+        spark.conf.set("spark.sql.adaptive.skewJoin.enabled", True)  # noqa
+        spark.conf.set("spark.sql.adaptive.coalescePartitions.enabled", True)  # noqa
+    experiments_table = spark.table("experiments")  # noqa
+    slugs = [e["slug"] for e in experiments]
+    windows = [analysis_window(e) for e in experiments]
+    # experiment_id and submission_date_s3 partition the experiments table.
+    # Filtering on them before anything else lets Spark skip the partitions
+    # outside of the batch's experiments and dates instead of reading them.
+    in_batch = experiments_table.filter(f.col("experiment_id").isin(*slugs))
+    firsts = [first for first, _ in windows]
+    lasts = [last for _, last in windows]
+    batch_dates = date_filter(
+        min(firsts) if all(firsts) else None,
+        max(lasts) if all(lasts) else None,
+    )
+    if batch_dates is not None:
+        in_batch = in_batch.filter(batch_dates)
+    condition = None
+    for e, (first, last) in zip(experiments, windows):
+        this_experiment = f.col("experiment_id") == e["slug"]
+        dates = date_filter(first, last)
+        if dates is not None:
+            this_experiment = this_experiment & dates
+        condition = this_experiment if condition is None else condition | this_experiment
+    in_batch = in_batch.filter(condition)
+    if sample_percent < 100:
+        in_batch = in_batch.filter(f.col("sample_id").cast("int") < sample_percent)
+
+    diagnostics = {}
+    capped = None
+    if max_pings_per_client_day is not None:
+        with diagnostics_phase(diagnostics, "drop_heavy_client_days"):
+            in_batch, capped = drop_heavy_client_days(in_batch, max_pings_per_client_day)
+
+    if len(experiments) > 1:
+        # Each experiment's analysis reads the batch from the cache instead of
+        # scanning the experiments table again.
+        in_batch = in_batch.cache()
 
     facets = [
         "client_id",
@@ -45,61 +433,189 @@ def run_etl(slug, enrollment_end, output_path):
         "normalized_channel",
     ]
 
-    columns_to_average = [
-        "subsession_length",
-        "active_ticks",
-        "scalar_parent_browser_engagement_total_uri_count",
-    ]
+    columns_to_average = COLUMNS_TO_AVERAGE
 
     per_user_daily_averages = (
-        my_experiment
-        .groupBy("submission_date_s3", *facets)
-        .agg(
-            *[f.sum(c).alias(c) for c in columns_to_average]
+        daily_sums(
+            in_batch,
+            ["experiment_id", "submission_date_s3"] + facets,
+            columns_to_average,
+            skew_mode,
+            salt_buckets,
         )
-        .groupBy(*facets)
+        .groupBy("experiment_id", *facets)
         .agg(
             f.count("*").alias("days_active"),
+            # Only kept until the dates found in each experiment's window are read off
+            f.min("submission_date_s3").alias("first_submission_date"),
+            f.max("submission_date_s3").alias("last_submission_date"),
             *[f.avg(c).alias(c) for c in columns_to_average]
         )
-        .toPandas()
     )
+    # Cached, because the sketches are computed from it too
+    per_user_daily_averages = per_user_daily_averages.cache()
+    with diagnostics_phase(diagnostics, "per_user_daily_averages") as phase:
+        phase["plan"] = explain(per_user_daily_averages)
+        per_user = per_user_daily_averages.toPandas()
+    # The first and last dates that were actually found, from the per-client
+    # aggregate instead of another pass over the experiments table
+    dates = ["first_submission_date", "last_submission_date"]
+    observed = per_user.groupby("experiment_id").agg(
+        {"first_submission_date": "min", "last_submission_date": "max"}
+    )
+    per_user = per_user.drop(columns=dates)
 
-    temp_db_file = tempfile.NamedTemporaryFile(delete=False)
-    temp_db_path = temp_db_file.name
-    temp_db_file.close()
-    conn = sqlite3.connect(temp_db_path)
-    summary.to_sql("summary", conn, index=False)
-    per_user_daily_averages.to_sql("per_user_daily_averages", conn, index=False)
-    conn.close()
+    with diagnostics_phase(diagnostics, "quantile_sketches") as phase:
+        sketches = quantile_sketches(
+            per_user_daily_averages,
+            ["days_active"] + columns_to_average,
+            SKETCH_RELATIVE_ACCURACY,
+        )
+        phase["plan"] = explain(sketches)
+        sketches = sketches.toPandas()
+    per_user_daily_averages.unpersist()
 
-    if not os.path.exists(os.path.dirname(output_path)):
-        os.makedirs(os.path.dirname(output_path))
-    if os.path.exists(output_path):
-        os.remove(output_path)
-    shutil.copy(src=temp_db_path, dst=output_path)
+    for e in experiments:
+        experiment_diagnostics = dict(diagnostics)
+        with diagnostics_phase(experiment_diagnostics, "experiment_analysis") as phase:
+            my_experiment = in_batch.filter(f.col("experiment_id") == e["slug"])
+            phase["plan"] = explain(my_experiment)
+            summary = ExperimentAnalysis(my_experiment).metrics(*blessed_metrics).run()
 
+        mine = per_user["experiment_id"] == e["slug"]
+        tables = {
+            "summary": summary,
+            # Sorted, so that rows that didn't change since the last run land in
+            # the same pages, and the same manifest blocks, of the new file
+            "per_user_daily_averages": (
+                per_user[mine].drop(columns="experiment_id").sort_values(facets)
+            ),
+            "quantile_sketches": (
+                sketches[sketches["experiment_id"] == e["slug"]].drop(columns="experiment_id")
+            ),
+        }
+        if capped is not None:
+            tables["capped_pings"] = (
+                capped[capped["experiment_id"] == e["slug"]].drop(columns="experiment_id")
+            )
+        # The window that was asked for, and the dates that were actually found in it
+        metadata = [
+            ("enrollment_start", e["enrollment_start"]),
+            ("enrollment_end", e["enrollment_end"]),
+            ("observation_end", e["observation_end"]),
+            ("sample_percent", str(sample_percent)),
+            ("sketch_relative_accuracy", str(SKETCH_RELATIVE_ACCURACY)),
+        ]
+        for name in dates:
+            metadata.append((name, observed[name].get(e["slug"])))
+        tables["etl_metadata"] = pd.DataFrame(metadata, columns=["name", "value"])
+        if output_format in SHARD_KEYS:
+            write_sharded(e["output_path"], tables, SHARD_KEYS[output_format])
+        else:
+            write_sqlite(e["output_path"], tables)
 
-@click.command()
-@click.option("--slug", required=True, type=str)
-@click.option("--uuid", required=True, type=str)
-@click.option("--enrollment-end", type=str)
-@click.option("--test", is_flag=True)
-def cli(slug, uuid, enrollment_end, test):
-    safe_slug = name_to_stub(slug)
-    output_path = os.path.join(
+        with open(e["diagnostics_path"], "w") as f:
+            json.dump(experiment_diagnostics, f, indent=2, sort_keys=True)
+
+
+def working_path(slug, uuid):
+    return os.path.join(
         "/",
         "dbfs",
         "mozreport",
-        "%s-%s" % (safe_slug, uuid),
-        "summary.sqlite3"
+        "%s-%s" % (name_to_stub(slug), uuid),
     )
+
+
+@click.command()
+@click.option("--slug", default=SLUG, type=str)
+@click.option("--uuid", default=UUID, type=str)
+@click.option("--enrollment-start", default=ENROLLMENT_START, type=str)
+@click.option("--enrollment-end", default=ENROLLMENT_END, type=str)
+@click.option("--observation-end", default=OBSERVATION_END, type=str)
+@click.option(
+    "--experiments",
+    "batch",
+    type=str,
+    help=(
+        "A JSON list of objects with the slug, uuid, enrollment_start, enrollment_end "
+        "and observation_end of several experiments to analyze together, "
+        "instead of the single-experiment options"
+    ),
+)
+@click.option("--sample-percent", default=SAMPLE_PERCENT, type=click.IntRange(1, 100))
+@click.option(
+    "--output-format",
+    default=OUTPUT_FORMAT,
+    type=click.Choice(["sqlite"] + sorted(SHARD_KEYS)),
+)
+@click.option(
+    "--skew-mode",
+    default=SKEW_MODE,
+    type=click.Choice(["none", "aqe", "salted"]),
+)
+@click.option("--salt-buckets", type=int, default=32)
+@click.option("--max-pings-per-client-day", default=MAX_PINGS_PER_CLIENT_DAY, type=int)
+@click.option("--test", is_flag=True)
+def cli(
+    slug,
+    uuid,
+    enrollment_start,
+    enrollment_end,
+    observation_end,
+    batch,
+    sample_percent,
+    output_format,
+    skew_mode,
+    salt_buckets,
+    max_pings_per_client_day,
+    test,
+):
+    if batch:
+        batch = json.loads(batch)
+    elif slug is None or uuid is None:
+        raise click.UsageError("Either --slug and --uuid, or --experiments, are required.")
+    else:
+        batch = [{
+            "slug": slug,
+            "uuid": uuid,
+            "enrollment_start": enrollment_start,
+            "enrollment_end": enrollment_end,
+            "observation_end": observation_end,
+        }]
+    experiments = []
+    for e in batch:
+        path = working_path(e["slug"], e["uuid"])
+        experiments.append({
+            "slug": e["slug"],
+            "enrollment_start": e.get("enrollment_start"),
+            "enrollment_end": e.get("enrollment_end"),
+            "observation_end": e.get("observation_end"),
+            "output_path": os.path.join(path, "summary.sqlite3"),
+            "diagnostics_path": os.path.join(path, "diagnostics.json"),
+        })
     if test:
-        print("Slug:", slug)
-        print("Last day of enrollment period:", enrollment_end)
-        print("Output path:", output_path)
+        for e in experiments:
+            print("Slug:", e["slug"])
+            print("First day of enrollment period:", e["enrollment_start"])
+            print("Last day of enrollment period:", e["enrollment_end"])
+            print("Last day of observation period:", e["observation_end"])
+            print("Submission dates analyzed: %s to %s" % analysis_window(e))
+            print("Output path:", e["output_path"])
+            print("Diagnostics path:", e["diagnostics_path"])
+        print("Sample percent:", sample_percent)
+        print("Output format:", output_format)
+        print("Skew mode:", skew_mode)
+        print("Max pings per client per day:", max_pings_per_client_day)
         sys.exit(0)
-    run_etl(slug, enrollment_end, output_path)
+    run_etl(
+        experiments,
+        sample_percent=sample_percent,
+        output_format=output_format,
+        skew_mode=skew_mode,
+        salt_buckets=salt_buckets,
+        max_pings_per_client_day=max_pings_per_client_day,
+    )
 
 
 if __name__ == "__main__":
@@ -1,18 +1,92 @@
+import ast
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import json
+import os
 from pathlib import Path
-from typing import Optional
+import re
+from typing import List, Optional, Tuple
 
 import attr
-import cattr
-import toml
 
 from . import databricks
+from .cache import ResultCache
+from .delta import download
+from .shards import SHARD_MANIFEST
 from .util import name_to_stub
 
 
+DEFAULT_METRICS = [
+    "EngagementAvgDailyHours",
+    "EngagementAvgDailyActiveHours",
+    "EngagementHourlyUris",
+    "EngagementIntensity",
+]
+
+DEFAULT_COLUMNS_TO_AVERAGE = [
+    "subsession_length",
+    "active_ticks",
+    "scalar_parent_browser_engagement_total_uri_count",
+]
+
+
 @attr.s
 class ExperimentConfig:
     uuid: str = attr.ib()
     slug: str = attr.ib()
+    # Analysis window, as YYYYMMDD submission dates. The analysis covers the days
+    # after enrollment_end (or from enrollment_start, if the end isn't set)
+    # through observation_end.
+    enrollment_start: Optional[str] = attr.ib(default=None)
+    enrollment_end: Optional[str] = attr.ib(default=None)
+    observation_end: Optional[str] = attr.ib(default=None)
+    sample_percent: int = attr.ib(default=100)
+    output_format: str = attr.ib(default="sqlite")
+    skew_mode: str = attr.ib(default="none")
+    max_pings_per_client_day: Optional[int] = attr.ib(default=None)
+    # Names of mozanalysis.metrics classes to compute with ExperimentAnalysis
+    metrics: List[str] = attr.ib(factory=lambda: list(DEFAULT_METRICS))
+    # main_summary columns to sum per client-day and average per client
+    columns_to_average: List[str] = attr.ib(factory=lambda: list(DEFAULT_COLUMNS_TO_AVERAGE))
+
+    # The sharded formats split per_user_daily_averages into a file per branch,
+    # or per branch and channel; see mozreport.shards
+    valid_output_formats = ["sqlite", "sharded", "sharded-by-channel"]
+    valid_skew_modes = ["none", "aqe", "salted"]
+
+    @enrollment_start.validator
+    @enrollment_end.validator
+    @observation_end.validator
+    def validate_date(self, attribute, value) -> None:
+        if value is not None and not re.match(r"^\d{8}$", value):
+            raise ValueError(f"{attribute.name} must be a date like 20190131")
+
+    def __attrs_post_init__(self) -> None:
+        window = [self.enrollment_start, self.enrollment_end, self.observation_end]
+        dates = [d for d in window if d is not None]
+        if dates != sorted(dates):
+            raise ValueError(
+                "enrollment_start, enrollment_end and observation_end must be in order"
+            )
+
+    @sample_percent.validator
+    def validate_sample_percent(self, attribute, value) -> None:
+        if not 1 <= value <= 100:
+            raise ValueError("sample_percent must be between 1 and 100")
+
+    @output_format.validator
+    def validate_output_format(self, attribute, value) -> None:
+        if value not in self.valid_output_formats:
+            raise ValueError(
+                "Invalid output format; choices are: %s" %
+                ", ".join(self.valid_output_formats))
+
+    @skew_mode.validator
+    def validate_skew_mode(self, attribute, value) -> None:
+        if value not in self.valid_skew_modes:
+            raise ValueError(
+                "Invalid skew mode; choices are: %s" %
+                ", ".join(self.valid_skew_modes))
 
     @staticmethod
     def _default_config_path():
@@ -20,12 +94,16 @@ class ExperimentConfig:
 
     @classmethod
     def from_file(cls, config_path: Optional[Path] = None) -> "ExperimentConfig":
+        import cattr
+        import toml
         config_path = config_path or cls._default_config_path()
         with open(config_path, "r") as f:
             blob = toml.load(f)
         return cattr.structure(blob, cls)
 
     def save(self, config_path: Optional[Path] = None) -> None:
+        import cattr
+        import toml
         config_path = config_path or self._default_config_path()
         d = cattr.unstructure(self)
         config_path.parent.mkdir(parents=True, exist_ok=True)
@@ -37,11 +115,119 @@ class ExperimentConfig:
         slug = name_to_stub(self.slug)
         return f"/mozreport/{slug}-{self.uuid}"
 
+    def script_parameters(self) -> dict:
+        """Values for the config block of the ETL script."""
+        return {
+            "SLUG": self.slug,
+            "UUID": self.uuid,
+            "ENROLLMENT_START": self.enrollment_start,
+            "ENROLLMENT_END": self.enrollment_end,
+            "OBSERVATION_END": self.observation_end,
+            "SAMPLE_PERCENT": self.sample_percent,
+            "OUTPUT_FORMAT": self.output_format,
+            "SKEW_MODE": self.skew_mode,
+            "MAX_PINGS_PER_CLIENT_DAY": self.max_pings_per_client_day,
+            "METRICS": self.metrics,
+            "COLUMNS_TO_AVERAGE": self.columns_to_average,
+        }
+
+
+ETL_TEMPLATE_PATH = Path(__file__).parent/"etl_template"/"etl_script.py"
+
+CONFIG_BLOCK = re.compile(
+    r"^# mozreport:begin-config\n.*?^# mozreport:end-config\n",
+    re.MULTILINE | re.DOTALL,
+)
+
+
+@attr.s(frozen=True)
+class ScriptTemplate:
+    """A Python script with a config block of `NAME = literal` assignments.
+
+    The block is delimited by `# mozreport:begin-config` and
+    `# mozreport:end-config` lines. Its assignments declare the template's
+    parameters and their defaults, so the template is itself a runnable script.
+    """
+    head: str = attr.ib()
+    defaults: Tuple[Tuple[str, object], ...] = attr.ib()
+    tail: str = attr.ib()
+
+    @classmethod
+    def parse(cls, source: str) -> "ScriptTemplate":
+        match = CONFIG_BLOCK.search(source)
+        if not match:
+            raise ValueError("Template has no mozreport config block")
+        defaults = []
+        for statement in ast.parse(match.group(0)).body:
+            if not (
+                isinstance(statement, ast.Assign)
+                and len(statement.targets) == 1
+                and isinstance(statement.targets[0], ast.Name)
+            ):
+                raise ValueError("Config blocks may only contain NAME = literal assignments")
+            defaults.append((statement.targets[0].id, ast.literal_eval(statement.value)))
+        return cls(
+            head=source[:match.start()],
+            defaults=tuple(defaults),
+            tail=source[match.end():],
+        )
+
+    def render(self, values: dict) -> str:
+        names = [name for name, _ in self.defaults]
+        unknown = set(values) - set(names)
+        if unknown:
+            raise ValueError("Unknown template parameters: %s" % ", ".join(sorted(unknown)))
+        lines = ["# mozreport:begin-config", "# Generated from mozreport.toml."]
+        for name, default in self.defaults:
+            lines.append(f"{name} = {values.get(name, default)!r}")
+        lines.append("# mozreport:end-config")
+        return self.head + "\n".join(lines) + "\n" + self.tail
+
+
+@lru_cache(maxsize=None)
+def load_script_template(path: Path) -> ScriptTemplate:
+    """Reads and parses a script template once per process."""
+    return ScriptTemplate.parse(path.read_text())
+
+
+@lru_cache(maxsize=1024)
+def _render_script(path: Path, config_key: str) -> str:
+    return load_script_template(path).render(json.loads(config_key))
+
+
+def generate_etl_script(experiment_config: ExperimentConfig) -> str:
+    # The rendered script depends only on the template and these values,
+    # so they (serialized canonically) are the cache key.
+    config_key = json.dumps(experiment_config.script_parameters(), sort_keys=True, default=str)
+    return _render_script(ETL_TEMPLATE_PATH, config_key)
+
+
+# The parameters that can differ between the experiments of a batch
+PER_EXPERIMENT_PARAMETERS = [
+    "SLUG", "UUID", "ENROLLMENT_START", "ENROLLMENT_END", "OBSERVATION_END",
+]
 
-def generate_etl_script(experiment_config):
-    etl_script_path = Path(__file__).parent/"etl_template"/"etl_script.py"
-    etl_script = etl_script_path.read_text()
-    return etl_script
+# Analysis window fields, and the ETL script options they're passed as
+WINDOW_OPTIONS = [
+    ("enrollment_start", "--enrollment-start"),
+    ("enrollment_end", "--enrollment-end"),
+    ("observation_end", "--observation-end"),
+]
+
+
+def _shared_params(experiment: ExperimentConfig) -> List[str]:
+    params = ["--sample-percent", str(experiment.sample_percent)]
+    params.extend(["--output-format", experiment.output_format])
+    params.extend(["--skew-mode", experiment.skew_mode])
+    if experiment.max_pings_per_client_day is not None:
+        params.extend(["--max-pings-per-client-day", str(experiment.max_pings_per_client_day)])
+    return params
+
+
+def _upload_script(etl_script: str, destination: str, client: databricks.Client) -> None:
+    if client.file_exists(destination):
+        client.delete_file(destination)
+    client.upload_file(etl_script, destination)
 
 
 def submit_etl_script(
@@ -52,10 +238,12 @@ def submit_etl_script(
 ) -> None:
     remote_working_path = experiment.dbfs_working_path
     etl_script_destination = remote_working_path + "/mozreport_etl_script.py"
-    if client.file_exists(etl_script_destination):
-        client.delete_file(etl_script_destination)
-    client.upload_file(etl_script, etl_script_destination)
+    _upload_script(etl_script, etl_script_destination, client)
     params = ["--slug", experiment.slug, "--uuid", experiment.uuid]
+    for field, option in WINDOW_OPTIONS:
+        if getattr(experiment, field):
+            params.extend([option, getattr(experiment, field)])
+    params.extend(_shared_params(experiment))
     job_id = client.submit_python_task(
         experiment.slug,
         cluster_slug,
@@ -63,3 +251,114 @@ def submit_etl_script(
         params
     )
     return job_id
+
+
+def submit_etl_batch(
+    experiments: List[ExperimentConfig],
+    client: databricks.Client,
+    cluster_slug: str,
+) -> int:
+    """Runs the default ETL script for several experiments as one Databricks job.
+
+    The job reads the experiments table once for all of them, and writes
+    each experiment's results to its own dbfs_working_path. The experiments
+    may only differ in the PER_EXPERIMENT_PARAMETERS; raises ValueError otherwise.
+    """
+    if not experiments:
+        raise ValueError("No experiments to submit")
+
+    def shared(experiment):
+        return {
+            k: v for k, v in experiment.script_parameters().items()
+            if k not in PER_EXPERIMENT_PARAMETERS
+        }
+
+    first = shared(experiments[0])
+    for experiment in experiments[1:]:
+        different = sorted(k for k, v in shared(experiment).items() if first[k] != v)
+        if different:
+            raise ValueError(
+                f"{experiment.slug} can't be batched with {experiments[0].slug}; "
+                f"they differ in: {', '.join(different)}"
+            )
+
+    # The script is shared, so it lives in a working path of its own
+    batch_path = f"/mozreport/batch-{name_to_stub(experiments[0].slug)}-{experiments[0].uuid}"
+    etl_script_destination = batch_path + "/mozreport_etl_script.py"
+    _upload_script(generate_etl_script(experiments[0]), etl_script_destination, client)
+    batch = [
+        dict(
+            {"slug": e.slug, "uuid": e.uuid},
+            **{field: getattr(e, field) for field, _ in WINDOW_OPTIONS}
+        )
+        for e in experiments
+    ]
+    params = ["--experiments", json.dumps(batch)] + _shared_params(experiments[0])
+    return client.submit_python_task(
+        "mozreport batch: " + ", ".join(e.slug for e in experiments),
+        cluster_slug,
+        etl_script_destination,
+        params,
+    )
+
+
+def fetch_result_file(
+    client: databricks.Client,
+    working_path: str,
+    filename: str,
+    directory: Path = Path("."),
+    cache: Optional[ResultCache] = None,
+) -> Path:
+    """Downloads one output of an ETL run from its DBFS working path into directory.
+
+    With a cache, the file is only downloaded if the cache doesn't have it.
+    If there's a previous copy in directory, only the blocks that changed
+    are downloaded. The local file is replaced, never written in place,
+    since it may be a hard link into the cache.
+    """
+    remote_path = working_path + "/" + filename
+    destination = Path(directory)/filename
+    if cache is not None:
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        cache.fetch(client, remote_path, destination)
+        return destination
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    contents = download(client, remote_path, destination)
+    temp = destination.with_name(f".{destination.name}.download")
+    with open(temp, "wb") as f:
+        f.write(contents)
+    os.replace(temp, destination)
+    return destination
+
+
+def fetch_shards(
+    client: databricks.Client,
+    working_path: str,
+    directory: Path = Path("."),
+    cache: Optional[ResultCache] = None,
+    max_workers: int = databricks.MAX_CONCURRENT_REQUESTS,
+) -> List[Path]:
+    """Downloads the shards of a sharded result concurrently, if it has any.
+
+    The manifest is written after every shard has arrived, so readers never
+    see a manifest that lists missing shards. A local manifest left by an
+    earlier sharded run is removed first. Returns the paths of the shards.
+    """
+    local_manifest = Path(directory)/SHARD_MANIFEST
+    if local_manifest.exists():
+        local_manifest.unlink()
+    remote_manifest = working_path + "/" + SHARD_MANIFEST
+    if not client.file_exists(remote_manifest):
+        return []
+    contents = client.get_file(remote_manifest)
+    shards = json.loads(contents.decode("utf-8"))["shards"]
+
+    def fetch(shard):
+        return fetch_result_file(client, working_path, shard["path"], directory, cache=cache)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        paths = list(executor.map(fetch, shards))
+    temp = local_manifest.with_name(f".{SHARD_MANIFEST}.download")
+    temp.write_bytes(contents)
+    os.replace(temp, local_manifest)
+    return paths
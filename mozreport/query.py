@@ -0,0 +1,122 @@
+import csv
+import json
+from pathlib import Path
+import sqlite3
+from typing import IO, List, Optional, Sequence, Union
+
+from .shards import open_result
+
+PER_USER_TABLE = "per_user_daily_averages"
+FACETS = ["client_id", "experiment_branch", "normalized_channel"]
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+
+def quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    """The columns of a table or view, or [] if there's no such thing."""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({quote(table)})")]
+
+
+def averaged_columns(conn: sqlite3.Connection) -> List[str]:
+    """The per-user columns that aren't facets, i.e. days_active and columns_to_average."""
+    return [c for c in table_columns(conn, PER_USER_TABLE) if c not in FACETS]
+
+
+def create_views(conn: sqlite3.Connection) -> None:
+    """Defines the branch_means and branch_quantiles views for this connection.
+
+    The views are temporary, so they work on read-only databases and always
+    match the columns of the table they summarize. They aren't defined if
+    there's no per-user table, or it has nothing to average.
+    """
+    columns = averaged_columns(conn)
+    if not columns:
+        return
+    means = ", ".join(f"AVG({quote(c)}) AS {quote(c)}" for c in columns)
+    conn.execute(f"""
+        CREATE TEMP VIEW IF NOT EXISTS branch_means AS
+        SELECT experiment_branch, COUNT(*) AS clients, {means}
+        FROM {quote(PER_USER_TABLE)}
+        GROUP BY experiment_branch
+    """)
+
+    # Nearest-rank quantiles: the smallest value whose rank is at least q * n
+    quantiles = ", ".join(
+        f"MIN(CASE WHEN rank >= {q} * n THEN value END) AS p{round(q * 100)}"
+        for q in QUANTILES
+    )
+    per_column = [
+        f"""
+        SELECT experiment_branch, '{c.replace("'", "''")}' AS column_name, MAX(n) AS n, {quantiles}
+        FROM (
+            SELECT
+                experiment_branch,
+                {quote(c)} AS value,
+                ROW_NUMBER() OVER (PARTITION BY experiment_branch ORDER BY {quote(c)}) AS rank,
+                COUNT(*) OVER (PARTITION BY experiment_branch) AS n
+            FROM {quote(PER_USER_TABLE)}
+            WHERE {quote(c)} IS NOT NULL
+        )
+        GROUP BY experiment_branch
+        """
+        for c in columns
+    ]
+    conn.execute(
+        "CREATE TEMP VIEW IF NOT EXISTS branch_quantiles AS " + " UNION ALL ".join(per_column)
+    )
+
+
+def open_summary(
+    path: Union[str, Path] = "summary.sqlite3",
+    branches: Optional[Sequence[Optional[str]]] = None,
+    channels: Optional[Sequence[Optional[str]]] = None,
+) -> sqlite3.Connection:
+    """Opens a fetched summary.sqlite3 for reading, with the prepared views.
+
+    Only the per-user rows of the given branches and channels are visible,
+    and, for a sharded result, only their shards are read; see open_result.
+    Fetched results are never written to, since they can be hard links into
+    the result cache; the ETL script creates the indexes they need.
+    """
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(str(path))
+    conn = open_result(path, branches, channels)
+    create_views(conn)
+    return conn
+
+
+def views(conn: sqlite3.Connection) -> List[str]:
+    return [
+        row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') "
+            "UNION ALL SELECT name FROM sqlite_temp_master WHERE type = 'view' "
+            "ORDER BY name"
+        )
+    ]
+
+
+def write_csv(cursor: sqlite3.Cursor, out: IO[str]) -> None:
+    """Writes query results as CSV, one row at a time."""
+    writer = csv.writer(out)
+    writer.writerow([d[0] for d in cursor.description])
+    writer.writerows(cursor)
+
+
+def write_json(cursor: sqlite3.Cursor, out: IO[str]) -> None:
+    """Writes query results as a JSON array of objects, one row at a time."""
+    names = [d[0] for d in cursor.description]
+    out.write("[")
+    for i, row in enumerate(cursor):
+        out.write(",\n" if i else "\n")
+        out.write(json.dumps(dict(zip(names, row))))
+    out.write("\n]\n")
+
+
+WRITERS = {
+    "csv": write_csv,
+    "json": write_json,
+}
@@ -0,0 +1,27 @@
+from pathlib import Path
+import sqlite3
+from typing import Union
+
+# Negative cache sizes are in KiB; this is 256 MiB
+DEFAULT_CACHE_SIZE_KIB = 256 * 1024
+
+
+def connect_readonly(
+    path: Union[str, Path] = "summary.sqlite3",
+    cache_size_kib: int = DEFAULT_CACHE_SIZE_KIB,
+    factory: type = sqlite3.Connection,
+) -> sqlite3.Connection:
+    """Opens a fetched result database for reading.
+
+    The database is opened with immutable=1, so SQLite skips locking and
+    change detection, and memory-maps the whole file, so pages are read
+    straight from the OS page cache instead of being copied into SQLite's.
+    Don't use it on a database that something else may be writing to.
+    """
+    path = Path(path).resolve()
+    if not path.exists():
+        raise FileNotFoundError(str(path))
+    conn = sqlite3.connect(path.as_uri() + "?immutable=1", uri=True, factory=factory)
+    conn.execute(f"PRAGMA mmap_size = {path.stat().st_size}")
+    conn.execute(f"PRAGMA cache_size = -{cache_size_kib}")
+    return conn
@@ -0,0 +1,148 @@
+from contextlib import closing
+from pathlib import Path
+import sqlite3
+import time
+from typing import List, Optional
+
+import attr
+
+from .util import get_data_dir
+
+# Life cycle states after which a run won't change again
+FINISHED_STATES = ["TERMINATED", "SKIPPED", "INTERNAL_ERROR"]
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS runs (
+        host TEXT NOT NULL,
+        run_id INTEGER NOT NULL,
+        slug TEXT NOT NULL,
+        working_path TEXT NOT NULL,
+        directory TEXT NOT NULL,
+        run_page_url TEXT,
+        submitted REAL NOT NULL,
+        life_cycle_state TEXT NOT NULL,
+        result_state TEXT,
+        fetched INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (host, run_id, working_path)
+    )
+"""
+
+
+@attr.s(frozen=True)
+class TrackedRun:
+    host: str = attr.ib()
+    run_id: int = attr.ib()
+    slug: str = attr.ib()
+    # Where the run writes its results on DBFS, and where `wait` should fetch them to
+    working_path: str = attr.ib()
+    directory: str = attr.ib()
+    run_page_url: Optional[str] = attr.ib()
+    submitted: float = attr.ib()
+    life_cycle_state: str = attr.ib()
+    result_state: Optional[str] = attr.ib()
+    fetched: bool = attr.ib(converter=bool)
+
+    @property
+    def finished(self) -> bool:
+        return self.life_cycle_state in FINISHED_STATES
+
+    @property
+    def succeeded(self) -> bool:
+        return self.life_cycle_state == "TERMINATED" and self.result_state == "SUCCESS"
+
+    @property
+    def state(self) -> str:
+        if self.finished:
+            return self.result_state or self.life_cycle_state
+        return self.life_cycle_state
+
+
+class RunTracker:
+    """Remembers submitted Databricks runs in a SQLite database in the data directory.
+
+    Runs are recorded when they're submitted, so `mozreport status` and
+    `mozreport wait` can follow them from any terminal, long after `submit`
+    has returned. A batch run is recorded once per experiment, since each
+    experiment's result is fetched separately.
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path or get_data_dir()/"runs.sqlite3"
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=30)
+        conn.execute(SCHEMA)
+        return conn
+
+    def record(
+        self,
+        host: str,
+        run_id: int,
+        slug: str,
+        working_path: str,
+        directory: Path,
+        info: dict,
+    ) -> TrackedRun:
+        """Starts tracking a run, given the response to runs/get for it."""
+        state = info.get("state", {})
+        run = TrackedRun(
+            host=host,
+            run_id=run_id,
+            slug=slug,
+            working_path=working_path,
+            directory=str(Path(directory).resolve()),
+            run_page_url=info.get("run_page_url"),
+            submitted=time.time(),
+            life_cycle_state=state.get("life_cycle_state", "PENDING"),
+            result_state=state.get("result_state"),
+            fetched=False,
+        )
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                attr.astuple(run),
+            )
+        return run
+
+    def update(self, run: TrackedRun, info: dict) -> TrackedRun:
+        """Stores the state from a runs/get response, and returns the updated run."""
+        state = info["state"]
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE runs SET life_cycle_state = ?, result_state = ? "
+                "WHERE host = ? AND run_id = ? AND working_path = ?",
+                (
+                    state["life_cycle_state"], state.get("result_state"),
+                    run.host, run.run_id, run.working_path,
+                ),
+            )
+        return attr.evolve(
+            run,
+            life_cycle_state=state["life_cycle_state"],
+            result_state=state.get("result_state"),
+        )
+
+    def mark_fetched(self, run: TrackedRun) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE runs SET fetched = 1 WHERE host = ? AND run_id = ? AND working_path = ?",
+                (run.host, run.run_id, run.working_path),
+            )
+
+    def runs(self, limit: Optional[int] = None) -> List[TrackedRun]:
+        """Tracked runs, most recently submitted first."""
+        if not self.path.exists():
+            return []
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT host, run_id, slug, working_path, directory, run_page_url, submitted, "
+                "life_cycle_state, result_state, fetched FROM runs "
+                "ORDER BY submitted DESC LIMIT ?",
+                (-1 if limit is None else limit,),
+            ).fetchall()
+        return [TrackedRun(*row) for row in rows]
+
+    def pending(self) -> List[TrackedRun]:
+        """Runs that are still going, or that succeeded and haven't been fetched."""
+        return [r for r in self.runs() if not r.finished or (r.succeeded and not r.fetched)]
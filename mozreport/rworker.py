@@ -0,0 +1,154 @@
+import json
+from pathlib import Path
+import re
+import subprocess
+import time
+from typing import Callable, Iterator, List, Optional, Sequence
+
+SENTINEL = "__mozreport_done__"
+
+# Loaded once per session. Reports can call mozreport_load_tables() to reuse
+# tables read by an earlier render, as long as the database hasn't changed.
+PRELUDE = """
+suppressPackageStartupMessages({
+  library(rmarkdown)
+  library(knitr)
+})
+mozreport_cache <- new.env()
+mozreport_read_table <- function(path, table) {
+  # Read-only and memory-mapped, like mozreport.results.connect_readonly
+  conn <- DBI::dbConnect(
+    RSQLite::SQLite(),
+    paste0("file:", path, "?immutable=1"),
+    flags=RSQLite::SQLITE_RO
+  )
+  on.exit(DBI::dbDisconnect(conn))
+  DBI::dbExecute(conn, sprintf("PRAGMA mmap_size = %.0f", file.size(path)))
+  DBI::dbExecute(conn, "PRAGMA cache_size = -262144")
+  DBI::dbReadTable(conn, table)
+}
+mozreport_load_tables <- function(path, tables) {
+  # The sharded output formats split one table across the databases in shards.json,
+  # which `mozreport fetch` rewrites whenever it downloads them
+  manifest_path <- file.path(dirname(path), "shards.json")
+  manifest <- NULL
+  files <- path
+  if (file.exists(manifest_path)) {
+    manifest <- jsonlite::fromJSON(manifest_path, simplifyDataFrame=FALSE)
+    files <- c(path, manifest_path)
+  }
+  info <- file.info(files)
+  key <- paste(normalizePath(files), info$size, as.numeric(info$mtime), collapse=" ")
+  if (!identical(mozreport_cache$key, key)) {
+    mozreport_cache$tables <- lapply(setNames(tables, tables), function(t) {
+      if (!is.null(manifest) && identical(t, manifest$table) && length(manifest$shards)) {
+        shards <- vapply(manifest$shards, function(s) s$path, "")
+        do.call(rbind, lapply(file.path(dirname(path), shards), mozreport_read_table, table=t))
+      } else {
+        mozreport_read_table(path, t)
+      }
+    })
+    mozreport_cache$key <- key
+  }
+  mozreport_cache$tables
+}
+"""
+
+
+class RWorker:
+    """A long-lived R session that evaluates expressions on request.
+
+    Each expression is sent to R's stdin as a single line. R prints a line
+    starting with SENTINEL and the expression's status when it's done.
+    Everything else R prints to stdout is passed to `echo`.
+    """
+    def __init__(
+        self,
+        command: Sequence[str] = ("R", "--slave", "--no-save", "--no-restore"),
+        echo: Callable[[str], None] = print,
+    ) -> None:
+        self.echo = echo
+        self.process = subprocess.Popen(
+            list(command),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            bufsize=1,
+        )
+
+    def __enter__(self) -> "RWorker":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def run(self, expression: str) -> bool:
+        """Evaluates `expression` in R's global environment.
+
+        Returns whether it finished without an error.
+        """
+        # A JSON string literal is also a valid R string literal.
+        line = (
+            "mozreport_status <- tryCatch({"
+            f"eval(parse(text={json.dumps(expression)}), envir=globalenv()); 'ok'"
+            "}, error=function(e) {message('Error: ', conditionMessage(e)); 'error'}); "
+            f"cat('\\n{SENTINEL} ', mozreport_status, '\\n', sep='')\n"
+        )
+        try:
+            self.process.stdin.write(line)
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            raise RWorkerException("The R session has exited")
+        for output in self.process.stdout:
+            output = output.rstrip("\n")
+            if output.startswith(SENTINEL):
+                return output[len(SENTINEL):].strip() == "ok"
+            if output:
+                self.echo(output)
+        raise RWorkerException("The R session has exited")
+
+    def render(self, report: Path) -> bool:
+        # A fresh environment per render, so objects from the last render can't leak in
+        return self.run(
+            f"rmarkdown::render({json.dumps(str(report))}, "
+            "envir=new.env(parent=globalenv()), quiet=TRUE)"
+        )
+
+    def close(self) -> None:
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write("quit(save='no')\n")
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+            self.process.wait()
+
+
+def required_packages(report: Path) -> List[str]:
+    """Finds the packages that an R Markdown document loads with library()."""
+    return sorted(set(re.findall(r"\blibrary\((\w+)\)", report.read_text())))
+
+
+def wait_for_changes(
+    paths: Sequence[Path],
+    interval: float = 1.0,
+    sleep: Callable[[float], None] = time.sleep,
+) -> Iterator[List[Path]]:
+    """Yields the list of changed paths each time any of them is modified."""
+    def stamp(path: Path) -> Optional[int]:
+        try:
+            return path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    stamps = {path: stamp(path) for path in paths}
+    while True:
+        sleep(interval)
+        changed = [path for path in paths if stamp(path) != stamps[path]]
+        if changed:
+            stamps.update({path: stamp(path) for path in changed})
+            yield changed
+
+
+class RWorkerException(Exception):
+    pass
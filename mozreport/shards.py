@@ -0,0 +1,189 @@
+from contextlib import closing
+import json
+from pathlib import Path
+import re
+import sqlite3
+from typing import List, Optional, Sequence, Union
+
+from .results import connect_readonly
+
+# Written next to summary.sqlite3 by the sharded output formats of the ETL script
+SHARD_MANIFEST = "shards.json"
+SHARDED_TABLE = "per_user_daily_averages"
+
+
+def read_manifest(directory: Union[str, Path] = ".") -> Optional[dict]:
+    """The shard manifest of the result in directory, or None if it isn't sharded."""
+    path = Path(directory)/SHARD_MANIFEST
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def branches(path: Union[str, Path] = "summary.sqlite3") -> List[Optional[str]]:
+    """The branches in a result, read from its manifest if it's sharded."""
+    path = Path(path)
+    manifest = read_manifest(path.parent)
+    if manifest is not None:
+        names = {shard["experiment_branch"] for shard in manifest["shards"]}
+    else:
+        with closing(connect_readonly(path)) as conn:
+            names = {r[0] for r in conn.execute(
+                f"SELECT DISTINCT experiment_branch FROM {SHARDED_TABLE}"
+            )}
+    return sorted(names, key=lambda b: (b is not None, b))
+
+
+def select_shards(
+    manifest: dict,
+    branches: Optional[Sequence[Optional[str]]] = None,
+    channels: Optional[Sequence[Optional[str]]] = None,
+) -> List[dict]:
+    """The shards that can hold rows of the given branches and channels; None means all."""
+    selected = []
+    for shard in manifest["shards"]:
+        if branches is not None and shard["experiment_branch"] not in branches:
+            continue
+        # Shards by branch alone hold every channel
+        if (
+            channels is not None
+            and "normalized_channel" in manifest["keys"]
+            and shard["normalized_channel"] not in channels
+        ):
+            continue
+        selected.append(shard)
+    return selected
+
+
+def literal(value: Optional[str]) -> str:
+    return "NULL" if value is None else "'" + str(value).replace("'", "''") + "'"
+
+
+def row_filter(
+    branches: Optional[Sequence[Optional[str]]] = None,
+    channels: Optional[Sequence[Optional[str]]] = None,
+) -> str:
+    """A WHERE clause for the rows of the given branches and channels."""
+    conditions = []
+    for column, values in (("experiment_branch", branches), ("normalized_channel", channels)):
+        if values is None:
+            continue
+        alternatives = [f"{column} IN ({', '.join(literal(v) for v in values if v is not None)})"]
+        if None in values:
+            alternatives.append(f"{column} IS NULL")
+        conditions.append("(" + " OR ".join(alternatives) + ")")
+    return " WHERE " + " AND ".join(conditions) if conditions else ""
+
+
+def attach(conn: sqlite3.Connection, uris: List[str]) -> int:
+    """Attaches as many of uris as SQLite allows, as shard0, shard1..., and returns how many."""
+    for i, uri in enumerate(uris):
+        try:
+            conn.execute(f"ATTACH DATABASE ? AS shard{i}", (uri,))
+        except sqlite3.OperationalError as e:
+            if "too many attached" not in str(e):
+                raise
+            return i
+    return len(uris)
+
+
+def detach(conn: sqlite3.Connection, count: int) -> None:
+    for i in range(count):
+        conn.execute(f"DETACH DATABASE shard{i}")
+
+
+def union(count: int, where: str) -> str:
+    members = [f"SELECT * FROM shard{i}.{SHARDED_TABLE}{where}" for i in range(count)]
+    return " UNION ALL ".join(members)
+
+
+class LazyShardCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        self.connection.fill_before(sql)
+        return super().execute(sql, parameters)
+
+
+class LazyShardConnection(sqlite3.Connection):
+    """A connection whose per_user_daily_averages is copied from its shards when first read.
+
+    Used when there are more shards than SQLite can attach at once. Until a
+    statement reads the table, or a view over it, the table is empty, so
+    opening the result, and queries of its other tables, don't copy anything.
+    PRAGMA and CREATE statements only need the table's columns, which it
+    has from the start.
+    """
+    uris: List[str] = []
+    where = ""
+    batch_size = 0
+    filled = True
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or LazyShardCursor)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def reads_shards(self, sql: str) -> bool:
+        if re.match(r"\s*(PRAGMA|CREATE)\b", sql, re.IGNORECASE):
+            return False
+        names = {SHARDED_TABLE}
+        views = super().execute("SELECT name, sql FROM sqlite_temp_master WHERE type = 'view'")
+        names.update(name for name, view in views if SHARDED_TABLE in view)
+        return any(name.lower() in sql.lower() for name in names)
+
+    def fill_before(self, sql: str) -> None:
+        if self.filled or not self.reads_shards(sql):
+            return
+        for start in range(0, len(self.uris), self.batch_size):
+            batch = self.uris[start:start + self.batch_size]
+            attach(self, batch)
+            super().execute(f"INSERT INTO temp.{SHARDED_TABLE} {union(len(batch), self.where)}")
+            # Shards can't be detached in the middle of a transaction
+            self.commit()
+            detach(self, len(batch))
+        self.filled = True
+
+
+def open_result(
+    path: Union[str, Path] = "summary.sqlite3",
+    branches: Optional[Sequence[Optional[str]]] = None,
+    channels: Optional[Sequence[Optional[str]]] = None,
+) -> sqlite3.Connection:
+    """Opens a fetched result for reading, limited to some branches and channels.
+
+    For a sharded result, only the shards that are needed are attached, and
+    a temporary per_user_daily_averages view joins them, so queries don't
+    need to know about shards. SQLite can only attach 10 databases at once,
+    so more shards than that are copied into a temporary table instead, a
+    batch at a time, the first time the table is read; see
+    LazyShardConnection. Selecting fewer keeps that from happening. For an
+    unsharded result, the view filters the table the same way.
+    """
+    path = Path(path)
+    manifest = read_manifest(path.parent)
+    where = row_filter(branches, channels)
+    if manifest is None:
+        conn = connect_readonly(path)
+        if where:
+            conn.execute(
+                f"CREATE TEMP VIEW {SHARDED_TABLE} AS SELECT * FROM main.{SHARDED_TABLE}{where}"
+            )
+        return conn
+    shards = select_shards(manifest, branches, channels)
+    if not shards:
+        raise ValueError("No shards hold the requested branches and channels")
+    conn = connect_readonly(path, factory=LazyShardConnection)
+    uris = [(path.parent/s["path"]).resolve().as_uri() + "?immutable=1" for s in shards]
+    try:
+        batch_size = attach(conn, uris)
+        if batch_size == len(uris):
+            conn.execute(f"CREATE TEMP VIEW {SHARDED_TABLE} AS {union(len(uris), where)}")
+            return conn
+        conn.execute(f"CREATE TEMP TABLE {SHARDED_TABLE} AS {union(1, '')} LIMIT 0")
+        detach(conn, batch_size)
+    except Exception:
+        conn.close()
+        raise
+    conn.uris, conn.where, conn.batch_size, conn.filled = uris, where, batch_size, False
+    return conn
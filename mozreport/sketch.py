@@ -0,0 +1,122 @@
+import math
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import attr
+
+from .query import quote
+
+SKETCH_TABLE = "quantile_sketches"
+SKETCH_KEYS = ["experiment_branch", "normalized_channel"]
+# What the ETL used before it recorded the accuracy in etl_metadata
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+
+@attr.s
+class Sketch:
+    """A mergeable quantile sketch with logarithmic buckets, like DDSketch.
+
+    `buckets` maps (sign, bucket index) to a count; see quantile_sketches()
+    in the ETL script for how values are assigned to buckets. Quantiles are
+    within relative_accuracy of the true value.
+    """
+    relative_accuracy: float = attr.ib(default=DEFAULT_RELATIVE_ACCURACY)
+    buckets: Dict[Tuple[int, int], int] = attr.ib(factory=dict)
+
+    @property
+    def gamma(self) -> float:
+        return (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+
+    @property
+    def count(self) -> int:
+        return sum(self.buckets.values())
+
+    def key(self, value: float) -> Tuple[int, int]:
+        if value == 0:
+            return (0, 0)
+        sign = 1 if value > 0 else -1
+        return (sign, math.ceil(math.log(abs(value), self.gamma)))
+
+    def value(self, key: Tuple[int, int]) -> float:
+        """The value that represents a bucket, within relative_accuracy of everything in it."""
+        sign, index = key
+        return sign * 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value: float, count: int = 1) -> None:
+        key = self.key(value)
+        self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def merge(self, other: "Sketch") -> "Sketch":
+        """Combines the sketches of two disjoint sets of values."""
+        if not math.isclose(self.relative_accuracy, other.relative_accuracy):
+            raise ValueError("Can't merge sketches with different relative accuracies")
+        buckets = dict(self.buckets)
+        for key, count in other.buckets.items():
+            buckets[key] = buckets.get(key, 0) + count
+        return Sketch(self.relative_accuracy, buckets)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """The q-th quantile, 0 <= q <= 1, or None if the sketch is empty."""
+        if not 0 <= q <= 1:
+            raise ValueError("q must be between 0 and 1")
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        # Negative values sort by decreasing magnitude, then zero, then positive values
+        for key in sorted(self.buckets, key=lambda k: (k[0], k[0] * k[1])):
+            seen += self.buckets[key]
+            if seen > rank:
+                return self.value(key)
+        return self.value(key)
+
+    def quantiles(self, qs: Iterable[float]) -> List[Optional[float]]:
+        return [self.quantile(q) for q in qs]
+
+
+def relative_accuracy(conn: sqlite3.Connection) -> float:
+    try:
+        row = conn.execute(
+            "SELECT value FROM etl_metadata WHERE name = 'sketch_relative_accuracy'"
+        ).fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    return float(row[0]) if row else DEFAULT_RELATIVE_ACCURACY
+
+
+def metrics(conn: sqlite3.Connection) -> List[str]:
+    return [r[0] for r in conn.execute(f"SELECT DISTINCT metric FROM {SKETCH_TABLE} ORDER BY 1")]
+
+
+def read_sketches(
+    conn: sqlite3.Connection,
+    metric: str,
+    by: Sequence[str] = ("experiment_branch",),
+) -> Dict[tuple, Sketch]:
+    """Reads the sketches of a metric from a result database, merged over everything not in `by`.
+
+    `by` is a subset of SKETCH_KEYS. With the default, the sketches of each
+    branch's channels are merged, and the result is keyed by (branch,).
+    The merging happens in SQL, so only the buckets are read.
+    """
+    unknown = [k for k in by if k not in SKETCH_KEYS]
+    if unknown:
+        raise ValueError(f"Can't group sketches by {', '.join(unknown)}")
+    accuracy = relative_accuracy(conn)
+    keys = [quote(k) for k in by]
+    rows = conn.execute(
+        f"""
+        SELECT {"".join(k + ", " for k in keys)}sign, bucket, SUM(count)
+        FROM {SKETCH_TABLE}
+        WHERE metric = ?
+        GROUP BY {"".join(k + ", " for k in keys)}sign, bucket
+        """,
+        (metric,),
+    )
+    sketches = {}
+    for row in rows:
+        group, (sign, bucket, count) = tuple(row[:len(keys)]), row[len(keys):]
+        sketch = sketches.setdefault(group, Sketch(accuracy))
+        sketch.buckets[(sign, bucket)] = count
+    return sketches
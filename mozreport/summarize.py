@@ -0,0 +1,232 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+import json
+import math
+import os
+from pathlib import Path
+import sqlite3
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import attr
+import numpy as np
+
+from .query import PER_USER_TABLE, averaged_columns, quote
+from .shards import branches, open_result, read_manifest
+
+GROUP_KEYS = ["experiment_branch", "normalized_channel"]
+# Rows per fetchmany(); with a dozen averaged columns, a batch is about 25 MB of floats
+DEFAULT_BATCH_SIZE = 250000
+DEFAULT_BINS = 50
+
+
+@attr.s(eq=False)
+class ColumnSummary:
+    """Running count, mean, variance, extremes and histogram of one column.
+
+    Batches are folded in with Chan et al.'s pairwise form of Welford's
+    algorithm, so summaries of disjoint sets of rows can be merged in any
+    order without losing precision. The histogram counts values between
+    `edges`, which summaries must share to be merged.
+    """
+    edges: np.ndarray = attr.ib()
+    count: int = attr.ib(default=0)
+    mean: float = attr.ib(default=0.0)
+    m2: float = attr.ib(default=0.0)
+    minimum: float = attr.ib(default=math.inf)
+    maximum: float = attr.ib(default=-math.inf)
+    histogram: np.ndarray = attr.ib(default=None)
+
+    def __attrs_post_init__(self):
+        if self.histogram is None:
+            self.histogram = np.zeros(len(self.edges) - 1, dtype=np.int64)
+
+    @property
+    def variance(self) -> Optional[float]:
+        """The sample variance, or None with fewer than two values."""
+        return self.m2 / (self.count - 1) if self.count > 1 else None
+
+    def _combine(self, count: int, mean: float, m2: float) -> None:
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def update(self, values: np.ndarray) -> None:
+        """Adds a batch of values; NaNs, which is what NULLs become, are skipped."""
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        mean = values.mean()
+        self._combine(len(values), float(mean), float(np.square(values - mean).sum()))
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        self.histogram += np.histogram(values, bins=self.edges)[0]
+
+    def merge(self, other: "ColumnSummary") -> "ColumnSummary":
+        """Combines the summaries of two disjoint sets of values."""
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Can't merge summaries with different histogram edges")
+        merged = ColumnSummary(
+            self.edges, self.count, self.mean, self.m2,
+            min(self.minimum, other.minimum), max(self.maximum, other.maximum),
+            self.histogram + other.histogram,
+        )
+        if other.count:
+            merged._combine(other.count, other.mean, other.m2)
+        return merged
+
+
+def extremes(conn: sqlite3.Connection, columns: List[str]) -> Dict[str, tuple]:
+    """The smallest and largest value of each column, or (None, None) for an empty column."""
+    selected = ", ".join(f"MIN({quote(c)}), MAX({quote(c)})" for c in columns)
+    row = conn.execute(f"SELECT {selected} FROM {quote(PER_USER_TABLE)}").fetchone()
+    return {c: (row[2 * i], row[2 * i + 1]) for i, c in enumerate(columns)}
+
+
+def histogram_edges(low: Optional[float], high: Optional[float], bins: int = DEFAULT_BINS):
+    """Evenly spaced bin edges from low to high, shared by every group's histogram."""
+    if low is None:
+        low, high = 0, 1
+    elif high <= low:
+        high = low + 1
+    return np.linspace(low, high, bins + 1)
+
+
+def summarize_part(
+    path: Path,
+    branches: Optional[List[Optional[str]]],
+    rowids: Optional[Tuple[int, int]],
+    columns: List[str],
+    edges: Dict[str, np.ndarray],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Dict[tuple, Dict[str, ColumnSummary]]:
+    """Summarizes each branch and channel in part of a result, reading batch_size rows at a time.
+
+    The part is the shards of some branches of a sharded result, or the
+    rows of an unsharded one whose rowid is in [start, end). Rows are added
+    to their group's summaries as they come, so the part is read in a single
+    scan, with no index or sort.
+    """
+    selected = ", ".join(quote(c) for c in GROUP_KEYS + columns)
+    where, parameters = "", ()
+    if rowids is not None:
+        where, parameters = " WHERE rowid >= ? AND rowid < ?", rowids
+    summaries = {}
+    with closing(open_result(path, branches=branches)) as conn:
+        cursor = conn.execute(f"SELECT {selected} FROM {quote(PER_USER_TABLE)}{where}", parameters)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            groups = {}
+            for row in rows:
+                groups.setdefault(row[:2], []).append(row[2:])
+            for key, group in groups.items():
+                if key not in summaries:
+                    summaries[key] = {c: ColumnSummary(edges[c]) for c in columns}
+                values = np.array(group, dtype=float)
+                for i, column in enumerate(columns):
+                    summaries[key][column].update(values[:, i])
+    return summaries
+
+
+def rowid_ranges(path: Path, parts: int) -> List[Tuple[int, int]]:
+    """Splits the rows of an unsharded result into about `parts` ranges of rowids."""
+    with closing(open_result(path)) as conn:
+        low, high = conn.execute(
+            f"SELECT MIN(rowid), MAX(rowid) FROM {quote(PER_USER_TABLE)}"
+        ).fetchone()
+    if low is None:
+        return []
+    step = -(-(high - low + 1) // parts)
+    return [(start, start + step) for start in range(low, high + 1, step)]
+
+
+def summarize(
+    path: Union[str, Path] = "summary.sqlite3",
+    by: Sequence[str] = GROUP_KEYS,
+    bins: int = DEFAULT_BINS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    processes: Optional[int] = None,
+) -> Dict[tuple, Dict[str, ColumnSummary]]:
+    """Summarizes every averaged column of per_user_daily_averages, in bounded memory.
+
+    Rows are streamed from SQLite in batches, so memory use depends on
+    batch_size, not on the size of the table. Parts of the table are
+    summarized in parallel by a pool of `processes` processes (one per CPU
+    by default; 1 summarizes them in this process): each branch's shards
+    for a sharded result, or ranges of rows otherwise. `by` is a subset of
+    GROUP_KEYS; the result is keyed by tuples of their values, then by column.
+    """
+    unknown = [k for k in by if k not in GROUP_KEYS]
+    if unknown:
+        raise ValueError(f"Can't group summaries by {', '.join(unknown)}")
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(str(path))
+    # The result is only read, never indexed, since it can be a hard link
+    # into the result cache. Every row is read twice: once for the extremes,
+    # which set the histogram edges that all groups share, then once to be
+    # summarized. A sharded result is read one branch's shards at a time.
+    if read_manifest(path.parent) is None:
+        selections = [None]
+        parts = [(None, r) for r in rowid_ranges(path, processes or os.cpu_count() or 1)]
+    else:
+        selections = [[b] for b in branches(path)]
+        parts = [(b, None) for b in selections]
+    if not parts:
+        return {}
+    ranges = {}
+    for selection in selections:
+        with closing(open_result(path, branches=selection)) as conn:
+            columns = averaged_columns(conn)
+            for column, (low, high) in extremes(conn, columns).items():
+                if low is not None:
+                    old_low, old_high = ranges.get(column, (low, high))
+                    ranges[column] = (min(low, old_low), max(high, old_high))
+    edges = {c: histogram_edges(*ranges.get(c, (None, None)), bins) for c in columns}
+
+    arguments = [(path, b, r, columns, edges, batch_size) for b, r in parts]
+    if processes == 1 or len(parts) < 2:
+        results = [summarize_part(*a) for a in arguments]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(summarize_part, *zip(*arguments)))
+
+    summaries = {}
+    for per_group in results:
+        for (branch, channel), per_column in per_group.items():
+            values = {"experiment_branch": branch, "normalized_channel": channel}
+            key = tuple(values[k] for k in by)
+            if key in summaries:
+                per_column = {c: summaries[key][c].merge(s) for c, s in per_column.items()}
+            summaries[key] = per_column
+    return summaries
+
+
+def as_cursor(
+    summaries: Dict[tuple, Dict[str, ColumnSummary]],
+    by: Sequence[str] = GROUP_KEYS,
+) -> sqlite3.Cursor:
+    """The summaries as rows of an in-memory table, for query.WRITERS.
+
+    Histograms are JSON objects with the bin edges and the count in each bin.
+    """
+    conn = sqlite3.connect(":memory:")
+    names = list(by) + [
+        "column_name", "n", "mean", "variance", "minimum", "maximum", "histogram",
+    ]
+    conn.execute(f"CREATE TABLE summaries ({', '.join(quote(n) for n in names)})")
+    rows = []
+    for key in sorted(summaries, key=lambda k: [(v is not None, v) for v in k]):
+        for column, s in summaries[key].items():
+            histogram = {"edges": s.edges.tolist(), "counts": s.histogram.tolist()}
+            rows.append(list(key) + [
+                column, s.count,
+                s.mean if s.count else None, s.variance,
+                s.minimum if s.count else None, s.maximum if s.count else None,
+                json.dumps(histogram),
+            ])
+    conn.executemany(f"INSERT INTO summaries VALUES ({', '.join('?' for _ in names)})", rows)
+    return conn.execute("SELECT * FROM summaries")
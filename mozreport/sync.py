@@ -0,0 +1,164 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import os
+from pathlib import Path
+import posixpath
+import tempfile
+from typing import Dict, List, Optional, Set
+
+from . import databricks
+from .databricks import MAX_CONCURRENT_REQUESTS
+from .delta import download
+
+
+def remote_files(client: databricks.Client, remote_dir: str) -> Dict[str, dict]:
+    """The files under remote_dir, keyed by their path relative to it."""
+    if not client.file_exists(remote_dir):
+        return {}
+    root = remote_dir.rstrip("/") + "/"
+    return {
+        entry["path"][len(root):]: entry
+        for entry in client.list_dir(remote_dir, recursive=True)
+        if not entry["is_dir"]
+    }
+
+
+def local_files(local_dir: Path) -> Dict[str, Path]:
+    """The files under local_dir, keyed by their path relative to it, with / separators."""
+    return {
+        path.relative_to(local_dir).as_posix(): path
+        for path in sorted(Path(local_dir).rglob("*"))
+        if path.is_file()
+    }
+
+
+def is_downloaded(path: Path, entry: dict) -> bool:
+    """Whether a local file was downloaded from the remote file described by entry.
+
+    sync_down gives the files it writes the remote modification time, so a
+    remote file that was rewritten since, even at the same size, won't match.
+    """
+    if not path.is_file():
+        return False
+    stat = path.stat()
+    return (
+        stat.st_size == entry["file_size"]
+        and stat.st_mtime_ns // 1000000 == entry["modification_time"]
+    )
+
+
+def is_uploaded(path: Path, entry: dict) -> bool:
+    """Whether a local file was uploaded to the remote file described by entry.
+
+    The remote file is written after the local one was last changed.
+    """
+    if not path.is_file():
+        return False
+    stat = path.stat()
+    return (
+        stat.st_size == entry["file_size"]
+        and stat.st_mtime_ns // 1000000 <= entry["modification_time"]
+    )
+
+
+def sync_down(
+    client: databricks.Client,
+    remote_dir: str,
+    local_dir: Path,
+    max_workers: int = MAX_CONCURRENT_REQUESTS,
+) -> List[str]:
+    """Copies the files under remote_dir that changed into local_dir.
+
+    Downloaded files get the remote modification time, and a local file is
+    considered up to date if it has the same size and modification time as
+    the remote file.
+    Returns the relative paths of the files that were downloaded.
+    """
+    local_dir = Path(local_dir)
+    changed = {
+        name: entry
+        for name, entry in remote_files(client, remote_dir).items()
+        if not is_downloaded(local_dir/name, entry)
+    }
+
+    def fetch(name):
+        entry = changed[name]
+        destination = local_dir/name
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        contents = download(client, entry["path"], destination)
+        fd, temp = tempfile.mkstemp(dir=str(destination.parent), prefix=f".{destination.name}.")
+        with os.fdopen(fd, "wb") as f:
+            f.write(contents)
+        modified = entry["modification_time"] * 1000000
+        os.utime(temp, ns=(modified, modified))
+        os.replace(temp, destination)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(fetch, sorted(changed)))
+    return sorted(changed)
+
+
+def sync_up(
+    client: databricks.Client,
+    local_dir: Path,
+    remote_dir: str,
+    max_workers: int = MAX_CONCURRENT_REQUESTS,
+) -> List[str]:
+    """Copies the files under local_dir that changed into remote_dir.
+
+    A file is uploaded if it's missing on DBFS, has a different size there,
+    or was modified locally after the remote copy was written.
+    Returns the relative paths of the files that were uploaded.
+    """
+    remote = remote_files(client, remote_dir)
+    changed = {
+        name: path
+        for name, path in local_files(local_dir).items()
+        if name not in remote or not is_uploaded(path, remote[name])
+    }
+
+    def upload(name):
+        with open(changed[name], "rb") as f:
+            client.upload_file(f, posixpath.join(remote_dir, name), overwrite=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(upload, sorted(changed)))
+    return sorted(changed)
+
+
+def stale_directories(
+    client: databricks.Client,
+    remote_dir: str,
+    cutoff: float,
+    only: Optional[Set[str]] = None,
+) -> List[str]:
+    """The directories in remote_dir in which nothing was modified since cutoff, a Unix time.
+
+    With `only`, other directories aren't considered. DBFS doesn't track
+    when directories change, so each one is listed recursively,
+    concurrently with the others, to find its newest file.
+    """
+    if not client.file_exists(remote_dir):
+        return []
+    directories = [e["path"] for e in client.list_dir(remote_dir) if e["is_dir"]]
+    if only is not None:
+        directories = [path for path in directories if path in only]
+
+    def newest(path):
+        entries = client.list_dir(path, recursive=True)
+        times = [e["modification_time"] for e in entries if not e["is_dir"]]
+        return max(times, default=0)
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        modified = list(executor.map(newest, directories))
+    return [path for path, ms in zip(directories, modified) if ms / 1000 < cutoff]
+
+
+def delete_all(
+    client: databricks.Client,
+    remote_paths: List[str],
+    max_workers: int = MAX_CONCURRENT_REQUESTS,
+) -> None:
+    """Deletes each of remote_paths, with everything in it."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(partial(client.delete_file, recursive=True), remote_paths))
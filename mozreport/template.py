@@ -1,52 +1,194 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import mmap
 from os import walk
 from pathlib import Path
+import shutil
 from typing import List, Optional
 
 import attr
 
-from ._version import __version__
 from .util import get_data_dir
 
+# Optional file describing a template; it isn't copied by emplace
+METADATA_FILENAME = "template.toml"
+INDEX_FILENAME = "template_index.json"
+INDEX_VERSION = 1
+
 
 @attr.s
 class Template:
     name: str = attr.ib()
     path: Path = attr.ib()
+    description: str = attr.ib(default="")
+    r_packages: List[str] = attr.ib(factory=list)
+    output_formats: List[str] = attr.ib(factory=list)
+
+    @classmethod
+    def from_path(cls, path: Path) -> "Template":
+        metadata = {}
+        if (path/METADATA_FILENAME).exists():
+            import toml
+            metadata = toml.load(str(path/METADATA_FILENAME))
+        return cls(
+            name=path.name,
+            path=path,
+            description=metadata.get("description", ""),
+            r_packages=metadata.get("r_packages", []),
+            output_formats=metadata.get("output_formats", []),
+        )
 
     @classmethod
     def find_all(cls, user_path: Optional[Path] = None) -> List["Template"]:
+        """Finds the templates shipped with mozreport and in the user's data directory.
+
+        The result is cached in an index in the data directory, which is
+        rebuilt when the modification time of any of the template
+        directories or metadata files changes.
+        """
+        data_dir = user_path or get_data_dir()
         search_path = [
             Path(__file__).parent,
-            user_path or get_data_dir(),
+            data_dir,
         ]
         search_path = [i/"templates" for i in search_path if (i/"templates").exists()]
+        index_path = data_dir/INDEX_FILENAME
+
+        index = _load_index(index_path)
+        if index is not None and _index_is_current(index, search_path):
+            return [
+                cls(**{**entry["template"], "path": Path(entry["template"]["path"])})
+                for entry in index["templates"]
+            ]
+
         discovered = []
         for path in search_path:
             children = (i for i in path.iterdir() if i.is_dir())
             for child in children:
-                discovered.append(cls(
-                    name=child.name,
-                    path=child,
-                ))
+                discovered.append(cls.from_path(child))
+        _save_index(index_path, search_path, discovered)
         return discovered
 
-    def emplace(self, target: Path, overwrite: bool = True) -> None:
+    def emplace(
+        self,
+        target: Path,
+        overwrite: bool = True,
+        incremental: bool = False,
+        max_workers: Optional[int] = None,
+    ) -> None:
+        """Copies the template into `target`.
+
+        With incremental=True, files that are newer than their counterparts
+        in the template are left alone, like make would.
+        If overwrite is False and any other file already exists,
+        raises FileExistsError before copying anything.
+        """
         if not target.exists():
             raise FileNotFoundError(str(target))
         if not target.is_dir():
             raise NotADirectoryError(str(target))
 
-        def transform(x):
-            return x.replace(b"MOZREPORT_VERSION", __version__.public().encode("ascii"))
+        from ._version import __version__
+        version = __version__.public().encode("ascii")
 
+        copies = []
         for (path, dirs, files) in walk(self.path):
             path = Path(path)
             relative = path.relative_to(self.path)
             (target / relative).mkdir(exist_ok=True)
             for filename in files:
-                dest = target/relative/filename
-                if not overwrite and dest.exists():
-                    raise FileExistsError(str(dest))
-                buffer = (path/filename).read_bytes()
-                buffer = transform(buffer)
-                dest.write_bytes(buffer)
+                if path == self.path and filename == METADATA_FILENAME:
+                    continue
+                copies.append((path/filename, target/relative/filename))
+
+        if incremental:
+            copies = [(src, dest) for (src, dest) in copies if not _is_up_to_date(src, dest)]
+        if not overwrite:
+            existing = [str(dest) for (_, dest) in copies if dest.exists()]
+            if existing:
+                raise FileExistsError(", ".join(existing))
+
+        def copy(paths):
+            _copy_with_version(*paths, version)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # list() re-raises any exception from the workers
+            list(executor.map(copy, copies))
+
+
+def _stamp(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _load_index(index_path: Path) -> Optional[dict]:
+    try:
+        with open(index_path, "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != INDEX_VERSION:
+        return None
+    return index
+
+
+def _index_is_current(index: dict, search_path: List[Path]) -> bool:
+    # Adding or removing a template changes the mtime of its parent directory,
+    # and adding or removing its metadata file changes the template's.
+    if index["roots"] != {str(root): _stamp(root) for root in search_path}:
+        return False
+    for entry in index["templates"]:
+        path = Path(entry["template"]["path"])
+        if entry["stamp"] != [_stamp(path), _stamp(path/METADATA_FILENAME)]:
+            return False
+    return True
+
+
+def _save_index(index_path: Path, search_path: List[Path], templates: List[Template]) -> None:
+    index = {
+        "version": INDEX_VERSION,
+        "roots": {str(root): _stamp(root) for root in search_path},
+        "templates": [
+            {
+                "template": {**attr.asdict(t), "path": str(t.path)},
+                "stamp": [_stamp(t.path), _stamp(t.path/METADATA_FILENAME)],
+            }
+            for t in templates
+        ],
+    }
+    try:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(index_path, "w") as f:
+            json.dump(index, f, indent=2)
+    except OSError:
+        # The index is only a cache
+        pass
+
+
+def _is_up_to_date(src: Path, dest: Path) -> bool:
+    try:
+        return dest.stat().st_mtime_ns >= src.stat().st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def _copy_with_version(src: Path, dest: Path, version: bytes) -> None:
+    """Copies src to dest, replacing MOZREPORT_VERSION with `version`.
+
+    Files without the placeholder (fonts, images, ...) are searched through
+    a memory map and copied by shutil.copyfile, which lets the OS copy them
+    (sendfile on Linux, clonefile on macOS) without reading them into Python.
+    """
+    with open(src, "rb") as f:
+        if src.stat().st_size == 0:
+            needs_substitution = False
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                needs_substitution = buffer.find(b"MOZREPORT_VERSION") != -1
+        if needs_substitution:
+            f.seek(0)
+            dest.write_bytes(f.read().replace(b"MOZREPORT_VERSION", version))
+            return
+    shutil.copyfile(src, dest)
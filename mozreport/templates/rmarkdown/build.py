@@ -1,18 +1,205 @@
 #!/usr/bin/env python
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+from pathlib import Path
+import re
 import subprocess
 
+REPORT = Path("report.Rmd")
+DATA = Path("summary.sqlite3")
+# Lists the shards of per_user_daily_averages, for the sharded output formats
+SHARD_MANIFEST = Path("shards.json")
+# The analysis is knitted once, to this file, and converted to each output format from it.
+# rmarkdown uses report.knit.md for its own intermediate file, and deletes it.
+KNITTED = Path(".mozreport.knit.md")
 
-def R(script):
-    return subprocess.check_call(["R", "--slave", "-e", script])
+# Output formats and the files they're rendered to. rmarkdown formats take
+# their options from the YAML header of report.Rmd; ipynb is converted by pandoc.
+# By default, the formats listed under `output:` in that header are rendered.
+DEFAULT_FORMATS = ["html_document"]
+OUTPUT_FORMATS = {
+    "html_document": Path("report.html"),
+    "pdf_document": Path("report.pdf"),
+    "ipynb": Path("report.ipynb"),
+}
 
+# Build state lives here between runs; delete it to start from scratch.
+STATE_DIR = Path(".mozreport_build")
+PACKAGES_STAMP = STATE_DIR/"packages.json"
+RENDER_STAMP = STATE_DIR/"render.json"
 
-def build():
+CRAN = "https://cloud.r-project.org"
+
+
+def R(script, env=None):
+    return subprocess.check_call(["R", "--slave", "-e", script], env=env)
+
+
+def read_stamp(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_stamp(path, value):
+    path.parent.mkdir(exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(value, f, indent=2, sort_keys=True)
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def data_files():
+    """summary.sqlite3, and the shards listed in shards.json if the result is sharded."""
+    files = [DATA]
+    if SHARD_MANIFEST.exists():
+        with open(SHARD_MANIFEST, "r") as f:
+            files.extend(Path(shard["path"]) for shard in json.load(f)["shards"])
+    return files
+
+
+def file_hash(path, previous):
+    """Hashes a file, reusing the previous hash if its size and mtime haven't changed."""
+    stat = path.stat()
+    if previous and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+        return previous
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256(path)}
+
+
+def data_hash(previous):
+    """Hashes the data files together, reusing the previous hashes of unchanged files."""
+    previous_files = (previous or {}).get("files", {})
+    files = {str(p): file_hash(p, previous_files.get(str(p))) for p in data_files()}
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(("%s %s\n" % (name, files[name]["sha256"])).encode("utf-8"))
+    return {"files": files, "sha256": digest.hexdigest()}
+
+
+def configured_formats():
+    """The output formats listed in report.Rmd's YAML header that build.py can render.
+
+    Reads the `output: format` and indented `output:` mapping forms, without
+    a YAML parser, since this script only needs the standard library.
+    Falls back to DEFAULT_FORMATS.
+    """
+    header = re.match(r"---\n(.*?)\n---", REPORT.read_text(), re.DOTALL)
+    formats = []
+    if header:
+        lines = iter(header.group(1).splitlines())
+        for line in lines:
+            match = re.match(r"output:\s*(\S+)?\s*$", line)
+            if not match:
+                continue
+            if match.group(1):
+                formats.append(match.group(1))
+            for line in lines:
+                if not line.startswith(" "):
+                    break
+                entry = re.match(r"  (\w+)\s*:", line)
+                if entry:
+                    formats.append(entry.group(1))
+            break
+    return [f for f in formats if f in OUTPUT_FORMATS] or list(DEFAULT_FORMATS)
+
+
+def required_packages():
+    """Finds the R packages that report.Rmd loads or calls into."""
+    source = REPORT.read_text()
+    packages = set(re.findall(r"\b(?:library|require)\((\w+)\)", source))
+    packages.update(re.findall(r"\b(\w+)::", source))
+    packages.update(["knitr", "rmarkdown"])
+    return sorted(packages)
+
+
+def ensure_packages():
+    """Installs missing R packages, unless a previous build already checked for them."""
+    packages = required_packages()
+    if read_stamp(PACKAGES_STAMP) == packages:
+        return
+    R(
+        "pkgs <- c(%s); " % ", ".join('"%s"' % p for p in packages) +
+        "missing <- setdiff(pkgs, .packages(all=TRUE)); "
+        'if (length(missing)) install.packages(missing, repo="%s")' % CRAN
+    )
+    write_stamp(PACKAGES_STAMP, packages)
+
+
+def knit(data_hash):
+    # knitr's chunk cache is keyed on this, so changing the data reruns every chunk
+    # but changing prose reruns none of them.
+    env = dict(os.environ, MOZREPORT_DATA_HASH=data_hash)
     R(
-        'if(!("RSQLite" %in% .packages(all=TRUE))) '
-        'install.packages("RSQLite", repo="https://cloud.r-project.org")'
+        "rmarkdown::render('%s', " % REPORT +
+        "output_format=rmarkdown::md_document(variant='markdown', preserve_yaml=TRUE), "
+        "output_file='%s')" % KNITTED,
+        env=env,
     )
-    R("rmarkdown::render('report.Rmd')")
+
+
+def convert(output_format):
+    output = OUTPUT_FORMATS[output_format]
+    if output_format == "ipynb":
+        R("rmarkdown::pandoc_convert('%s', to='ipynb', output='%s')" % (KNITTED, output))
+        return
+    # Each conversion gets its own copy of the input, because rmarkdown names
+    # its intermediate files after the input and the conversions run at once.
+    source = KNITTED.with_name("%s.%s.md" % (KNITTED.stem, output_format))
+    source.write_bytes(KNITTED.read_bytes())
+    try:
+        R(
+            "rmarkdown::render('%s', output_format='%s', output_file='%s', quiet=TRUE)"
+            % (source, output_format, output)
+        )
+    finally:
+        source.unlink()
+
+
+def is_stale(output):
+    return not output.exists() or output.stat().st_mtime_ns < KNITTED.stat().st_mtime_ns
+
+
+def build(formats, force=False):
+    ensure_packages()
+    previous = read_stamp(RENDER_STAMP) or {}
+    inputs = {
+        "report": sha256(REPORT),
+        "data": data_hash(previous.get("data")),
+    }
+    if force or previous != inputs or not KNITTED.exists():
+        knit(inputs["data"]["sha256"])
+        write_stamp(RENDER_STAMP, inputs)
+    stale = [f for f in formats if force or is_stale(OUTPUT_FORMATS[f])]
+    if not stale:
+        print("%s up to date." % ", ".join(str(OUTPUT_FORMATS[f]) for f in formats))
+        return
+    # The conversions are separate R processes; the threads just wait on them.
+    with ThreadPoolExecutor(max_workers=len(stale)) as executor:
+        list(executor.map(convert, stale))
 
 
 if __name__ == "__main__":
-    build()
+    parser = argparse.ArgumentParser(description="Renders report.Rmd if it or the data changed.")
+    parser.add_argument("--force", action="store_true", help="Render even if nothing changed")
+    parser.add_argument(
+        "--format",
+        action="append",
+        choices=sorted(OUTPUT_FORMATS),
+        help=(
+            "Output format to render; may be repeated "
+            "(default: the formats under `output:` in report.Rmd)"
+        ),
+    )
+    args = parser.parse_args()
+    build(args.format or configured_formats(), force=args.force)
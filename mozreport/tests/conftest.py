@@ -12,3 +12,18 @@ def runner():
     runner = CliRunner()
     runner.invoke = partial(runner.invoke, catch_exceptions=False)
     return runner
+
+
+@pytest.fixture(autouse=True)
+def data_dir(request, monkeypatch, tmpdir):
+    """Keeps unit tests from writing caches into the real configuration directory."""
+    if request.node.get_closest_marker("integration") is None:
+        monkeypatch.setenv("MOZREPORT_CONFIG", str(tmpdir.join("mozreport_data")))
+
+
+@pytest.fixture
+def emulator(tmpdir):
+    """A local emulated Databricks workspace, with DBFS under tmpdir/dbfs."""
+    from mozreport.emulator import Emulator
+    with Emulator(root=str(tmpdir.join("dbfs"))) as emulator:
+        yield emulator
@@ -0,0 +1,132 @@
+"""Throughput and memory benchmarks for the Databricks client.
+
+Each measurement runs in a fresh Python process against mozreport.emulator,
+so its peak RSS belongs to that operation alone. Set
+MOZREPORT_BENCHMARK_SIZES_MB (e.g. "1,64,1024,4096") to benchmark other file
+sizes, and MOZREPORT_BENCHMARK_LATENCY / MOZREPORT_BENCHMARK_BANDWIDTH (seconds
+per request, bytes per second) to make the emulator behave like a remote workspace.
+Results are printed; run pytest with -s to see them.
+"""
+from io import BytesIO
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from mozreport.databricks import Client, DatabricksConfig
+
+resource = pytest.importorskip("resource")
+
+pytestmark = pytest.mark.benchmark
+
+MEGABYTE = 1 << 20
+SIZES_MB = [int(s) for s in os.environ.get("MOZREPORT_BENCHMARK_SIZES_MB", "1,16").split(",")]
+LATENCY = float(os.environ.get("MOZREPORT_BENCHMARK_LATENCY", 0))
+BANDWIDTH = float(os.environ.get("MOZREPORT_BENCHMARK_BANDWIDTH", 0))
+
+# Regression budgets, for an unthrottled emulator. They're loose enough for a slow
+# laptop; a change that trips one has made things a lot worse.
+MIN_DOWNLOAD_MB_PER_SECOND = 10
+MIN_UPLOAD_MB_PER_SECOND = 10
+MAX_SUBMIT_SECONDS = 1.0
+# Peak RSS growth allowed per megabyte transferred, and in total on top of that
+MAX_RSS_GROWTH_PER_MB = 4
+MAX_RSS_GROWTH_OVERHEAD_MB = 64
+
+MEASURE = """
+import json, resource, sys, time
+from mozreport.databricks import Client, DatabricksConfig
+
+host, operation, argument = sys.argv[1:4]
+client = Client(DatabricksConfig(token="token", host=host))
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+if operation == "get_file":
+    client.get_file(argument)
+elif operation == "upload_file":
+    with open(argument, "rb") as f:
+        client.upload_file(f, "/bench" + argument)
+elif operation == "submit":
+    run_id = client.submit_python_task("benchmark", "cluster", argument)
+    finished = ("TERMINATED", "INTERNAL_ERROR")
+    while client.run_info(run_id)["state"]["life_cycle_state"] not in finished:
+        time.sleep(0.05)
+seconds = time.perf_counter() - start
+growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+# ru_maxrss is in bytes on macOS and KiB elsewhere
+growth_mb = growth / (1 << 20) if sys.platform == "darwin" else growth / 1024
+print(json.dumps({"seconds": seconds, "rss_growth_mb": growth_mb}))
+"""
+
+
+def measure(host, operation, argument):
+    result = subprocess.run(
+        [sys.executable, "-c", MEASURE, host, operation, argument],
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    )
+    return json.loads(result.stdout)
+
+
+def report(name, size_mb, result):
+    rate = f"{size_mb / result['seconds']:8.1f} MB/s" if size_mb else ""
+    print(
+        f"\n{name:>12} {size_mb:6d} MB: {result['seconds']:8.3f} s {rate} "
+        f"peak RSS +{result['rss_growth_mb']:.1f} MB"
+    )
+
+
+def rss_budget(size_mb):
+    return MAX_RSS_GROWTH_PER_MB * size_mb + MAX_RSS_GROWTH_OVERHEAD_MB
+
+
+@pytest.fixture(scope="module")
+def emulator():
+    command = [
+        sys.executable, "-m", "mozreport.emulator",
+        "--latency", str(LATENCY),
+        "--bandwidth", str(BANDWIDTH),
+    ]
+    command.extend(f"--synthetic=/bench/file-{mb}={mb * MEGABYTE}" for mb in SIZES_MB)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        yield process.stdout.readline().strip()
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def unthrottled():
+    return not (LATENCY or BANDWIDTH)
+
+
+class TestClientBenchmarks:
+    @pytest.mark.parametrize("size_mb", SIZES_MB)
+    def test_get_file(self, emulator, size_mb):
+        result = measure(emulator, "get_file", f"/bench/file-{size_mb}")
+        report("get_file", size_mb, result)
+        assert result["rss_growth_mb"] < rss_budget(size_mb)
+        if unthrottled():
+            assert size_mb / result["seconds"] > MIN_DOWNLOAD_MB_PER_SECOND
+
+    @pytest.mark.parametrize("size_mb", SIZES_MB)
+    def test_upload_file(self, emulator, size_mb, tmpdir):
+        path = tmpdir.join("upload")
+        with open(str(path), "wb") as f:
+            f.truncate(size_mb * MEGABYTE)
+        result = measure(emulator, "upload_file", str(path))
+        report("upload_file", size_mb, result)
+        assert result["rss_growth_mb"] < rss_budget(size_mb)
+        if unthrottled():
+            assert size_mb / result["seconds"] > MIN_UPLOAD_MB_PER_SECOND
+
+    def test_submit(self, emulator):
+        config = DatabricksConfig(token="token", host=emulator)
+        Client(config).upload_file(BytesIO(b"pass"), "/bench/script.py")
+        result = measure(emulator, "submit", "/bench/script.py")
+        report("submit", 0, result)
+        if unthrottled():
+            assert result["seconds"] < MAX_SUBMIT_SECONDS
@@ -0,0 +1,86 @@
+from io import BytesIO
+import os
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from mozreport.cache import ResultCache, replace_with_copy
+from mozreport.databricks import Client
+
+
+class TestResultCache:
+    @pytest.fixture
+    def client(self, emulator):
+        client = Client(emulator.config)
+        client.upload_file(BytesIO(b"a" * 100), "/a/summary.sqlite3")
+        client.upload_file(BytesIO(b"b" * 100), "/b/summary.sqlite3")
+        return client
+
+    def test_fetch(self, client, tmpdir):
+        cache = ResultCache()
+        first, second = Path(tmpdir.mkdir("first")), Path(tmpdir.mkdir("second"))
+        with patch.object(client, "get_file", wraps=client.get_file) as get_file:
+            assert not cache.fetch(client, "/a/summary.sqlite3", first/"summary.sqlite3")
+            assert cache.fetch(client, "/a/summary.sqlite3", second/"summary.sqlite3")
+            assert get_file.call_count == 1
+        for directory in (first, second):
+            assert (directory/"summary.sqlite3").read_bytes() == b"a" * 100
+        assert cache.size() == 100
+
+        # A changed file is downloaded again, and fetching replaces the local copy
+        # without touching the cached one
+        client.delete_file("/a/summary.sqlite3")
+        client.upload_file(BytesIO(b"new"), "/a/summary.sqlite3")
+        assert not cache.fetch(client, "/a/summary.sqlite3", first/"summary.sqlite3")
+        assert (first/"summary.sqlite3").read_bytes() == b"new"
+        assert (second/"summary.sqlite3").read_bytes() == b"a" * 100
+
+    def test_deduplicates_contents(self, client, tmpdir):
+        cache = ResultCache()
+        client.upload_file(BytesIO(b"a" * 100), "/c/summary.sqlite3")
+        cache.fetch(client, "/a/summary.sqlite3", Path(tmpdir)/"a")
+        cache.fetch(client, "/c/summary.sqlite3", Path(tmpdir)/"c")
+        assert len(os.listdir(cache.objects)) == 1
+
+    def test_evicts_least_recently_used(self, client, tmpdir):
+        cache = ResultCache(max_bytes=150)
+        destination = Path(tmpdir)/"summary.sqlite3"
+        cache.fetch(client, "/a/summary.sqlite3", destination)
+        cache.fetch(client, "/b/summary.sqlite3", destination)
+        assert cache.size() == 100
+        assert destination.read_bytes() == b"b" * 100
+        with patch.object(client, "get_file", wraps=client.get_file) as get_file:
+            assert cache.fetch(client, "/b/summary.sqlite3", destination)
+            assert not cache.fetch(client, "/a/summary.sqlite3", destination)
+            assert get_file.call_count == 1
+
+    def test_in_flight_files_are_kept(self, client, tmpdir):
+        cache = ResultCache(max_bytes=150)
+        destination = Path(tmpdir)/"summary.sqlite3"
+        # Another thread is between putting "a" and linking it into its destination
+        with cache._pin(cache.put("a", b"a" * 100).name):
+            cache.fetch(client, "/b/summary.sqlite3", destination)
+            assert len(os.listdir(cache.objects)) == 2
+        cache.evict()
+        assert cache.size() == 100
+
+    def test_fetch_survives_eviction(self, client, tmpdir):
+        cache = ResultCache()
+        destination = Path(tmpdir)/"summary.sqlite3"
+        # As if another process evicted the file right after it was put
+        with patch.object(cache, "put", return_value=cache.objects/"evicted"):
+            assert not cache.fetch(client, "/a/summary.sqlite3", destination)
+        assert destination.read_bytes() == b"a" * 100
+
+    def test_replace_with_copy_never_writes_through(self, tmpdir):
+        source = Path(tmpdir)/"source"
+        source.write_bytes(b"cached")
+        destination = Path(tmpdir)/"destination"
+        os.link(source, destination)
+        other = Path(tmpdir)/"other"
+        other.write_bytes(b"other")
+        replace_with_copy(other, destination)
+        assert source.read_bytes() == b"cached"
+        assert destination.read_bytes() == b"other"
+        assert sorted(os.listdir(tmpdir)) == ["destination", "other", "source"]
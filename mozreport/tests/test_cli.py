@@ -1,4 +1,8 @@
+from io import BytesIO
+import json
+import os
 from pathlib import Path
+import sqlite3
 from unittest.mock import Mock, create_autospec
 import sys
 
@@ -7,6 +11,7 @@ import pytest
 from mozreport import cli
 from mozreport.databricks import DatabricksConfig, Client
 from mozreport.experiment import ExperimentConfig
+from mozreport.runs import RunTracker
 
 
 def write_config_files():
@@ -30,6 +35,13 @@ def mock_client(monkeypatch):
     }
     response = b"Hello, world! " + "🌎".encode("utf-8")
     mock_client.return_value.get_file.return_value = response
+    mock_client.return_value.get_status.return_value = {
+        "file_size": len(response),
+        "modification_time": 1,
+    }
+    mock_client.return_value.config = DatabricksConfig(host="foo", token="bar")
+    # No block manifests, so fetches download whole files
+    mock_client.return_value.file_exists.return_value = False
     monkeypatch.setattr(cli, "Client", mock_client)
     yield mock_client
 
@@ -81,6 +93,22 @@ class TestCli:
             assert result2.exit_code == 0
             assert contents == outfile.read_bytes()
 
+    def test_new_keeps_customized_config(self, runner):
+        with runner.isolated_filesystem():
+            ExperimentConfig(
+                uuid="monty", slug="camelot", metrics=["EngagementIntensity"], sample_percent=10,
+                enrollment_end="20190301",
+            ).save()
+            result = runner.invoke(cli.cli, ["--pipeline=never", "new"], input="\n")
+            assert result.exit_code == 0
+            config = ExperimentConfig.from_file()
+            assert config.uuid == "monty" and config.slug == "camelot"
+            assert config.metrics == ["EngagementIntensity"]
+            assert config.sample_percent == 10
+            assert config.enrollment_end == "20190301"
+            script = Path("mozreport_etl_script.py").read_text()
+            assert "EngagementIntensity" in script
+
     def test_submit(self, runner, mock_client):
         result = runner.invoke(cli.cli, ["submit", "--help"])
         assert result.exit_code == 0
@@ -105,6 +133,152 @@ class TestCli:
                 assert f.read() == response
         assert result.exit_code == 0
 
+    def test_fetch_uses_cache(self, runner, mock_client):
+        get_file = mock_client.return_value.get_file
+        with runner.isolated_filesystem() as tmpdir:
+            write_config_files()
+            env = {"MOZREPORT_CONFIG": tmpdir}
+            for directory in ("first", "second"):
+                os.mkdir(directory)
+                os.chdir(directory)
+                ExperimentConfig(uuid="monty", slug="camelot").save()
+                assert runner.invoke(cli.cli, ["fetch"], env=env).exit_code == 0
+                os.chdir("..")
+            assert get_file.call_count == 1
+            assert Path("second/summary.sqlite3").read_bytes() == get_file.return_value
+            os.chdir("first")
+            assert runner.invoke(cli.cli, ["fetch", "--no-cache"], env=env).exit_code == 0
+            assert get_file.call_count == 2
+
+    def test_fetch_diagnostics(self, runner, mock_client):
+        response = mock_client.return_value.get_file.return_value
+        with runner.isolated_filesystem() as tmpdir:
+            write_config_files()
+            result = runner.invoke(
+                cli.cli,
+                ["fetch", "--diagnostics"],
+                env={"MOZREPORT_CONFIG": tmpdir},
+            )
+            assert (Path(tmpdir)/"diagnostics.json").read_bytes() == response
+            remote_paths = [c[0][0] for c in mock_client.return_value.get_file.call_args_list]
+            assert remote_paths == [
+                "/mozreport/camelot-monty/summary.sqlite3",
+                "/mozreport/camelot-monty/diagnostics.json",
+            ]
+        assert result.exit_code == 0
+
+    def test_status_and_wait(self, runner, mock_client):
+        run_info = mock_client.return_value.run_info
+        run_info.return_value = {
+            "state": {"life_cycle_state": "PENDING"},
+            "run_page_url": "https://example.com",
+        }
+        with runner.isolated_filesystem() as tmpdir:
+            write_config_files()
+            env = {"MOZREPORT_CONFIG": tmpdir}
+            result = runner.invoke(cli.cli, ["status"], env=env)
+            assert "No runs" in result.output
+            Path("mozreport_etl_script.py").write_text("dummy file")
+            result = runner.invoke(cli.cli, ["submit", "--no-wait"], env=env)
+            assert result.exit_code == 0
+            result = runner.invoke(cli.cli, ["status"], env=env)
+            assert "camelot (run 1234): PENDING" in result.output
+
+            Path("mozreport_etl_script.py").unlink()
+            run_info.side_effect = [
+                {"state": {"life_cycle_state": "RUNNING"}},
+                {"state": {"life_cycle_state": "TERMINATED", "result_state": "SUCCESS"}},
+            ]
+            with runner.isolated_filesystem():
+                result = runner.invoke(cli.cli, ["wait", "--interval=0"], env=env)
+            assert result.exit_code == 0
+            assert "camelot (run 1234): SUCCESS" in result.output
+            assert (Path(tmpdir)/"summary.sqlite3").exists()
+            result = runner.invoke(cli.cli, ["wait"], env=env)
+            assert "No runs are pending" in result.output
+            result = runner.invoke(cli.cli, ["status"], env=env)
+            assert "camelot (run 1234): SUCCESS, fetched" in result.output
+
+    def test_gc(self, runner, emulator, monkeypatch):
+        client = Client(emulator.config)
+        monkeypatch.setattr(cli, "Client", lambda config: client)
+        for name in ("old", "new", "pending", "others"):
+            client.upload_file(BytesIO(b"x"), f"/mozreport/{name}/summary.sqlite3")
+            path = emulator.state.root/"mozreport"/name/"summary.sqlite3"
+            if name != "new":
+                os.utime(str(path), (0, 0))
+        with runner.isolated_filesystem() as tmpdir:
+            write_config_files()
+            monkeypatch.setenv("MOZREPORT_CONFIG", tmpdir)
+            tracker = RunTracker()
+            for run_id, name in enumerate(("old", "new", "pending")):
+                info = {"state": {"life_cycle_state": "RUNNING"}}
+                run = tracker.record("foo", run_id, name, f"/mozreport/{name}", Path("."), info)
+                if name != "pending":
+                    info = {"state": {"life_cycle_state": "TERMINATED", "result_state": "FAILED"}}
+                    tracker.update(run, info)
+            result = runner.invoke(cli.cli, ["gc", "--dry-run"])
+            assert result.exit_code == 0
+            assert result.output.strip() == "dbfs:/mozreport/old"
+            assert client.file_exists("/mozreport/old")
+            result = runner.invoke(cli.cli, ["gc"])
+            assert result.exit_code == 0
+            assert not client.file_exists("/mozreport/old")
+            # Other people's directories are only deleted with --all, after asking
+            result = runner.invoke(cli.cli, ["gc", "--all"], input="n\n")
+            assert result.exit_code == 0
+            assert "dbfs:/mozreport/others" in result.output
+            assert client.file_exists("/mozreport/others")
+            result = runner.invoke(cli.cli, ["gc", "--all"], input="y\n")
+            assert result.exit_code == 0
+        assert not client.file_exists("/mozreport/others")
+        assert client.file_exists("/mozreport/new")
+        assert client.file_exists("/mozreport/pending")
+
+    def test_sync(self, runner, emulator, monkeypatch):
+        client = Client(emulator.config)
+        monkeypatch.setattr(cli, "Client", lambda config: client)
+        client.upload_file(BytesIO(b"summary"), "/mozreport/camelot-monty/summary.sqlite3")
+        client.upload_file(BytesIO(b"{}"), "/mozreport/camelot-monty/diagnostics.json")
+        with runner.isolated_filesystem() as tmpdir:
+            write_config_files()
+            monkeypatch.setenv("MOZREPORT_CONFIG", tmpdir)
+            result = runner.invoke(cli.cli, ["sync", "artifacts"])
+            assert result.exit_code == 0
+            assert Path("artifacts/summary.sqlite3").read_bytes() == b"summary"
+            assert Path("artifacts/diagnostics.json").exists()
+            Path("artifacts/notes.txt").write_text("notes")
+            result = runner.invoke(cli.cli, ["sync", "--up", "artifacts"])
+            assert result.exit_code == 0
+            assert result.output.strip().splitlines()[-1] == "notes.txt"
+        assert client.file_exists("/mozreport/camelot-monty/notes.txt")
+
+    def test_submit_batch(self, runner, mock_client):
+        run_info = mock_client.return_value.run_info
+        run_info.return_value = {
+            "state": {"life_cycle_state": "PENDING"},
+            "run_page_url": "https://example.com",
+        }
+        with runner.isolated_filesystem() as tmpdir:
+            write_config_files()
+            ExperimentConfig(uuid="grail", slug="holy").save(Path("holy/mozreport.toml"))
+            env = {"MOZREPORT_CONFIG": tmpdir}
+            result = runner.invoke(cli.cli, ["submit-batch", ".", "holy"], env=env)
+            assert result.exit_code == 0
+            mock_client.return_value.submit_python_task.assert_called_once()
+            # Both experiments are in the same run, which is polled once
+            run_info.side_effect = [
+                {"state": {"life_cycle_state": "TERMINATED", "result_state": "SUCCESS"}},
+            ]
+            result = runner.invoke(cli.cli, ["wait", "--interval=0"], env=env)
+            assert result.exit_code == 0
+            assert (Path(tmpdir)/"summary.sqlite3").exists()
+            assert (Path(tmpdir)/"holy"/"summary.sqlite3").exists()
+
+            ExperimentConfig(uuid="x", slug="y", sample_percent=1).save(Path("y/mozreport.toml"))
+            result = runner.invoke(cli.cli, ["submit-batch", ".", "y"], env=env)
+            assert result.exit_code == 1
+
     def test_pipelining(self, runner, mock_client):
         response = mock_client.return_value.get_file.return_value
         with runner.isolated_filesystem() as tmpdir:
@@ -157,6 +331,16 @@ class TestCli:
             assert result.exit_code == 0
             assert (Path(tmpdir)/"report.Rmd").exists()
 
+            # Re-running leaves the existing files alone
+            (Path(tmpdir)/"report.Rmd").write_text("My report")
+            result = runner.invoke(
+                cli.cli,
+                ["report", "--template", "rmarkdown"],
+                env={"MOZREPORT_CONFIG": tmpdir},
+            )
+            assert result.exit_code == 0
+            assert (Path(tmpdir)/"report.Rmd").read_text() == "My report"
+
         with runner.isolated_filesystem() as tmpdir:
             write_config_files()
             result = runner.invoke(
@@ -167,6 +351,100 @@ class TestCli:
             assert result.exit_code == 1
             assert "asdfasdf" in result.output
 
+    def test_report_list(self, runner):
+        result = runner.invoke(cli.cli, ["report", "--list"])
+        assert result.exit_code == 0
+        assert "rmarkdown: " in result.output
+        assert "RSQLite" in result.output
+
+    def test_build(self, runner, monkeypatch):
+        from mozreport import rworker
+
+        worker = create_autospec(rworker.RWorker)
+        worker.return_value.__enter__.return_value = worker.return_value
+        worker.return_value.run.return_value = True
+        worker.return_value.render.return_value = True
+        monkeypatch.setattr(rworker, "RWorker", worker)
+
+        with runner.isolated_filesystem() as tmpdir:
+            result = runner.invoke(cli.cli, ["build"])
+            assert result.exit_code == 1
+            assert "mozreport report" in result.output
+
+            (Path(tmpdir)/"report.Rmd").write_text("library(dplyr)\n")
+            result = runner.invoke(cli.cli, ["build"])
+            assert result.exit_code == 0
+            assert "library(dplyr)" in worker.return_value.run.call_args[0][0]
+            worker.return_value.render.assert_called_once_with(Path("report.Rmd"))
+
+    def test_query(self, runner):
+        with runner.isolated_filesystem():
+            result = runner.invoke(cli.cli, ["query", "SELECT 1"])
+            assert result.exit_code == 2
+
+            conn = sqlite3.connect("summary.sqlite3")
+            conn.execute(
+                "CREATE TABLE per_user_daily_averages "
+                "(client_id, experiment_branch, normalized_channel, days_active)"
+            )
+            conn.execute("INSERT INTO per_user_daily_averages VALUES ('a', 'control', 'beta', 3)")
+            conn.commit()
+            conn.close()
+
+            result = runner.invoke(cli.cli, ["query"])
+            assert "branch_means" in result.output.split()
+            result = runner.invoke(cli.cli, ["query", "--view", "branch_means"])
+            assert result.output.splitlines()[1] == "control,1,3.0"
+            result = runner.invoke(
+                cli.cli, ["query", "--branch", "treatment", "--view", "branch_means"],
+            )
+            assert len(result.output.splitlines()) == 1
+            result = runner.invoke(cli.cli, ["query", "--format", "json", "SELECT 1 AS one"])
+            assert '"one": 1' in result.output
+        assert result.exit_code == 0
+
+    def test_summarize(self, runner):
+        with runner.isolated_filesystem():
+            conn = sqlite3.connect("summary.sqlite3")
+            conn.execute(
+                "CREATE TABLE per_user_daily_averages "
+                "(client_id, experiment_branch, normalized_channel, days_active)"
+            )
+            conn.executemany(
+                "INSERT INTO per_user_daily_averages VALUES (?, ?, 'beta', ?)",
+                [("a", "control", 3), ("b", "control", 5), ("c", "treatment", 4)],
+            )
+            conn.commit()
+            conn.close()
+            result = runner.invoke(cli.cli, ["summarize", "--bins", "2"])
+            assert result.exit_code == 0
+            control = result.output.splitlines()[1]
+            assert control.startswith("control,days_active,2,4.0,2.0,3.0,5.0,")
+            result = runner.invoke(cli.cli, ["summarize", "--by-channel", "--format", "json"])
+            assert json.loads(result.output)[1]["normalized_channel"] == "beta"
+
+    def test_diff(self, runner):
+        with runner.isolated_filesystem():
+            for name, value in (("old.sqlite3", 1.0), ("new.sqlite3", 2.0)):
+                conn = sqlite3.connect(name)
+                conn.execute("CREATE TABLE summary (metric_name, branch, stat_value)")
+                conn.execute("INSERT INTO summary VALUES ('hours', 'control', ?)", (value,))
+                conn.execute(
+                    "CREATE TABLE per_user_daily_averages "
+                    "(client_id, experiment_branch, normalized_channel, days_active)"
+                )
+                conn.commit()
+                conn.close()
+            result = runner.invoke(cli.cli, ["diff", "old.sqlite3", "new.sqlite3"])
+            assert result.exit_code == 0
+            assert "hours,control,1.0,2.0" in result.output.splitlines()
+            result = runner.invoke(
+                cli.cli,
+                ["diff", "--format", "json", "old.sqlite3", "new.sqlite3"],
+            )
+            assert json.loads(result.output)["summary"][0]["new_stat_value"] == 2.0
+        assert result.exit_code == 0
+
 
 class TestConfig:
     @pytest.fixture()
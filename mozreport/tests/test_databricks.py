@@ -71,6 +71,41 @@ class TestDatabricksIntegration:
         client.delete_file(output_path)
 
 
+class TestDatabricksEmulated:
+    @pytest.fixture
+    def client(self, emulator):
+        return databricks.Client(emulator.config)
+
+    def test_file_roundtrip(self, client):
+        contents = bytes(range(256)) * 8193  # a little over two read chunks
+        assert not client.file_exists("/mozreport/test")
+        client.upload_file(BytesIO(contents), "/mozreport/test")
+        assert client.file_exists("/mozreport/test")
+        assert client.get_file("/mozreport/test") == contents
+        with pytest.raises(databricks.DatabricksException):
+            client.upload_file(BytesIO(b"again"), "/mozreport/test")
+        client.delete_file("/mozreport/test")
+        assert not client.file_exists("/mozreport/test")
+        with pytest.raises(databricks.DatabricksException):
+            client.get_file("/mozreport/test")
+
+    def test_submit_python_task(self, client):
+        test_script = dedent("""\
+            import sys
+            with open(sys.argv[1], "w") as f:
+                f.write("Hello from " + sys.argv[2])
+        """)
+        client.upload_file(BytesIO(test_script.encode("utf-8")), "/mozreport/test.py")
+        run_id = client.submit_python_task(
+            "Test run", "cluster", "/mozreport/test.py",
+            parameters=["/dbfs/mozreport/test.result", "the emulator"],
+        )
+        while client.run_info(run_id)["state"]["life_cycle_state"] != "TERMINATED":
+            time.sleep(0.05)
+        assert client.run_info(run_id)["state"]["result_state"] == "SUCCESS"
+        assert client.get_file("/mozreport/test.result") == b"Hello from the emulator"
+
+
 class TestDatabricks:
     @pytest.fixture
     def mocked_client(self):
@@ -105,6 +140,15 @@ class TestDatabricks:
         session.get.return_value.json.return_value = {"error_code": "RESOURCE_DOES_NOT_EXIST"}
         assert not client.file_exists("/foo")
 
+    def test_get_status(self, mocked_client):
+        client, session = mocked_client
+        session.get.return_value.json.return_value = {"path": "/foo", "file_size": 3}
+        assert client.get_status("/foo")["file_size"] == 3
+
+        session.get.return_value.status_code = 404
+        with pytest.raises(databricks.DatabricksException):
+            client.get_status("/foo")
+
     def test_delete_file(self, mocked_client):
         client, session = mocked_client
         client.delete_file("/foo")
@@ -0,0 +1,63 @@
+from io import BytesIO
+import json
+import os
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from mozreport.databricks import Client
+from mozreport.delta import MANIFEST_SUFFIX, block_hashes, download
+
+MEGABYTE = 1 << 20
+
+
+def upload(client, path, contents, tmpdir, manifest=True):
+    for remote in (path, path + MANIFEST_SUFFIX):
+        client.delete_file(remote)
+    client.upload_file(BytesIO(contents), path)
+    if manifest:
+        local = Path(tmpdir)/"manifest-source"
+        local.write_bytes(contents)
+        manifest = {
+            "algorithm": "sha256",
+            "block_size": MEGABYTE,
+            "size": len(contents),
+            "blocks": block_hashes(local, MEGABYTE),
+        }
+        client.upload_file(BytesIO(json.dumps(manifest).encode("utf-8")), path + MANIFEST_SUFFIX)
+
+
+class TestDelta:
+    @pytest.fixture
+    def client(self, emulator):
+        return Client(emulator.config)
+
+    @pytest.fixture
+    def contents(self):
+        return os.urandom(3 * MEGABYTE + 1000)
+
+    def test_reads_only_changed_blocks(self, client, contents, tmpdir):
+        base = Path(tmpdir)/"summary.sqlite3"
+        base.write_bytes(contents)
+        changed = bytearray(contents)
+        changed[MEGABYTE + 5] ^= 0xff
+        changed += b"appended"
+        upload(client, "/result/summary.sqlite3", bytes(changed), tmpdir)
+        with patch.object(client, "read_range", wraps=client.read_range) as read_range:
+            assert download(client, "/result/summary.sqlite3", base) == changed
+        offsets = [c[0][1] for c in read_range.call_args_list]
+        assert offsets == [MEGABYTE, 3 * MEGABYTE]
+
+    def test_falls_back_to_whole_file(self, client, contents, tmpdir):
+        base = Path(tmpdir)/"summary.sqlite3"
+        base.write_bytes(contents)
+        # No base, no manifest, or a manifest that doesn't describe the file
+        upload(client, "/result/summary.sqlite3", contents[:-1], tmpdir)
+        assert download(client, "/result/summary.sqlite3", Path(tmpdir)/"missing") == contents[:-1]
+        upload(client, "/result/summary.sqlite3", contents[:-1], tmpdir, manifest=False)
+        assert download(client, "/result/summary.sqlite3", base) == contents[:-1]
+        upload(client, "/result/summary.sqlite3", contents[:-1], tmpdir)
+        client.delete_file("/result/summary.sqlite3")
+        client.upload_file(BytesIO(contents[1:]), "/result/summary.sqlite3")
+        assert download(client, "/result/summary.sqlite3", base) == contents[1:]
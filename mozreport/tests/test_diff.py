@@ -0,0 +1,95 @@
+from pathlib import Path
+import sqlite3
+
+import pytest
+
+from mozreport import diff
+from mozreport.tests.test_shards import write_sharded
+
+
+def write_result(path, summary, per_user):
+    conn = sqlite3.connect(str(path))
+    conn.execute(
+        "CREATE TABLE summary (metric_name TEXT, stat_name TEXT, branch TEXT, "
+        "stat_value REAL, ci_low REAL, ci_high REAL)"
+    )
+    conn.executemany("INSERT INTO summary VALUES (?, ?, ?, ?, ?, ?)", summary)
+    conn.execute(
+        "CREATE TABLE per_user_daily_averages "
+        "(client_id TEXT, experiment_branch TEXT, normalized_channel TEXT, "
+        "days_active INTEGER, active_ticks REAL)"
+    )
+    conn.executemany("INSERT INTO per_user_daily_averages VALUES (?, ?, ?, ?, ?)", per_user)
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def pair(tmpdir):
+    old, new = Path(tmpdir)/"old.sqlite3", Path(tmpdir)/"new.sqlite3"
+    write_result(
+        old,
+        [
+            ("intensity", "p50", "control", 0.5, 0.4, 0.6),
+            ("intensity", "p50", "treatment", 0.5, 0.4, 0.6),
+            ("hours", "p50", "control", 2.0, 1.0, 3.0),
+        ],
+        [
+            ("a", "control", "release", 1, 10.0),
+            ("b", "treatment", "release", 2, 20.0),
+        ],
+    )
+    write_result(
+        new,
+        [
+            ("intensity", "p50", "control", 0.5, 0.4, 0.6),
+            ("intensity", "p50", "treatment", 0.7, 0.6, 0.8),
+            ("uris", "p50", "control", 9.0, 8.0, 10.0),
+        ],
+        [
+            ("a", "control", "release", 2, 10.0),
+            ("b", "treatment", "release", 3, 20.0),
+            ("c", "treatment", "release", 1, 50.0),
+        ],
+    )
+    return diff.open_pair(old, new)
+
+
+class TestDiff:
+    def test_summary_changes(self, pair):
+        rows = diff.summary_changes(pair).fetchall()
+        assert rows == [
+            ("hours", "p50", "control", 2.0, None, 1.0, None, 3.0, None),
+            ("intensity", "p50", "treatment", 0.5, 0.7, 0.4, 0.6, 0.6, 0.8),
+            ("uris", "p50", "control", None, 9.0, None, 8.0, None, 10.0),
+        ]
+
+    def test_per_user_changes(self, pair):
+        cursor = diff.per_user_changes(pair)
+        names = [d[0] for d in cursor.description]
+        rows = [dict(zip(names, row)) for row in cursor]
+        by_key = {(r["experiment_branch"], r["statistic"]): r for r in rows}
+        assert len(rows) == 6
+        assert by_key["treatment", "clients"]["old_value"] == 1
+        assert by_key["treatment", "clients"]["new_value"] == 2
+        assert by_key["treatment", "clients"]["relative_change"] == 1.0
+        assert by_key["treatment", "mean_active_ticks"]["new_value"] == 35.0
+        assert by_key["control", "mean_days_active"]["change"] == 1.0
+        assert by_key["control", "mean_active_ticks"]["change"] == 0.0
+
+    def test_sharded(self, tmpdir):
+        old = Path(tmpdir)/"old.sqlite3"
+        write_result(old, [], [("a", "control", "release", 4, 10.0)])
+        new = Path(tmpdir)/"new"
+        write_sharded(new, ["experiment_branch"], count=3)
+        rows = diff.per_user_changes(diff.open_pair(old, new/"summary.sqlite3")).fetchall()
+        assert [r[:4] for r in rows] == [
+            ("control", "clients", 1, 3),
+            ("control", "mean_days_active", 4.0, 1.0),
+            ("treatment", "clients", None, 3),
+            ("treatment", "mean_days_active", None, 1.0),
+        ]
+
+    def test_missing_file(self, tmpdir):
+        with pytest.raises(FileNotFoundError):
+            diff.open_pair(Path(tmpdir)/"a", Path(tmpdir)/"b")
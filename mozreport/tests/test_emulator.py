@@ -0,0 +1,89 @@
+from base64 import b64encode
+import time
+
+import pytest
+import requests
+
+from mozreport.emulator import Emulator, synthetic_bytes
+
+
+def wait(emulator, run_id):
+    url = emulator.url + "/api/2.0/jobs/runs/get"
+    while True:
+        state = requests.get(url, params={"run_id": run_id}).json()["state"]
+        if state["life_cycle_state"] in ("TERMINATED", "INTERNAL_ERROR"):
+            return state
+        time.sleep(0.05)
+
+
+class TestEmulator:
+    @pytest.fixture
+    def api(self, emulator):
+        def call(method, endpoint, **kwargs):
+            return getattr(requests, method)(emulator.url + "/api/2.0/" + endpoint, **kwargs)
+        return call
+
+    def test_streaming_upload(self, api, emulator, tmpdir):
+        handle = api("post", "dbfs/create", json={"path": "/big/file"}).json()["handle"]
+        for block in (b"first ", b"second"):
+            data = b64encode(block).decode("ascii")
+            assert api("post", "dbfs/add-block", json={"handle": handle, "data": data}).ok
+        assert api("post", "dbfs/close", json={"handle": handle}).ok
+        assert tmpdir.join("dbfs", "big", "file").read_binary() == b"first second"
+        assert api("get", "dbfs/get-status", params={"path": "/big"}).json()["is_dir"]
+        response = api("post", "dbfs/create", json={"path": "/big/file"})
+        assert response.json()["error_code"] == "RESOURCE_ALREADY_EXISTS"
+
+    def test_delete_directory(self, api, emulator):
+        assert api("post", "dbfs/mkdirs", json={"path": "/a/b/c"}).ok
+        response = api("post", "dbfs/delete", json={"path": "/a"})
+        assert response.json()["error_code"] == "IO_ERROR"
+        assert api("post", "dbfs/delete", json={"path": "/a", "recursive": True}).ok
+        assert api("get", "dbfs/get-status", params={"path": "/a"}).status_code == 404
+        response = api("get", "dbfs/get-status", params={"path": "/../outside"})
+        assert response.status_code == 404
+
+    def test_list(self, api, emulator):
+        assert api("post", "dbfs/mkdirs", json={"path": "/dir/sub"}).ok
+        emulator.state.synthetic["/dir/synthetic"] = 10
+        files = api("get", "dbfs/list", params={"path": "/dir"}).json()["files"]
+        assert [(f["path"], f["is_dir"]) for f in files] == [
+            ("/dir/sub", True), ("/dir/synthetic", False),
+        ]
+        files = api("get", "dbfs/list", params={"path": "/dir/synthetic"}).json()["files"]
+        assert files[0]["file_size"] == 10
+        assert api("get", "dbfs/list", params={"path": "/missing"}).status_code == 404
+
+    def test_synthetic_read(self, api, emulator):
+        emulator.state.synthetic["/synthetic"] = 1000
+        body = api("get", "dbfs/read", params={"path": "/synthetic", "offset": 990}).json()
+        assert body["bytes_read"] == 10
+        assert body["data"] == b64encode(synthetic_bytes(990, 10)).decode("ascii")
+        response = api("get", "dbfs/read", params={"path": "/synthetic", "length": 2 << 20})
+        assert response.json()["error_code"] == "MAX_READ_SIZE_EXCEEDED"
+
+    def test_failed_runs(self, api, emulator, tmpdir):
+        def submit(python_file):
+            job = {"spark_python_task": {"python_file": python_file}}
+            return api("post", "jobs/runs/submit", json=job).json()["run_id"]
+
+        assert wait(emulator, submit("dbfs:/missing.py"))["life_cycle_state"] == "INTERNAL_ERROR"
+        tmpdir.join("dbfs", "fails.py").write("raise SystemExit('spark is not defined')")
+        state = wait(emulator, submit("dbfs:/fails.py"))
+        assert state["result_state"] == "FAILED"
+        assert state["state_message"] == "spark is not defined"
+
+    def test_unstartable_run(self, tmpdir):
+        with Emulator(root=str(tmpdir), python=str(tmpdir.join("missing-python"))) as emulator:
+            tmpdir.join("script.py").write("")
+            job = {"spark_python_task": {"python_file": "dbfs:/script.py"}}
+            response = requests.post(emulator.url + "/api/2.0/jobs/runs/submit", json=job)
+            state = wait(emulator, response.json()["run_id"])
+        assert state["life_cycle_state"] == "INTERNAL_ERROR"
+        assert state["result_state"] == "FAILED"
+
+    def test_rate_limit(self, tmpdir):
+        with Emulator(root=str(tmpdir), rate_limit=2) as emulator:
+            url = emulator.url + "/api/2.0/dbfs/get-status"
+            statuses = [requests.get(url, params={"path": "/"}).status_code for _ in range(3)]
+        assert statuses == [200, 200, 429]
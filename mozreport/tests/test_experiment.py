@@ -1,7 +1,17 @@
+import json
 from pathlib import Path
+from unittest.mock import create_autospec
+
 import pytest
 
-from mozreport.experiment import ExperimentConfig, generate_etl_script
+from mozreport.databricks import Client
+from mozreport.experiment import (
+    ExperimentConfig,
+    ScriptTemplate,
+    generate_etl_script,
+    submit_etl_batch,
+    submit_etl_script,
+)
 
 
 class TestExperimentConfig:
@@ -34,3 +44,124 @@ class TestExperimentConfig:
         generated = generate_etl_script(config)
         # Test that the generated code doesn't throw a syntax error
         compile(generated, "<string>", mode="exec")
+
+    def test_generated_script_uses_registry(self, config):
+        config.metrics = ["EngagementIntensity"]
+        config.columns_to_average = ["active_ticks", "subsession_length"]
+        namespace = {}
+        generated = generate_etl_script(config)
+        block = generated[:generated.index("# mozreport:end-config")]
+        exec(block[block.index("# mozreport:begin-config"):], namespace)
+        assert namespace["METRICS"] == ["EngagementIntensity"]
+        assert namespace["COLUMNS_TO_AVERAGE"] == ["active_ticks", "subsession_length"]
+
+    def test_generated_script_is_deterministic(self, config):
+        other = ExperimentConfig(uuid="experiment-uuid", slug="experiment-slug")
+        assert generate_etl_script(config) == generate_etl_script(other)
+        other.sample_percent = 10
+        rendered = generate_etl_script(other)
+        assert rendered != generate_etl_script(config)
+        assert "SAMPLE_PERCENT = 10\n" in rendered
+        assert "SLUG = 'experiment-slug'\n" in rendered
+
+    def test_registry_roundtrips(self, tmpdir, config):
+        filename = Path(tmpdir.join("config.toml"))
+        config.metrics = ["EngagementIntensity"]
+        config.save(filename)
+        assert ExperimentConfig.from_file(filename).metrics == ["EngagementIntensity"]
+
+    def test_sharded_output_format(self, config):
+        config.output_format = "sharded-by-channel"
+        assert "OUTPUT_FORMAT = 'sharded-by-channel'\n" in generate_etl_script(config)
+        with pytest.raises(ValueError):
+            ExperimentConfig(uuid="a", slug="b", output_format="parquet")
+
+    def test_rejects_invalid_skew_mode(self):
+        with pytest.raises(ValueError):
+            ExperimentConfig(uuid="a", slug="b", skew_mode="asdfasdf")
+
+    def test_submit_passes_skew_options(self, config):
+        client = create_autospec(Client)
+        client.file_exists.return_value = False
+        config.skew_mode = "salted"
+        config.max_pings_per_client_day = 1000
+        submit_etl_script("script", config, client, "cluster")
+        params = client.submit_python_task.call_args[0][3]
+        assert params[params.index("--skew-mode") + 1] == "salted"
+        assert params[params.index("--max-pings-per-client-day") + 1] == "1000"
+
+    def test_analysis_window(self, config):
+        with pytest.raises(ValueError):
+            ExperimentConfig(uuid="a", slug="b", enrollment_end="2019-01-01")
+        with pytest.raises(ValueError):
+            ExperimentConfig(
+                uuid="a", slug="b", enrollment_end="20190201", observation_end="20190101"
+            )
+        client = create_autospec(Client)
+        client.file_exists.return_value = False
+        config.enrollment_start = "20190101"
+        config.observation_end = "20190301"
+        submit_etl_script("script", config, client, "cluster")
+        params = client.submit_python_task.call_args[0][3]
+        assert params[params.index("--enrollment-start") + 1] == "20190101"
+        assert params[params.index("--observation-end") + 1] == "20190301"
+        assert "--enrollment-end" not in params
+        assert "OBSERVATION_END = '20190301'\n" in generate_etl_script(config)
+
+    def test_submit_batch(self, config):
+        client = create_autospec(Client)
+        client.file_exists.return_value = False
+        other = ExperimentConfig(uuid="other-uuid", slug="other-slug", enrollment_end="20190101")
+        submit_etl_batch([config, other], client, "cluster")
+        script, destination = client.upload_file.call_args[0]
+        compile(script, "<string>", mode="exec")
+        assert destination == (
+            "/mozreport/batch-experiment_slug-experiment-uuid/mozreport_etl_script.py"
+        )
+        params = client.submit_python_task.call_args[0][3]
+        assert json.loads(params[params.index("--experiments") + 1]) == [
+            {
+                "slug": "experiment-slug", "uuid": "experiment-uuid",
+                "enrollment_start": None, "enrollment_end": None, "observation_end": None,
+            },
+            {
+                "slug": "other-slug", "uuid": "other-uuid",
+                "enrollment_start": None, "enrollment_end": "20190101", "observation_end": None,
+            },
+        ]
+
+        other.sample_percent = 10
+        with pytest.raises(ValueError, match="SAMPLE_PERCENT"):
+            submit_etl_batch([config, other], client, "cluster")
+
+
+class TestScriptTemplate:
+    source = (
+        "import os\n"
+        "# mozreport:begin-config\n"
+        "NAME = None\n"
+        "COUNT = [\n"
+        "    1,\n"
+        "]\n"
+        "# mozreport:end-config\n"
+        "print(NAME)\n"
+    )
+
+    def test_render(self):
+        template = ScriptTemplate.parse(self.source)
+        assert template.defaults == (("NAME", None), ("COUNT", [1]))
+        rendered = template.render({"NAME": "spam"})
+        assert rendered.startswith("import os\n# mozreport:begin-config\n")
+        assert "NAME = 'spam'\nCOUNT = [1]\n" in rendered
+        assert rendered.endswith("# mozreport:end-config\nprint(NAME)\n")
+
+    def test_rejects_bad_templates(self):
+        with pytest.raises(ValueError):
+            ScriptTemplate.parse("print('no config block')\n")
+        with pytest.raises(ValueError):
+            ScriptTemplate.parse(self.source.replace("NAME = None", "NAME = os.getcwd()"))
+        for target in ("NAME, OTHER", "os.NAME"):
+            with pytest.raises(ValueError):
+                ScriptTemplate.parse(self.source.replace("NAME = None", f"{target} = None"))
+        with pytest.raises(ValueError):
+            ScriptTemplate.parse(self.source).render({"EGGS": 1})
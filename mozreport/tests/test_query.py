@@ -0,0 +1,103 @@
+import hashlib
+from io import StringIO
+import json
+from pathlib import Path
+import sqlite3
+
+import pytest
+
+from mozreport import query
+
+
+@pytest.fixture
+def summary_path(tmpdir):
+    path = Path(tmpdir)/"summary.sqlite3"
+    conn = sqlite3.connect(str(path))
+    conn.execute("CREATE TABLE summary (branch TEXT, metric_name TEXT, stat_value REAL)")
+    conn.execute(
+        "CREATE TABLE per_user_daily_averages ("
+        "client_id TEXT, experiment_branch TEXT, normalized_channel TEXT, "
+        "days_active INTEGER, active_ticks REAL)"
+    )
+    rows = [
+        (f"client{i}", branch, "release", 1, float(i))
+        for branch in ("control", "treatment")
+        for i in range(1, 11)
+    ]
+    rows.append(("clientX", "treatment", "release", 2, None))
+    conn.executemany("INSERT INTO per_user_daily_averages VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return path
+
+
+class TestQuery:
+    def test_result_unchanged(self, summary_path):
+        # Fetched results can be hard links to objects in the result cache
+        digest = hashlib.sha256(summary_path.read_bytes()).hexdigest()
+        conn = query.open_summary(summary_path)
+        assert conn.execute("SELECT COUNT(*) FROM branch_means").fetchone() == (2,)
+        assert hashlib.sha256(summary_path.read_bytes()).hexdigest() == digest
+
+    def test_read_only(self, summary_path):
+        conn = sqlite3.connect(f"file:{summary_path}?mode=ro", uri=True)
+        query.create_views(conn)
+        assert conn.execute("SELECT COUNT(*) FROM branch_means").fetchone() == (2,)
+
+    def test_no_per_user_table(self, tmpdir):
+        path = Path(tmpdir)/"summary.sqlite3"
+        with sqlite3.connect(str(path)) as conn:
+            conn.execute("CREATE TABLE summary (branch TEXT, metric_name TEXT, stat_value REAL)")
+        conn = query.open_summary(path)
+        assert query.views(conn) == ["summary"]
+
+    def test_facets_only(self, tmpdir):
+        path = Path(tmpdir)/"summary.sqlite3"
+        with sqlite3.connect(str(path)) as conn:
+            conn.execute(
+                "CREATE TABLE per_user_daily_averages ("
+                "client_id TEXT, experiment_branch TEXT, normalized_channel TEXT)"
+            )
+        conn = query.open_summary(path)
+        assert query.views(conn) == ["per_user_daily_averages"]
+
+    def test_branch_means(self, summary_path):
+        conn = query.open_summary(summary_path)
+        rows = conn.execute(
+            "SELECT experiment_branch, clients, days_active, active_ticks "
+            "FROM branch_means ORDER BY experiment_branch"
+        ).fetchall()
+        assert rows == [
+            ("control", 10, 1.0, 5.5),
+            ("treatment", 11, 12 / 11, 5.5),
+        ]
+
+    def test_branch_quantiles(self, summary_path):
+        conn = query.open_summary(summary_path)
+        row = conn.execute(
+            "SELECT n, p10, p50, p90 FROM branch_quantiles "
+            "WHERE experiment_branch = 'treatment' AND column_name = 'active_ticks'"
+        ).fetchone()
+        # The NULL is left out
+        assert row == (10, 1.0, 5.0, 9.0)
+
+    def test_writers(self, summary_path):
+        conn = query.open_summary(summary_path)
+        sql = "SELECT experiment_branch, clients FROM branch_means ORDER BY 1"
+
+        out = StringIO()
+        query.write_csv(conn.execute(sql), out)
+        assert out.getvalue().splitlines() == [
+            "experiment_branch,clients", "control,10", "treatment,11",
+        ]
+
+        out = StringIO()
+        query.write_json(conn.execute(sql), out)
+        assert json.loads(out.getvalue()) == [
+            {"experiment_branch": "control", "clients": 10},
+            {"experiment_branch": "treatment", "clients": 11},
+        ]
+
+        out = StringIO()
+        query.write_json(conn.execute(sql + " LIMIT 0"), out)
+        assert json.loads(out.getvalue()) == []
@@ -0,0 +1,28 @@
+from pathlib import Path
+import sqlite3
+
+import pytest
+
+from mozreport.results import connect_readonly
+
+
+class TestConnectReadonly:
+    def test_connect_readonly(self, tmpdir):
+        path = Path(tmpdir)/"summary.sqlite3"
+        with pytest.raises(FileNotFoundError):
+            connect_readonly(path)
+
+        conn = sqlite3.connect(str(path))
+        conn.execute("CREATE TABLE summary (x)")
+        conn.executemany("INSERT INTO summary VALUES (?)", [(i,) for i in range(1000)])
+        conn.commit()
+        conn.close()
+
+        conn = connect_readonly(path, cache_size_kib=1024)
+        assert conn.execute("SELECT SUM(x) FROM summary").fetchone() == (499500,)
+        assert conn.execute("PRAGMA cache_size").fetchone() == (-1024,)
+        mmap_size = conn.execute("PRAGMA mmap_size").fetchone()[0]
+        # mmap may be compiled out of SQLite, which reports 0
+        assert mmap_size in (0, path.stat().st_size)
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("INSERT INTO summary VALUES (1)")
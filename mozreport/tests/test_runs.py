@@ -0,0 +1,38 @@
+from itertools import count
+from types import SimpleNamespace
+
+from mozreport import runs
+from mozreport.runs import RunTracker
+
+
+class TestRunTracker:
+    def test_lifecycle(self, tmpdir, monkeypatch):
+        # Runs are ordered by submission time, which mustn't depend on the clock's resolution
+        clock = count(1000)
+        monkeypatch.setattr(runs, "time", SimpleNamespace(time=lambda: float(next(clock))))
+        tracker = RunTracker()
+        assert tracker.runs() == []
+        run = tracker.record(
+            "host", 1, "slug", "/mozreport/slug-uuid", tmpdir,
+            {"state": {"life_cycle_state": "PENDING"}, "run_page_url": "url"},
+        )
+        tracker.record("host", 2, "other", "/mozreport/other-uuid", tmpdir, {})
+        assert [r.run_id for r in tracker.runs()] == [2, 1]
+        assert [r.run_id for r in tracker.runs(limit=1)] == [2]
+        assert run.directory == str(tmpdir)
+        assert run.submitted == 1000.0
+
+        run = tracker.update(
+            run, {"state": {"life_cycle_state": "TERMINATED", "result_state": "SUCCESS"}}
+        )
+        assert run.succeeded and run.state == "SUCCESS"
+        assert {r.run_id for r in tracker.pending()} == {1, 2}
+        tracker.mark_fetched(run)
+        assert [r.run_id for r in tracker.pending()] == [2]
+
+        other = tracker.runs()[0]
+        other = tracker.update(
+            other, {"state": {"life_cycle_state": "INTERNAL_ERROR", "result_state": "FAILED"}}
+        )
+        assert other.finished and not other.succeeded
+        assert tracker.pending() == []
@@ -0,0 +1,81 @@
+import os
+from pathlib import Path
+import sys
+from textwrap import dedent
+
+import pytest
+
+from mozreport.rworker import (
+    SENTINEL,
+    RWorker,
+    RWorkerException,
+    required_packages,
+    wait_for_changes,
+)
+
+# Stands in for R: echoes each command it receives, and fails the ones that call stop()
+FAKE_R = dedent(f"""\
+    import sys
+    for line in sys.stdin:
+        if line.startswith("quit("):
+            break
+        print("received", len(line))
+        print("{SENTINEL}", "error" if "stop(" in line else "ok", flush=True)
+""")
+
+
+@pytest.fixture
+def worker():
+    echoed = []
+    with RWorker([sys.executable, "-c", FAKE_R], echo=echoed.append) as worker:
+        worker.echoed = echoed
+        yield worker
+
+
+class TestRWorker:
+    def test_run(self, worker):
+        assert worker.run("x <- 1\nprint(x)")
+        assert not worker.run('stop("oops")')
+        assert worker.render(Path("report.Rmd"))
+        assert len(worker.echoed) == 3
+        assert all(e.startswith("received") for e in worker.echoed)
+
+    def test_commands_are_one_line(self, worker):
+        worker.run('cat("a\\nb")\nprint(2)')
+        # One command, so one "received" line, despite the embedded newlines
+        assert len(worker.echoed) == 1
+
+    def test_dead_session(self):
+        worker = RWorker([sys.executable, "-c", "pass"])
+        worker.process.wait()
+        with pytest.raises(RWorkerException):
+            worker.run("1")
+        worker.close()
+
+
+class TestHelpers:
+    def test_required_packages(self, tmpdir):
+        report = Path(tmpdir)/"report.Rmd"
+        report.write_text("library(dplyr)\nlibrary(RSQLite)\nx <- library(dplyr)\n")
+        assert required_packages(report) == ["RSQLite", "dplyr"]
+
+    def test_wait_for_changes(self, tmpdir):
+        tmpdir = Path(tmpdir)
+        watched = tmpdir/"report.Rmd"
+        missing = tmpdir/"summary.sqlite3"
+        watched.write_text("one")
+
+        def sleep(interval):
+            sleep.calls += 1
+            if sleep.calls == 2:
+                watched.write_text("two")
+                stat = watched.stat()
+                os.utime(watched, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            if sleep.calls == 3:
+                missing.write_text("data")
+        sleep.calls = 0
+
+        changes = wait_for_changes([watched, missing], sleep=sleep)
+        assert next(changes) == [watched]
+        assert next(changes) == [missing]
+        assert sleep.calls == 3
@@ -0,0 +1,131 @@
+from io import BytesIO
+import json
+from pathlib import Path
+import sqlite3
+
+import pytest
+
+from mozreport.databricks import Client
+from mozreport.experiment import fetch_shards
+from mozreport.query import open_summary
+from mozreport.shards import SHARD_MANIFEST, branches, open_result, read_manifest, select_shards
+
+
+def write_database(path, rows):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path))
+    conn.execute("CREATE TABLE summary (branch TEXT, metric_name TEXT, stat_value REAL)")
+    conn.execute(
+        "CREATE TABLE per_user_daily_averages ("
+        "client_id TEXT, experiment_branch TEXT, normalized_channel TEXT, days_active INTEGER)"
+    )
+    conn.executemany("INSERT INTO per_user_daily_averages VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def write_sharded(directory, keys, count=2):
+    """A result like the ETL script's sharded formats write, with `count` clients per shard."""
+    groups = [("control", "release"), ("control", None), ("treatment", "release")]
+    if "normalized_channel" not in keys:
+        groups = [("control", "release"), ("treatment", "release")]
+    write_database(directory/"summary.sqlite3", [])
+    shards = []
+    for i, (branch, channel) in enumerate(groups):
+        rows = [(f"c{i}-{j}", branch, channel, j) for j in range(count)]
+        path = f"shards/{i:03d}-{branch}.sqlite3"
+        write_database(directory/path, rows)
+        shard = {"path": path, "rows": count, "experiment_branch": branch}
+        if "normalized_channel" in keys:
+            shard["normalized_channel"] = channel
+        shards.append(shard)
+    manifest = {"table": "per_user_daily_averages", "keys": keys, "shards": shards}
+    (directory/SHARD_MANIFEST).write_text(json.dumps(manifest))
+    return manifest
+
+
+def count_by_branch(conn):
+    return conn.execute(
+        "SELECT experiment_branch, COUNT(*) FROM per_user_daily_averages "
+        "GROUP BY 1 ORDER BY 1"
+    ).fetchall()
+
+
+class TestShards:
+    def test_select_shards(self, tmpdir):
+        by_channel = write_sharded(Path(tmpdir)/"a", ["experiment_branch", "normalized_channel"])
+        assert len(select_shards(by_channel)) == 3
+        assert len(select_shards(by_channel, branches=["control"])) == 2
+        assert len(select_shards(by_channel, channels=[None])) == 1
+        by_branch = write_sharded(Path(tmpdir)/"b", ["experiment_branch"])
+        assert len(select_shards(by_branch, channels=["release"])) == 2
+        assert read_manifest(Path(tmpdir)) is None
+
+    def test_open_result(self, tmpdir):
+        directory = Path(tmpdir)
+        write_sharded(directory, ["experiment_branch", "normalized_channel"])
+        path = directory/"summary.sqlite3"
+        assert branches(path) == ["control", "treatment"]
+        assert count_by_branch(open_result(path)) == [("control", 4), ("treatment", 2)]
+        conn = open_result(path, branches=["control"], channels=[None])
+        assert count_by_branch(conn) == [("control", 2)]
+        assert conn.execute("PRAGMA database_list").fetchall()[-1][1] == "shard0"
+        with pytest.raises(ValueError):
+            open_result(path, branches=["missing"])
+
+    def test_open_summary(self, tmpdir):
+        directory = Path(tmpdir)
+        write_sharded(directory, ["experiment_branch"])
+        conn = open_summary(directory/"summary.sqlite3", branches=["treatment"])
+        assert conn.execute("SELECT experiment_branch, clients FROM branch_means").fetchall() == [
+            ("treatment", 2),
+        ]
+        # The shards are only read
+        shard = sqlite3.connect(str(directory/"shards"/"001-treatment.sqlite3"))
+        assert not shard.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+
+    def test_unsharded_filter(self, tmpdir):
+        path = Path(tmpdir)/"summary.sqlite3"
+        write_database(path, [("a", "control", "beta", 1), ("b", "treatment", None, 1)])
+        assert branches(path) == ["control", "treatment"]
+        conn = open_result(path, channels=[None])
+        assert count_by_branch(conn) == [("treatment", 1)]
+
+    def test_too_many_shards(self, tmpdir):
+        directory = Path(tmpdir)
+        manifest = write_sharded(directory, ["experiment_branch"])
+        manifest["shards"] = [manifest["shards"][0]] * 11 + [manifest["shards"][1]]
+        (directory/SHARD_MANIFEST).write_text(json.dumps(manifest))
+        # More than SQLite can attach at once are copied in batches, when first read
+        conn = open_summary(directory/"summary.sqlite3")
+        assert conn.execute("SELECT COUNT(*) FROM summary").fetchone() == (0,)
+        assert not conn.filled
+        assert conn.execute("SELECT SUM(clients) FROM branch_means").fetchone() == (24,)
+        assert conn.filled
+        assert count_by_branch(conn) == [("control", 22), ("treatment", 2)]
+        assert [r[1] for r in conn.execute("PRAGMA database_list")] == ["main", "temp"]
+        conn = open_result(directory/"summary.sqlite3", branches=["treatment"])
+        assert count_by_branch(conn.cursor()) == [("treatment", 2)]
+
+
+class TestFetchShards:
+    def test_fetch_shards(self, emulator, tmpdir):
+        client = Client(emulator.config)
+        remote = Path(tmpdir)/"remote"
+        manifest = write_sharded(remote, ["experiment_branch"])
+        for shard in manifest["shards"]:
+            contents = (remote/shard["path"]).read_bytes()
+            client.upload_file(BytesIO(contents), "/work/" + shard["path"])
+        local = Path(tmpdir)/"local"
+        local.mkdir()
+        assert fetch_shards(client, "/work", local) == []
+
+        client.upload_file(BytesIO(json.dumps(manifest).encode("utf-8")), "/work/shards.json")
+        paths = fetch_shards(client, "/work", local)
+        assert [p.relative_to(local).as_posix() for p in paths] == [
+            s["path"] for s in manifest["shards"]
+        ]
+        assert read_manifest(local) == manifest
+        assert (local/"shards"/"000-control.sqlite3").read_bytes() == (
+            remote/"shards"/"000-control.sqlite3"
+        ).read_bytes()
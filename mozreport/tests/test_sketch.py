@@ -0,0 +1,73 @@
+import random
+import sqlite3
+
+import pytest
+
+from mozreport.sketch import Sketch, metrics, read_sketches
+
+
+def exact_quantile(values, q):
+    # The same rank convention as Sketch.quantile
+    return sorted(values)[int(q * (len(values) - 1))]
+
+
+class TestSketch:
+    def test_quantiles_are_accurate(self):
+        rng = random.Random(0)
+        values = [rng.lognormvariate(3, 2) for _ in range(10000)] + [0.0] * 100
+        values += [-rng.expovariate(1) for _ in range(500)]
+        sketch = Sketch(relative_accuracy=0.01)
+        for v in values:
+            sketch.add(v)
+        assert sketch.count == len(values)
+        assert len(sketch.buckets) < 2000
+        for q in (0, 0.01, 0.05, 0.1, 0.5, 0.9, 0.99, 1):
+            exact = exact_quantile(values, q)
+            assert sketch.quantile(q) == pytest.approx(exact, rel=0.01, abs=1e-12)
+
+    def test_merge(self):
+        rng = random.Random(1)
+        values = [rng.uniform(0, 100) for _ in range(2000)]
+        one, other, both = Sketch(), Sketch(), Sketch()
+        for i, v in enumerate(values):
+            (one if i % 2 else other).add(v)
+            both.add(v)
+        assert one.merge(other) == both
+        assert Sketch().quantile(0.5) is None
+        with pytest.raises(ValueError):
+            one.merge(Sketch(relative_accuracy=0.05))
+
+    def test_read_sketches(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute(
+            "CREATE TABLE quantile_sketches (experiment_branch TEXT, normalized_channel TEXT, "
+            "metric TEXT, sign INTEGER, bucket INTEGER, count INTEGER)"
+        )
+        conn.execute("CREATE TABLE etl_metadata (name TEXT, value TEXT)")
+        conn.execute("INSERT INTO etl_metadata VALUES ('sketch_relative_accuracy', '0.02')")
+        expected = {}
+        for branch, channel, values in [
+            ("control", "release", range(1, 101)),
+            ("control", "beta", range(101, 201)),
+            ("treatment", None, range(1, 1001)),
+        ]:
+            sketch = Sketch(relative_accuracy=0.02)
+            for v in values:
+                sketch.add(v)
+            conn.executemany(
+                "INSERT INTO quantile_sketches VALUES (?, ?, 'active_ticks', ?, ?, ?)",
+                [(branch, channel, s, b, c) for (s, b), c in sketch.buckets.items()],
+            )
+            expected[branch] = expected.get(branch, Sketch(0.02)).merge(sketch)
+
+        assert metrics(conn) == ["active_ticks"]
+        by_branch = read_sketches(conn, "active_ticks")
+        assert by_branch == {(b,): s for b, s in expected.items()}
+        assert by_branch[("control",)].quantile(0.5) == pytest.approx(100, rel=0.02)
+        by_channel = read_sketches(
+            conn, "active_ticks", by=["experiment_branch", "normalized_channel"]
+        )
+        assert set(by_channel) == {("control", "release"), ("control", "beta"), ("treatment", None)}
+        assert read_sketches(conn, "no_such_metric") == {}
+        with pytest.raises(ValueError):
+            read_sketches(conn, "active_ticks", by=["client_id"])
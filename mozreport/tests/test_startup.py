@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Modules that `mozreport --help` shouldn't need
+HEAVY_MODULES = ["cattr", "halo", "numpy", "requests", "toml"]
+
+# Cumulative import time budget for mozreport.cli, in milliseconds.
+# The slow modules above cost about 100 ms on their own.
+IMPORT_BUDGET_MS = float(os.environ.get("MOZREPORT_IMPORT_BUDGET_MS", 100))
+
+
+def cli_import_time_ms() -> float:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import mozreport.cli"],
+        stderr=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    )
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == "mozreport.cli":
+            return int(fields[1]) / 1000
+    raise AssertionError("mozreport.cli missing from importtime output")
+
+
+class TestStartup:
+    def test_cli_import_is_lazy(self):
+        script = "import sys, mozreport.cli; print(' '.join(sys.modules))"
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            stdout=subprocess.PIPE,
+            check=True,
+            universal_newlines=True,
+        )
+        loaded = set(result.stdout.split())
+        assert not loaded.intersection(HEAVY_MODULES)
+
+    # Wall-clock budgets are flaky on shared CI machines, so this is opt-in
+    @pytest.mark.timing
+    @pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime needs Python 3.7")
+    def test_cli_import_time(self):
+        # Best of three, to ride out a noisy machine
+        elapsed = min(cli_import_time_ms() for _ in range(3))
+        assert elapsed < IMPORT_BUDGET_MS
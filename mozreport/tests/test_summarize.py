@@ -0,0 +1,109 @@
+import hashlib
+from pathlib import Path
+import random
+import sqlite3
+
+import numpy as np
+import pytest
+
+from mozreport.summarize import ColumnSummary, as_cursor, rowid_ranges, summarize
+from mozreport.tests.test_shards import write_sharded
+
+
+@pytest.fixture
+def summary_path(tmpdir):
+    rng = random.Random(0)
+    path = Path(tmpdir)/"summary.sqlite3"
+    conn = sqlite3.connect(str(path))
+    conn.execute(
+        "CREATE TABLE per_user_daily_averages ("
+        "client_id TEXT, experiment_branch TEXT, normalized_channel TEXT, "
+        "days_active INTEGER, active_ticks REAL)"
+    )
+    rows = [
+        (f"client{i}", branch, channel, rng.randint(1, 28), rng.lognormvariate(5, 1))
+        for branch in ("control", "treatment")
+        for channel in ("release", "beta", None)
+        for i in range(1000)
+    ]
+    rows.append(("clientX", "treatment", "release", 2, None))
+    conn.executemany("INSERT INTO per_user_daily_averages VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def exact(path, branch, column):
+    conn = sqlite3.connect(str(path))
+    values = [r[0] for r in conn.execute(
+        f"SELECT {column} FROM per_user_daily_averages "
+        f"WHERE experiment_branch = ? AND {column} IS NOT NULL",
+        (branch,),
+    )]
+    return np.array(values, dtype=float)
+
+
+class TestSummarize:
+    def test_batches_merge_exactly(self):
+        rng = np.random.default_rng(0)
+        values = rng.normal(1e6, 1, 10001)
+        edges = np.linspace(values.min(), values.max(), 11)
+        whole, one, other = (ColumnSummary(edges) for _ in range(3))
+        whole.update(values)
+        for batch in np.array_split(values[:5000], 7):
+            one.update(batch)
+        other.update(values[5000:])
+        merged = one.merge(other)
+        for s in (whole, merged):
+            assert s.count == len(values)
+            assert s.mean == pytest.approx(values.mean(), rel=1e-12)
+            assert s.variance == pytest.approx(values.var(ddof=1), rel=1e-9)
+            assert s.histogram.sum() == len(values)
+        assert (merged.histogram == whole.histogram).all()
+        assert merged.minimum == values.min() and merged.maximum == values.max()
+        with pytest.raises(ValueError):
+            one.merge(ColumnSummary(edges[:5]))
+
+    @pytest.mark.parametrize("processes", [1, 2])
+    def test_summarize(self, summary_path, processes):
+        summaries = summarize(
+            summary_path, by=["experiment_branch"], batch_size=100, processes=processes,
+        )
+        assert sorted(summaries) == [("control",), ("treatment",)]
+        for (branch,), per_column in summaries.items():
+            assert list(per_column) == ["days_active", "active_ticks"]
+            for column, s in per_column.items():
+                values = exact(summary_path, branch, column)
+                assert s.count == len(values)
+                assert s.mean == pytest.approx(values.mean())
+                assert s.variance == pytest.approx(values.var(ddof=1))
+                assert (s.minimum, s.maximum) == (values.min(), values.max())
+                assert s.histogram.sum() == len(values)
+        assert summaries[("treatment",)]["days_active"].count == 3001
+        # The ranges of rows that are summarized in parallel cover every row once
+        assert rowid_ranges(summary_path, 4) == [
+            (1, 1502), (1502, 3003), (3003, 4504), (4504, 6005),
+        ]
+
+    def test_by_channel(self, summary_path):
+        digest = hashlib.sha256(summary_path.read_bytes()).hexdigest()
+        # Batches that span channels are split between them
+        summaries = summarize(summary_path, batch_size=700, processes=1)
+        assert len(summaries) == 6
+        assert summaries[("control", None)]["days_active"].count == 1000
+        assert summaries[("treatment", "release")]["days_active"].count == 1001
+        # The result is only read; it can be a hard link into the result cache
+        assert hashlib.sha256(summary_path.read_bytes()).hexdigest() == digest
+        rows = as_cursor(summaries).fetchall()
+        assert rows[0][:4] == ("control", None, "days_active", 1000)
+        with pytest.raises(ValueError):
+            summarize(summary_path, by=["client_id"])
+
+    def test_sharded(self, tmpdir):
+        directory = Path(tmpdir)
+        write_sharded(directory, ["experiment_branch", "normalized_channel"], count=5)
+        summaries = summarize(directory/"summary.sqlite3", processes=2)
+        assert sorted(summaries, key=str) == [
+            ("control", "release"), ("control", None), ("treatment", "release"),
+        ]
+        assert summaries[("control", None)]["days_active"].mean == 2
@@ -0,0 +1,65 @@
+from io import BytesIO
+import os
+from pathlib import Path
+import time
+
+import pytest
+
+from mozreport.databricks import Client
+from mozreport.sync import delete_all, stale_directories, sync_down, sync_up
+
+
+@pytest.fixture
+def client(emulator):
+    return Client(emulator.config)
+
+
+class TestSync:
+    def test_list_dir(self, client):
+        client.upload_file(BytesIO(b"a"), "/root/a")
+        client.upload_file(BytesIO(b"bb"), "/root/sub/b")
+        assert [e["path"] for e in client.list_dir("/root")] == ["/root/a", "/root/sub"]
+        entries = client.list_dir("/root", recursive=True)
+        assert sorted(e["path"] for e in entries) == ["/root/a", "/root/sub", "/root/sub/b"]
+
+    def test_sync_round_trip(self, client, tmpdir):
+        source, destination = Path(tmpdir.mkdir("source")), Path(tmpdir.mkdir("destination"))
+        (source/"nested").mkdir()
+        (source/"summary.sqlite3").write_bytes(b"summary")
+        (source/"nested"/"shard").write_bytes(b"shard")
+        assert sync_up(client, source, "/work") == ["nested/shard", "summary.sqlite3"]
+        assert sync_up(client, source, "/work") == []
+        assert sync_down(client, "/work", destination) == ["nested/shard", "summary.sqlite3"]
+        assert (destination/"nested"/"shard").read_bytes() == b"shard"
+        assert sync_down(client, "/work", destination) == []
+
+        (source/"summary.sqlite3").write_bytes(b"new summary")
+        assert sync_up(client, source, "/work") == ["summary.sqlite3"]
+        assert sync_down(client, "/work", destination) == ["summary.sqlite3"]
+        assert (destination/"summary.sqlite3").read_bytes() == b"new summary"
+
+    def test_sync_down_same_size(self, client, tmpdir):
+        destination = Path(tmpdir.mkdir("destination"))
+        client.upload_file(BytesIO(b"version-1"), "/work/file")
+        assert sync_down(client, "/work", destination) == ["file"]
+        client.upload_file(BytesIO(b"version-2"), "/work/file", overwrite=True)
+        # Rewritten later, but at the same size
+        remote = tmpdir.join("dbfs", "work", "file")
+        os.utime(str(remote), (time.time() + 10, time.time() + 10))
+        assert sync_down(client, "/work", destination) == ["file"]
+        assert (destination/"file").read_bytes() == b"version-2"
+        assert sync_down(client, "/work", destination) == []
+
+    def test_sync_missing_directory(self, client, tmpdir):
+        assert sync_down(client, "/missing", Path(tmpdir)) == []
+
+    def test_stale_directories(self, client, emulator, tmpdir):
+        for name in ("old", "new"):
+            client.upload_file(BytesIO(b"x"), f"/mozreport/{name}/deep/file")
+        old = tmpdir.join("dbfs", "mozreport", "old", "deep", "file")
+        os.utime(str(old), (0, 0))
+        assert stale_directories(client, "/mozreport", time.time() - 60) == ["/mozreport/old"]
+        assert stale_directories(client, "/missing", time.time()) == []
+        delete_all(client, ["/mozreport/old"])
+        assert not client.file_exists("/mozreport/old")
+        assert client.file_exists("/mozreport/new")
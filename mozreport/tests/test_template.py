@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 import pytest
@@ -19,6 +20,36 @@ class TestTemplate:
         assert "rmarkdown" in names
         assert "spam" in names
 
+    def test_metadata(self, tmpdir):
+        tmpdir = Path(tmpdir)
+        template = [t for t in Template.find_all() if t.name == "rmarkdown"][0]
+        assert template.description
+        assert "RSQLite" in template.r_packages
+        assert "html_document" in template.output_formats
+        template.emplace(tmpdir)
+        assert not (tmpdir/"template.toml").exists()
+
+    def test_find_all_uses_index(self, tmpdir, monkeypatch):
+        tmpdir = Path(tmpdir)
+        (tmpdir/"templates"/"spam").mkdir(parents=True)
+        first = Template.find_all(tmpdir)
+        assert (tmpdir/"template_index.json").exists()
+
+        def iterdir(self):
+            raise AssertionError("The index should have been used")
+
+        with monkeypatch.context() as m:
+            m.setattr(Path, "iterdir", iterdir)
+            assert Template.find_all(tmpdir) == first
+
+        (tmpdir/"templates"/"spam"/"template.toml").write_text('description = "Spam"\n')
+        spam = [t for t in Template.find_all(tmpdir) if t.name == "spam"][0]
+        assert spam.description == "Spam"
+
+        (tmpdir/"templates"/"eggs").mkdir()
+        names = [t.name for t in Template.find_all(tmpdir)]
+        assert "eggs" in names
+
     def test_emplace(self, tmpdir):
         tmpdir = Path(tmpdir)
         template = [t for t in Template.find_all() if t.name == "rmarkdown"][0]
@@ -42,3 +73,34 @@ class TestTemplate:
         template = [t for t in Template.find_all(tmpdir) if t.name == "spam"][0]
         template.emplace(tmpdir)
         assert (tmpdir/"eggs"/"camelot").exists()
+
+    def test_emplace_incremental(self, tmpdir):
+        tmpdir = Path(tmpdir)
+        source = tmpdir/"templates"/"spam"
+        source.mkdir(parents=True)
+        (source/"report.txt").write_text("Made with MOZREPORT_VERSION")
+        (source/"logo.png").write_bytes(bytes(range(256)) * 4096)
+        target = tmpdir/"target"
+        target.mkdir()
+
+        template = [t for t in Template.find_all(tmpdir) if t.name == "spam"][0]
+        template.emplace(target, max_workers=2)
+        assert (target/"logo.png").read_bytes() == (source/"logo.png").read_bytes()
+        assert "MOZREPORT_VERSION" not in (target/"report.txt").read_text()
+
+        # Local edits are newer than the template, so they're kept
+        (target/"report.txt").write_text("My edits")
+        template.emplace(target, overwrite=False, incremental=True)
+        assert (target/"report.txt").read_text() == "My edits"
+
+        # ...until the template changes
+        (target/"logo.png").unlink()
+        stat = (target/"report.txt").stat()
+        os.utime(source/"report.txt", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        with pytest.raises(FileExistsError) as e:
+            template.emplace(target, overwrite=False, incremental=True)
+        assert "report.txt" in str(e.value)
+        assert not (target/"logo.png").exists()
+        template.emplace(target, incremental=True)
+        assert (target/"report.txt").read_text() != "My edits"
+        assert (target/"logo.png").exists()
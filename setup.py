@@ -2,11 +2,13 @@ from setuptools import setup
 
 test_deps = [
     "coverage",
+    "numpy",
     "pytest-cov",
     "pytest",
 ]
 
 extras = {
+    "summarize": ["numpy"],
     "testing": test_deps,
 }
 